@@ -1,7 +1,7 @@
 """ fslutils package
 """
 
-from .fsf import FSF
+from .fsf import FSF, LazyFSF, CompactFSF
 from . import fsf
 
 from ._version import get_versions
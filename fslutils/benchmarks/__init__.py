@@ -0,0 +1,8 @@
+""" Benchmarks for fslutils
+
+Run a benchmark module directly, for example::
+
+    python -m fslutils.benchmarks.bench_featparser
+
+Each ``bench_*`` function prints its own timings.
+"""
@@ -0,0 +1,42 @@
+""" Benchmarks for parse caches
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_cache
+"""
+
+from os.path import join as pjoin
+import shutil
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.fsf import load
+from fslutils import matfile
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def bench_sidecar(repeat=20):
+    with TemporaryDirectory() as tmpdir:
+        for basename in ('two_sess_mid.fsf', 'one_sess_level1.mat'):
+            shutil.copy(pjoin(DATA_DIR, basename), pjoin(tmpdir, basename))
+        rng = np.random.RandomState(1966)
+        matfile.save(rng.normal(size=(2000, 20)),
+                     pjoin(tmpdir, 'large.mat'))
+        for basename, loader in (('two_sess_mid.fsf', load),
+                                 ('one_sess_level1.mat', matfile.load),
+                                 ('large.mat', matfile.load)):
+            fname = pjoin(tmpdir, basename)
+            loader(fname, cache=True)  # Write sidecar
+            print_title('Sidecar cache: {} ({} runs)'.format(basename,
+                                                             repeat))
+            t_parse = timeit(lambda: loader(fname), number=repeat)
+            t_cache = timeit(lambda: loader(fname, cache=True), number=repeat)
+            print_timings('parse', t_parse)
+            print_timings('sidecar', t_cache, t_parse)
+
+
+if __name__ == '__main__':
+    bench_sidecar()
@@ -0,0 +1,53 @@
+""" Benchmarks for cohort tables
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_cohort
+"""
+
+from os.path import join as pjoin
+import tracemalloc
+
+from fslutils.supporting import read_file
+from fslutils.fsf import FSF
+from fslutils.cohort import cohort_table
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title
+
+QC_FIELDS = ['level', 'npts', 'tr', 'smooth', 'z_thresh', 'paradigm_hp',
+             'mc', 'robust_yn', 'mixed_yn', 'motionevs']
+
+
+def _allocated(func):
+    # Return result of `func` and memory allocated for result
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_cohort_memory(n_designs=2000):
+    contents = read_file(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    fsfs = [FSF(contents) for i in range(n_designs)]
+    # Make distinct values, as for real cohort.
+    for i, fsf in enumerate(fsfs):
+        fsf.fmri['npts'] = 200 + i
+        fsf.fmri['smooth'] = i / 10.
+    n_cells = n_designs * len(QC_FIELDS)
+    print_title('Memory for {} QC fields, {} designs'.format(
+        len(QC_FIELDS), n_designs))
+    # Values are shared with the FSF objects, so we only measure containers.
+    rows, dict_bytes = _allocated(
+        lambda: [{name: fsf.fmri[name] for name in QC_FIELDS}
+                 for fsf in fsfs])
+    cohort_table(fsfs[:2], QC_FIELDS)  # Warm up
+    table, table_bytes = _allocated(lambda: cohort_table(fsfs, QC_FIELDS))
+    for label, n_bytes in (('list of dicts', dict_bytes),
+                           ('cohort_table', table_bytes)):
+        print('{:<40s}{:10.1f} bytes / cell'.format(label,
+                                                    n_bytes / n_cells))
+
+
+if __name__ == '__main__':
+    bench_cohort_memory()
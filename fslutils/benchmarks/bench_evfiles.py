@@ -0,0 +1,48 @@
+""" Benchmarks for reading custom EV files
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_evfiles
+"""
+
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.evfiles import EVReader
+
+from fslutils.benchmarks.butils import print_title, print_timings
+
+
+def bench_read_many(n_files=1000, n_refs=4000, n_events=40, workers=8):
+    rng = np.random.RandomState(1966)
+    print_title('Read {} EV file references to {} files'.format(n_refs,
+                                                                n_files))
+    with TemporaryDirectory() as tmpdir:
+        fnames = []
+        for i in range(n_files):
+            fname = pjoin(tmpdir, 'ev{:05d}.txt'.format(i))
+            np.savetxt(fname, np.column_stack(
+                [np.sort(rng.uniform(0, 400, n_events)),
+                 rng.uniform(0.5, 4, n_events),
+                 np.ones(n_events)]), fmt='%.3f')
+            fnames.append(fname)
+        # Designs share timing files, as for subjects with the same
+        # paradigm.
+        refs = [fnames[i] for i in rng.randint(0, n_files, size=n_refs)]
+        t_loop = timeit(lambda: [np.loadtxt(fname, ndmin=2)
+                                 for fname in refs], number=1)
+        t_many = timeit(lambda: EVReader().read_many(refs, workers),
+                        number=1)
+        reader = EVReader()
+        reader.read_many(refs, workers)
+        t_cached = timeit(lambda: reader.read_many(refs, workers), number=1)
+    print_timings('loadtxt for each reference', t_loop)
+    print_timings('read_many, new reader', t_many, t_loop)
+    print_timings('read_many, cached files', t_cached, t_loop)
+
+
+if __name__ == '__main__':
+    bench_read_many()
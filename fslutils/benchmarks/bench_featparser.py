@@ -0,0 +1,88 @@
+""" Benchmarks for FSF design parsing
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_featparser
+"""
+
+from os.path import join as pjoin
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.supporting import read_file
+from fslutils.featparser import (fsf_to_dict, _fsf_to_dict_lines,
+                                 _infer_converter, _CONVERTERS,
+                                 _CONVERTER_REGEXPS, _DEF_ALL_RE,
+                                 mat_to_dict, _mat_to_dict_lines)
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def bench_fsf_to_dict(repeat=20):
+    for basename in ('one_sess_level1.fsf', 'two_sess_mid.fsf'):
+        contents = read_file(pjoin(DATA_DIR, basename))
+        assert fsf_to_dict(contents) == _fsf_to_dict_lines(contents)
+        print_title('fsf_to_dict: {} ({} runs)'.format(basename, repeat))
+        t_lines = timeit(lambda: _fsf_to_dict_lines(contents), number=repeat)
+        t_buffer = timeit(lambda: fsf_to_dict(contents), number=repeat)
+        print_timings('line loop', t_lines)
+        print_timings('whole buffer', t_buffer, t_lines)
+
+
+def _linear_converter(field_name):
+    # Converter lookup by searching regexps in turn.
+    if field_name in _CONVERTERS:
+        return _CONVERTERS[field_name]
+    for regexp, converter in _CONVERTER_REGEXPS:
+        if regexp.search(field_name) is not None:
+            return converter
+    return str
+
+
+def bench_infer_converter(repeat=20):
+    contents = read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    field_names = [field for top_name, field, value
+                   in _DEF_ALL_RE.findall(contents) if top_name == 'fmri']
+    print_title('Converter lookup: {} fields ({} runs)'.format(
+        len(field_names), repeat))
+    t_linear = timeit(lambda: [_linear_converter(f) for f in field_names],
+                      number=repeat)
+    t_dispatch = timeit(lambda: [_infer_converter(f) for f in field_names],
+                        number=repeat)
+    print_timings('regexp scan', t_linear)
+    print_timings('cached dispatch', t_dispatch, t_linear)
+
+
+def mat_contents(n_points, n_waves, seed=1966):
+    """ Return .mat file contents for random matrix, FEAT format
+    """
+    rng = np.random.RandomState(seed)
+    matrix = rng.normal(size=(n_points, n_waves))
+    lines = ['/NumWaves\t{}'.format(n_waves),
+             '/NumPoints\t{}'.format(n_points),
+             '/PPheights\t\t' + '\t'.join(
+                 '{:e}'.format(v) for v in np.ptp(matrix, axis=0)),
+             '',
+             '/Matrix']
+    lines += ['\t'.join('{:e}'.format(v) for v in row) + '\t'
+              for row in matrix]
+    return '\n'.join(lines) + '\n'
+
+
+def bench_mat_to_dict(repeat=10):
+    for label, contents in (
+        ('one_sess_level1.mat', read_file(pjoin(DATA_DIR,
+                                                'one_sess_level1.mat'))),
+        ('random 5000 x 40', mat_contents(5000, 40))):
+        print_title('mat_to_dict: {} ({} runs)'.format(label, repeat))
+        t_lines = timeit(lambda: _mat_to_dict_lines(contents), number=repeat)
+        t_bulk = timeit(lambda: mat_to_dict(contents), number=repeat)
+        print_timings('line loop', t_lines)
+        print_timings('bulk numeric', t_bulk, t_lines)
+
+
+if __name__ == '__main__':
+    bench_fsf_to_dict()
+    bench_infer_converter()
+    bench_mat_to_dict()
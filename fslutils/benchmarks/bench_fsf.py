@@ -0,0 +1,199 @@
+""" Benchmarks for FSF objects
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_fsf
+"""
+
+import os
+from os.path import join as pjoin
+import shutil
+import asyncio
+import time
+from glob import glob
+import tracemalloc
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+from fslutils.supporting import read_file
+from fslutils.featparser import fsf_to_dict
+from fslutils.fsf import (FSF, LazyFSF, CompactFSF, END_NO, load, load_many,
+                          aload_many, dumps, loads)
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def bench_matrix_properties(repeat=5):
+    contents = read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    print_title('Load and read evgs, contrasts: two_sess_mid.fsf '
+                '({} runs)'.format(repeat))
+
+    def load_read(arrays):
+        fsf = FSF(contents, arrays=arrays)
+        return fsf.evgs, fsf.contrasts_real, fsf.groupmem
+
+    t_fields = timeit(lambda: load_read(False), number=repeat)
+    t_arrays = timeit(lambda: load_read(True), number=repeat)
+    print_timings('from fields', t_fields)
+    print_timings('arrays mode', t_arrays, t_fields)
+
+
+def group_design(n_subjects, n_evs=2):
+    """ Return FSF string for group design with `n_subjects`, `n_evs`
+    """
+    lines = ['set fmri(version) 6.00', 'set fmri(level) 2',
+             'set fmri(npts) {}'.format(n_subjects),
+             'set fmri(evs_orig) {}'.format(n_evs),
+             'set fmri(ncon_real) {}'.format(n_evs)]
+    for i in range(1, n_subjects + 1):
+        lines.append('set feat_files({0}) "/data/sub-{0}.feat"'.format(i))
+        lines.append('set fmri(groupmem.{}) 1'.format(i))
+        for j in range(1, n_evs + 1):
+            lines.append('set fmri(evg{}.{}) {}'.format(i, j, i * j))
+    for i in range(1, n_evs + 1):
+        lines.append('set fmri(evtitle{0}) "EV {0}"'.format(i))
+        lines.append('set fmri(conname_real.{0}) "Contrast {0}"'.format(i))
+        for j in range(1, n_evs + 1):
+            lines.append('set fmri(con_real{}.{}) {}'.format(
+                i, j, float(i == j)))
+    return '\n'.join(lines) + '\n'
+
+
+class ScanFSF(FSF):
+    """ FSF finding numbered values by scanning all keys
+    """
+
+    def invalidate(self):
+        self._cache = {}
+
+    def _numbered_vals(self, prefix):
+        fsfd = self.fmri
+        keys = [k for k in fsfd if k.startswith(prefix)]
+        return [fsfd[k] for k in sorted(
+            keys, key=lambda k: int(END_NO.search(k).group(1)))]
+
+
+def bench_numbered_vals(repeat=3):
+    contents = group_design(1000)
+    print_title('evgs, contrasts, groupmem: 1000 subject design '
+                '({} runs)'.format(repeat))
+    fsf_dict = fsf_to_dict(contents)
+
+    def read_props(klass):
+        # New object for each run, so the properties are not yet cached.
+        fsf = klass._from_parsed(contents, fsf_dict)
+        return fsf.evgs, fsf.contrasts_real, fsf.groupmem
+
+    t_scan = timeit(lambda: read_props(ScanFSF), number=repeat)
+    t_index = timeit(lambda: read_props(FSF), number=repeat)
+    print_timings('scan all keys', t_scan)
+    print_timings('numbered index', t_index, t_scan)
+
+
+def bench_lazy(repeat=20):
+    contents = read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    print_title('Load and read outputdir, level, feat_files: '
+                'two_sess_mid.fsf ({} runs)'.format(repeat))
+
+    def load_read(klass):
+        fsf = klass(contents)
+        return fsf.fmri['outputdir'], fsf.fmri['level'], fsf.feat_files
+
+    t_fsf = timeit(lambda: load_read(FSF), number=repeat)
+    t_lazy = timeit(lambda: load_read(LazyFSF), number=repeat)
+    print_timings('FSF', t_fsf)
+    print_timings('LazyFSF', t_lazy, t_fsf)
+
+
+def bench_load_many(n_dirs=200, workers=4):
+    with TemporaryDirectory() as tmpdir:
+        paths = []
+        for i in range(n_dirs):
+            feat_dir = pjoin(tmpdir, 'sub-{:04d}.feat'.format(i))
+            os.mkdir(feat_dir)
+            shutil.copy(pjoin(DATA_DIR, 'two_sess_mid.fsf'),
+                        pjoin(feat_dir, 'design.fsf'))
+            paths.append(feat_dir)
+        print_title('Load {} x two_sess_mid.fsf, {} workers'.format(
+            n_dirs, workers))
+        t_loop = timeit(lambda: [load(p) for p in paths], number=1)
+        t_pool = timeit(lambda: load_many(paths, workers=workers), number=1)
+        print_timings('loop over load', t_loop)
+        print_timings('load_many', t_pool, t_loop)
+
+
+def latency_reader(latency):
+    """ Return file reader function that waits `latency` seconds first
+    """
+    def read(fname):
+        time.sleep(latency)
+        return read_file(fname)
+    return read
+
+
+def bench_aload_many(n_files=100, latency=0.02, limit=16):
+    fname = pjoin(DATA_DIR, 'one_sess_level1.fsf')
+    paths = [fname] * n_files
+    read = latency_reader(latency)
+    print_title('Load {} files with {}s read latency, limit {}'.format(
+        n_files, latency, limit))
+
+    def load_loop():
+        return [FSF.from_string(read(p)) for p in paths]
+
+    t_loop = timeit(load_loop, number=1)
+    t_async = timeit(
+        lambda: asyncio.run(aload_many(paths, limit=limit, read=read)),
+        number=1)
+    print_timings('loop', t_loop)
+    print_timings('aload_many', t_async, t_loop)
+
+
+def bench_memory(n_designs=20):
+    contents = read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    print_title('Memory per loaded design: two_sess_mid.fsf '
+                '({} bytes text, {} designs)'.format(len(contents), n_designs))
+    CompactFSF(contents)  # Warm up
+    for label, factory in (
+            ('FSF', lambda c: FSF(c)),
+            ('FSF, arrays', lambda c: FSF(c, arrays=True)),
+            ('CompactFSF', lambda c: CompactFSF(c)),
+            ('CompactFSF, drop contents',
+             lambda c: CompactFSF(c, keep_contents=False)),
+            ('CompactFSF, arrays, drop contents',
+             lambda c: CompactFSF(c, arrays=True, keep_contents=False))):
+        tracemalloc.start()
+        # Distinct copies of contents, as for designs read from files.
+        texts = [contents + ' ' * i for i in range(n_designs)]
+        fsfs = [factory(text) for text in texts]
+        del texts
+        n_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:<40s}{:10.0f} bytes / design'.format(label,
+                                                      n_bytes / len(fsfs)))
+        del fsfs
+
+
+def bench_round_trip(repeat=20):
+    print_title('Write, and write then read, test designs ({} runs)'.format(
+        repeat))
+    print('{:<40s}{:>10s}{:>14s}'.format('', 'dumps', 'dumps+loads'))
+    for fname in sorted(glob(pjoin(DATA_DIR, '*.fsf'))):
+        for arrays in (False, True):
+            fsf = load(fname, arrays=arrays)
+            t_dumps = timeit(lambda: dumps(fsf), number=repeat) / repeat
+            t_trip = timeit(lambda: loads(dumps(fsf), arrays),
+                            number=repeat) / repeat
+            label = os.path.basename(fname) + (' (arrays)' if arrays else '')
+            print('{:<40s}{:10.0f}{:14.0f} designs / minute'.format(
+                label, 60 / t_dumps, 60 / t_trip))
+
+
+if __name__ == '__main__':
+    bench_matrix_properties()
+    bench_numbered_vals()
+    bench_lazy()
+    bench_load_many()
+    bench_aload_many()
+    bench_memory()
+    bench_round_trip()
@@ -0,0 +1,56 @@
+""" Benchmarks for building higher-level designs
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_groupdesign
+"""
+
+from os.path import join as pjoin
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.fsf import load
+from fslutils.groupdesign import group_design, group_designs, GroupDesign
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def bench_group_designs(n_designs=2000, repeat=3):
+    fsf = load(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    design = group_design(fsf)
+    rng = np.random.RandomState(1966)
+    # Permute rows of design, keeping contrasts.
+    order = np.argsort(rng.uniform(size=(n_designs, len(design.matrix))),
+                       axis=1)
+    matrices = design.matrix[order]
+    print_title('Build {} permuted {} x {} designs ({} runs)'.format(
+        n_designs, *design.matrix.shape, repeat))
+
+    def loop():
+        designs = []
+        for matrix in matrices:
+            # As group_design, for one design at a time.
+            maxs = matrix.max(axis=0)
+            heights = maxs - matrix.min(axis=0)
+            heights[heights == 0] = np.abs(maxs[heights == 0])
+            con_regs = matrix @ design.contrasts.T
+            maxs = con_regs.max(axis=0)
+            con_heights = maxs - con_regs.min(axis=0)
+            con_heights[con_heights == 0] = np.abs(maxs[con_heights == 0])
+            designs.append(GroupDesign(matrix, heights, design.contrasts,
+                                       design.con_names, con_heights,
+                                       design.groupmem))
+        return designs
+
+    t_loop = timeit(loop, number=repeat)
+    t_stacked = timeit(
+        lambda: group_designs(matrices, design.contrasts, design.con_names,
+                              design.groupmem),
+        number=repeat)
+    print_timings('loop over designs', t_loop)
+    print_timings('group_designs', t_stacked, t_loop)
+
+
+if __name__ == '__main__':
+    bench_group_designs()
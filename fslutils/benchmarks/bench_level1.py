@@ -0,0 +1,86 @@
+""" Benchmarks for building first-level designs
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_level1
+"""
+
+from os.path import join as pjoin
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.fsf import load
+from fslutils.hrf import kernel, KernelCache
+from fslutils.level1 import level1_design, OVERSAMPLING
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def _random_ev_files(fsf, n_events, seed=1966):
+    tr, n_points = fsf.fmri['tr'], fsf.fmri['npts']
+    rng = np.random.RandomState(seed)
+    ev_files = {}
+    for ev_no in range(1, 5):
+        onsets = np.sort(rng.uniform(0, tr * n_points, size=n_events))
+        ev_files[ev_no] = np.column_stack(
+            [onsets, rng.uniform(0.5, 4, size=n_events),
+             np.ones(n_events)])
+    return ev_files
+
+
+def bench_level1(n_events=60, repeat=20):
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    tr, n_points = fsf.fmri['tr'], fsf.fmri['npts']
+    ev_files = _random_ev_files(fsf, n_events)
+    print_title('Build {} x {} level 1 design, {} events per EV '
+                '({} runs)'.format(n_points, 8, n_events, repeat))
+
+    def loop():
+        # One event and EV at a time, direct convolution.
+        tres = tr / OVERSAMPLING
+        n_hr = n_points * OVERSAMPLING
+        hrf = kernel(3, tres)
+        columns = []
+        for events in ev_files.values():
+            waveform = np.zeros(n_hr)
+            for onset, duration, amplitude in events:
+                start = int(round(onset / tres))
+                stop = max(int(round((onset + duration) / tres)), start + 1)
+                waveform[start:stop] += amplitude
+            convolved = np.convolve(waveform, hrf)[:n_hr]
+            columns.append(convolved[OVERSAMPLING // 2::OVERSAMPLING])
+        return np.column_stack(columns)
+
+    t_loop = timeit(loop, number=repeat)
+    t_design = timeit(lambda: level1_design(fsf, ev_files), number=repeat)
+    print_timings('loop, direct convolution (EVs only)', t_loop)
+    print_timings('level1_design (filtered, derivatives)', t_design, t_loop)
+
+
+def bench_kernel_cache(n_designs=100, repeat=3):
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    all_ev_files = [_random_ev_files(fsf, 60, seed) for seed in
+                    range(n_designs)]
+    print_title('Build {} level 1 designs ({} runs)'.format(n_designs,
+                                                             repeat))
+
+    def uncached():
+        for ev_files in all_ev_files:
+            level1_design(fsf, ev_files, cache=KernelCache(maxsize=0))
+
+    cache = KernelCache()
+
+    def cached():
+        for ev_files in all_ev_files:
+            level1_design(fsf, ev_files, cache=cache)
+
+    t_uncached = timeit(uncached, number=repeat)
+    t_cached = timeit(cached, number=repeat)
+    print_timings('kernels for each design', t_uncached)
+    print_timings('shared kernel cache', t_cached, t_uncached)
+
+
+if __name__ == '__main__':
+    bench_level1()
+    bench_kernel_cache()
@@ -0,0 +1,74 @@
+""" Benchmarks for reading and writing .mat files
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_matfile
+"""
+
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+import numpy as np
+
+from fslutils.supporting import read_file
+from fslutils.featparser import mat_to_dict
+from fslutils.matfile import load_mapped, save
+
+from fslutils.benchmarks.butils import print_title, print_timings
+from fslutils.benchmarks.bench_featparser import mat_contents
+
+
+def bench_load_mapped(repeat=5):
+    n_points, n_waves = 50000, 40
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'design.mat')
+        with open(fname, 'wt') as fobj:
+            fobj.write(mat_contents(n_points, n_waves))
+        print_title('Read rows 20000:21000, columns 0:2 of {} x {} '
+                    '.mat ({} runs)'.format(n_points, n_waves, repeat))
+
+        def read_full():
+            return mat_to_dict(read_file(fname))['Matrix'][20000:21000, :2]
+
+        def read_mapped():
+            matrix = load_mapped(fname)['Matrix']
+            window = matrix[20000:21000, :2]
+            matrix.close()
+            return window
+
+        t_full = timeit(read_full, number=repeat)
+        t_mapped = timeit(read_mapped, number=repeat)
+        print_timings('mat_to_dict', t_full)
+        print_timings('load_mapped', t_mapped, t_full)
+
+
+def bench_save(n_points=20000, n_waves=40, repeat=3):
+    rng = np.random.RandomState(1966)
+    matrix = rng.normal(size=(n_points, n_waves))
+    print_title('Write {} x {} .mat ({} runs)'.format(
+        n_points, n_waves, repeat))
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'design.mat')
+
+        def write_rows():
+            # Format values one row at a time, in Python.
+            with open(fname, 'wt') as fobj:
+                fobj.write('/NumWaves\t{}\n/NumPoints\t{}\n'.format(
+                    n_waves, n_points))
+                fobj.write('/PPheights\t\t' + '\t'.join(
+                    '{:e}'.format(v) for v in np.ptp(matrix, axis=0)))
+                fobj.write('\n\n/Matrix\n')
+                for row in matrix:
+                    fobj.write(
+                        '\t'.join('{:e}'.format(v) for v in row) + '\t\n')
+
+        t_rows = timeit(write_rows, number=repeat)
+        t_save = timeit(lambda: save(matrix, fname), number=repeat)
+        print_timings('row by row', t_rows)
+        print_timings('save', t_save, t_rows)
+
+
+if __name__ == '__main__':
+    bench_load_mapped()
+    bench_save()
@@ -0,0 +1,74 @@
+""" Benchmarks for parameter sweeps
+
+Run with::
+
+    python -m fslutils.benchmarks.bench_sweep
+"""
+
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+from fslutils.fsf import load, loads, dump
+from fslutils.sweep import grid, iter_variants, write_variants
+
+from fslutils.benchmarks.butils import DATA_DIR, print_title, print_timings
+
+
+def bench_write_variants(design='two_sess_mid.fsf', workers=4):
+    template = load(pjoin(DATA_DIR, design))
+    overrides = grid({'smooth': [4.0, 5.0, 6.0, 8.0],
+                      'paradigm_hp': [60.0, 90.0, 100.0, 128.0],
+                      'z_thresh': [2.3, 3.1, 3.5]})
+    print_title('Write {} variants of {}'.format(len(overrides), design))
+
+    def reparse_loop(out_dir):
+        # Parse template, set fields, write, for each variant.
+        for i, override in enumerate(overrides):
+            fsf = loads(template.contents)
+            fsf.set_fields(override)
+            dump(fsf, pjoin(out_dir, '{:04d}.fsf'.format(i)))
+
+    def copy_loop(out_dir):
+        # Copy template, set fields, write, for each variant.
+        for i, override in enumerate(overrides):
+            fsf = template.copy()
+            fsf.set_fields(override)
+            dump(fsf, pjoin(out_dir, '{:04d}.fsf'.format(i)))
+
+    with TemporaryDirectory() as tmpdir:
+        t_reparse = timeit(lambda: reparse_loop(tmpdir), number=1)
+        t_copy = timeit(lambda: copy_loop(tmpdir), number=1)
+        t_sweep = timeit(
+            lambda: write_variants(template, overrides,
+                                   pjoin(tmpdir, '{index:04d}.fsf'),
+                                   workers=workers),
+            number=1)
+    print_timings('re-parse, set_fields, dump', t_reparse)
+    print_timings('copy, set_fields, dump', t_copy, t_reparse)
+    print_timings('write_variants', t_sweep, t_reparse)
+
+
+def bench_iter_variants(design='two_sess_mid.fsf'):
+    template = load(pjoin(DATA_DIR, design))
+    overrides = grid({'smooth': [4.0, 5.0, 6.0, 8.0],
+                      'paradigm_hp': [60.0, 90.0, 100.0, 128.0],
+                      'z_thresh': [2.3, 3.1, 3.5]})
+    print_title('Make {} variants of {}'.format(len(overrides), design))
+
+    def copy_loop():
+        for override in overrides:
+            fsf = template.copy()
+            fsf.set_fields(override)
+
+    t_copy = timeit(copy_loop, number=1)
+    t_sweep = timeit(lambda: list(iter_variants(template, overrides)),
+                     number=1)
+    print_timings('copy, set_fields', t_copy)
+    print_timings('iter_variants', t_sweep, t_copy)
+
+
+if __name__ == '__main__':
+    bench_iter_variants()
+    bench_write_variants()
+    bench_write_variants('one_sess_level1.fsf')
@@ -0,0 +1,23 @@
+""" Benchmarking utilities
+"""
+
+from os.path import join as pjoin, dirname
+
+DATA_DIR = pjoin(dirname(__file__), '..', 'tests', 'data')
+
+
+def print_title(title):
+    """ Print `title` with underline
+    """
+    print()
+    print(title)
+    print('-' * len(title))
+
+
+def print_timings(label, times, base=None):
+    """ Print `label` and `times` in seconds, with speedup over `base`
+    """
+    line = '{:<40s}{:10.4f}'.format(label, times)
+    if base is not None:
+        line += '{:10.1f}x'.format(base / times)
+    print(line)
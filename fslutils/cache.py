@@ -0,0 +1,478 @@
+""" Caches of parsed FSF and .mat files
+
+A cache store saves the parsed contents of a file as arrays in a ``.npz``
+file, with metadata identifying the file and its contents.  The store can be
+a sidecar file next to the parsed file (:class:`SidecarStore`), or a file in a
+shared cache directory (:class:`DirectoryStore`).  We always read the file and
+check the hash of its contents before returning a cached result, so a cached
+result is always the same as a fresh parse.
+"""
+
+import os
+from os.path import split as psplit, join as pjoin, expanduser, isdir
+from hashlib import sha256
+import json
+from tempfile import mkstemp
+import zipfile
+
+import numpy as np
+
+from . import featparser as fp
+
+# Increment when changing format of stored arrays, or parsing.
+CACHE_FORMAT = 2
+
+# Smallest .mat file contents (in characters) for which we use the cache.
+# Parsing smaller files is faster than reading the stored arrays.
+MAT_CACHE_MIN_SIZE = 2 ** 16
+
+# Type codes for values in FSF dicts.
+_KIND_CODES = {bool: 0, int: 1, float: 2, str: 3}
+
+
+def _encode_strs(strs):
+    """ Encode sequence of strings `strs` as array of UTF-8 bytes
+
+    FSF keys and values cannot contain newlines, so we terminate each string
+    with a newline.
+    """
+    return np.frombuffer(''.join(s + '\n' for s in strs).encode('utf-8'),
+                         dtype=np.uint8)
+
+
+def _decode_strs(arr):
+    """ Decode array from :func:`_encode_strs` to list of strings
+    """
+    return arr.tobytes().decode('utf-8').split('\n')[:-1]
+
+
+def _fsf_to_arrays(fsf_dict):
+    """ Return dict of arrays encoding FSF dict `fsf_dict`, or None
+
+    Return None if `fsf_dict` contains values we cannot encode.
+    """
+    arrays = {'tops': _encode_strs(fsf_dict)}
+    for top_name, top in fsf_dict.items():
+        if top_name == 'fmri_arrays':
+            for family, arr in top.items():
+                arrays['matrix.' + family] = arr
+        elif isinstance(top, list):
+            arrays['list.' + top_name] = _encode_strs(top)
+        else:
+            try:
+                kinds = np.array([_KIND_CODES[type(v)] for v in top.values()],
+                                 dtype=np.uint8)
+            except KeyError:
+                return None
+            values = np.array(list(top.values()), dtype=object)
+            prefix = 'dict.' + top_name
+            arrays[prefix + '.keys'] = _encode_strs(top)
+            arrays[prefix + '.kinds'] = kinds
+            for kind, code in _KIND_CODES.items():
+                kind_values = values[kinds == code].tolist()
+                arrays['{}.{}'.format(prefix, code)] = (
+                    _encode_strs(kind_values) if kind is str
+                    else np.array(kind_values, dtype=kind))
+    return arrays
+
+
+def _arrays_to_fsf(arrays):
+    """ Return FSF dict from dict of arrays `arrays`
+    """
+    fsf_dict = {}
+    str_code = _KIND_CODES[str]
+    for top_name in _decode_strs(arrays['tops']):
+        if top_name == 'fmri_arrays':
+            top = fsf_dict[top_name] = {}
+            for key, arr in arrays.items():
+                if key.startswith('matrix.'):
+                    arr.flags.writeable = False
+                    top[key[len('matrix.'):]] = arr
+        elif 'list.' + top_name in arrays:
+            fsf_dict[top_name] = _decode_strs(arrays['list.' + top_name])
+        else:
+            prefix = 'dict.' + top_name
+            kinds = arrays[prefix + '.kinds']
+            values = np.empty(len(kinds), dtype=object)
+            for code in _KIND_CODES.values():
+                arr = arrays['{}.{}'.format(prefix, code)]
+                values[kinds == code] = (_decode_strs(arr) if code == str_code
+                                         else arr.tolist())
+            fsf_dict[top_name] = dict(zip(
+                _decode_strs(arrays[prefix + '.keys']), values.tolist()))
+    return fsf_dict
+
+
+def _mat_to_arrays(mat_dict):
+    """ Return dict of arrays encoding .mat dict `mat_dict`
+    """
+    return dict((key, np.asarray(value)) for key, value in mat_dict.items())
+
+
+def _arrays_to_mat(arrays):
+    """ Return .mat dict from dict of arrays `arrays`
+    """
+    mat_dict = dict((key, arr.tolist()) for key, arr in arrays.items()
+                    if key != 'Matrix')
+    mat_dict['Matrix'] = arrays['Matrix']
+    return mat_dict
+
+
+def _file_key(filename, contents, kind, **options):
+    """ Metadata identifying `filename`, its `contents` and parse options
+    """
+    stat = os.stat(filename)
+    return dict(format=CACHE_FORMAT,
+                kind=kind,
+                options=options,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                sha256=sha256(contents.encode('utf-8')).hexdigest())
+
+
+def _read_npz(path):
+    """ Read arrays and metadata from ``.npz`` file `path`
+
+    Return None, None if file is missing or unreadable.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = dict(npz.items())
+        meta = json.loads(str(arrays.pop('meta')))
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None, None
+    return meta, arrays
+
+
+def _write_npz(path, meta, arrays):
+    """ Write `arrays` and `meta` to ``.npz`` file `path`, atomically
+
+    Write to temporary file in same directory, and rename.  Return True if
+    write succeeded, False otherwise.
+    """
+    arrays = dict(arrays, meta=np.array(json.dumps(meta)))
+    try:
+        fd, tmp_path = mkstemp(dir=psplit(path)[0] or '.',
+                               prefix='.tmp-', suffix='.npz')
+    except (IOError, OSError):
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as fobj:
+            np.savez(fobj, **arrays)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+class CacheStore(object):
+    """ Base class for stores of parse results
+
+    Subclasses implement ``_get`` and ``_put``.  Instances count hits, misses
+    and writes.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get(self, filename, key):
+        """ Return stored arrays for `filename` if stored `key` matches
+
+        Parameters
+        ----------
+        filename : str
+            Filename of parsed file.
+        key : dict
+            Metadata for current file contents and parse options.
+
+        Returns
+        -------
+        arrays : None or dict
+            None if there is no stored entry for `filename`, or if the stored
+            entry does not match `key`.  Otherwise, dict of stored arrays.
+        """
+        arrays = self._get(filename, key)
+        if arrays is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return arrays
+
+    def put(self, filename, key, arrays):
+        """ Store `arrays` with metadata `key` for `filename`
+        """
+        if self._put(filename, key, arrays):
+            self.writes += 1
+
+    def stats(self):
+        """ Return dict of hit, miss and write counts for this store
+        """
+        return dict(hits=self.hits, misses=self.misses, writes=self.writes)
+
+
+class SidecarStore(CacheStore):
+    """ Store parsed contents of a file in a ``.npz`` file beside it
+
+    For example, we store the parsed contents of ``design.fsf`` in
+    ``design.fsf.fslcache.npz`` in the same directory.  If we cannot write
+    the sidecar file, we silently skip storing.
+    """
+
+    suffix = '.fslcache.npz'
+
+    def _path(self, filename):
+        return filename + self.suffix
+
+    def _get(self, filename, key):
+        meta, arrays = _read_npz(self._path(filename))
+        return arrays if meta == key else None
+
+    def _put(self, filename, key, arrays):
+        return _write_npz(self._path(filename), key, arrays)
+
+
+def _default_cache_dir():
+    if 'FSLUTILS_CACHE_DIR' in os.environ:
+        return os.environ['FSLUTILS_CACHE_DIR']
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                pjoin(expanduser('~'), '.cache'))
+    return pjoin(cache_home, 'fslutils')
+
+
+class DirectoryStore(CacheStore):
+    """ Store parse results in a cache directory, with a size limit
+
+    Entries are addressed by the hash of the file contents and the parse
+    options, so files with the same contents share an entry, wherever they
+    are.  When the total size of the entries exceeds `max_bytes`, we delete
+    the least recently used entries.  We mark entries as used by setting their
+    modification time.
+
+    We write entries to a temporary file and rename them into place, so
+    several processes can use the same directory at the same time.
+
+    Parameters
+    ----------
+    path : None or str, optional
+        Cache directory.  If None, use the ``FSLUTILS_CACHE_DIR`` environment
+        variable if set, or ``fslutils`` in the user cache directory
+        (``$XDG_CACHE_HOME``, or ``~/.cache``).  We create the directory if
+        necessary.
+    max_bytes : None or int, optional
+        Maximum total size of entries in bytes.  If None, use the
+        ``FSLUTILS_CACHE_SIZE`` environment variable if set, or 256MB.
+    """
+
+    suffix = '.npz'
+
+    def __init__(self, path=None, max_bytes=None):
+        super(DirectoryStore, self).__init__()
+        self.path = _default_cache_dir() if path is None else path
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('FSLUTILS_CACHE_SIZE', 2 ** 28))
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        # Estimate of total size of entries; None means unknown.
+        self._total_bytes = None
+
+    @staticmethod
+    def _address_key(key):
+        # Key without file identity, for content addressing.
+        return dict((k, v) for k, v in key.items()
+                    if k not in ('size', 'mtime_ns'))
+
+    def _path(self, key):
+        address_key = self._address_key(key)
+        digest = sha256(json.dumps(address_key, sort_keys=True).encode(
+            'utf-8')).hexdigest()
+        return pjoin(self.path, digest + self.suffix)
+
+    def _get(self, filename, key):
+        path = self._path(key)
+        meta, arrays = _read_npz(path)
+        if meta is None or meta != self._address_key(key):
+            return None
+        try:  # Mark as recently used
+            os.utime(path)
+        except (IOError, OSError):
+            pass
+        return arrays
+
+    def _put(self, filename, key, arrays):
+        try:
+            os.makedirs(self.path)
+        except (IOError, OSError):
+            if not isdir(self.path):
+                return False
+        path = self._path(key)
+        if not _write_npz(path, self._address_key(key), arrays):
+            return False
+        if self._total_bytes is None:
+            self._total_bytes = self.total_bytes()
+        else:
+            try:
+                self._total_bytes += os.stat(path).st_size
+            except (IOError, OSError):  # Removed by another process
+                pass
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+        return True
+
+    def _entries(self):
+        """ Return list of (mtime_ns, size, path) for entries in cache
+        """
+        entries = []
+        try:
+            dir_entries = list(os.scandir(self.path))
+        except (IOError, OSError):
+            return entries
+        for entry in dir_entries:
+            if (entry.name.startswith('.') or
+                    not entry.name.endswith(self.suffix)):
+                continue
+            try:
+                stat = entry.stat()
+            except (IOError, OSError):  # Removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def total_bytes(self):
+        """ Return total size of entries in cache directory
+        """
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self, max_bytes=None):
+        """ Delete least recently used entries until size <= `max_bytes`
+
+        Parameters
+        ----------
+        max_bytes : None or int, optional
+            Maximum total size of entries after eviction.  If None, use
+            ``self.max_bytes``.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except (IOError, OSError):  # Removed by another process
+                pass
+            else:
+                self.evictions += 1
+            total -= size
+        self._total_bytes = total
+
+    def clear(self):
+        """ Delete all entries in cache directory
+        """
+        self.evict(0)
+
+    def stats(self):
+        """ Return dict of counts for this store, with eviction count
+        """
+        stats = super(DirectoryStore, self).stats()
+        stats['evictions'] = self.evictions
+        return stats
+
+
+_SIDECAR_STORE = SidecarStore()
+
+_USER_STORE = None
+
+
+def user_store():
+    """ Return default :class:`DirectoryStore` for user cache directory
+    """
+    global _USER_STORE
+    if _USER_STORE is None:
+        _USER_STORE = DirectoryStore()
+    return _USER_STORE
+
+
+def _get_store(cache):
+    # Store corresponding to `cache` parameter value.
+    if cache is True:
+        return _SIDECAR_STORE
+    if cache == 'user':
+        return user_store()
+    return cache
+
+
+def cached_fsf_dict(filename, contents, arrays=False, cache=True):
+    """ Parse FSF `contents` from `filename`, using `cache`
+
+    Parameters
+    ----------
+    filename : str
+        Filename from which we read `contents`.
+    contents : str
+        Contents of FSF file `filename`.
+    arrays : {False, True}, optional
+        See ``featparser.fsf_to_dict``.
+    cache : True or 'user' or store, optional
+        If True, use a :class:`SidecarStore`.  If 'user', use the store from
+        :func:`user_store`.  Otherwise, a store object implementing ``get``
+        and ``put`` methods, such as an instance of :class:`SidecarStore` or
+        :class:`DirectoryStore`.
+
+    Returns
+    -------
+    fsf_dict : dict
+        Parsed FSF contents.
+    """
+    if fp._EXTRA_CONVERTER_REGEXPS:
+        # Cannot identify registered converters in stored metadata.
+        return fp.fsf_to_dict(contents, arrays)
+    store = _get_store(cache)
+    key = _file_key(filename, contents, 'fsf', arrays=bool(arrays))
+    stored = store.get(filename, key)
+    if stored is not None:
+        return _arrays_to_fsf(stored)
+    fsf_dict = fp.fsf_to_dict(contents, arrays)
+    encoded = _fsf_to_arrays(fsf_dict)
+    if encoded is not None:
+        store.put(filename, key, encoded)
+    return fsf_dict
+
+
+def cached_mat_dict(filename, contents, cache=True):
+    """ Parse .mat `contents` from `filename`, using `cache`
+
+    Parameters
+    ----------
+    filename : str
+        Filename from which we read `contents`.
+    contents : str
+        Contents of .mat file `filename`.
+    cache : True or store, optional
+        See :func:`cached_fsf_dict`.
+
+    Returns
+    -------
+    mat_dict : dict
+        Parsed .mat contents.
+
+    Notes
+    -----
+    We parse `contents` without the cache if it is shorter than
+    ``MAT_CACHE_MIN_SIZE``, because this is faster than reading the stored
+    arrays.
+    """
+    if len(contents) < MAT_CACHE_MIN_SIZE:
+        return fp.mat_to_dict(contents)
+    store = _get_store(cache)
+    key = _file_key(filename, contents, 'mat')
+    stored = store.get(filename, key)
+    if stored is not None:
+        return _arrays_to_mat(stored)
+    mat_dict = fp.mat_to_dict(contents)
+    store.put(filename, key, _mat_to_arrays(mat_dict))
+    return mat_dict
@@ -0,0 +1,104 @@
+""" Tables of ``fmri`` field values across many designs
+"""
+
+import numpy as np
+
+from .featparser import _infer_converter, _to_bool
+from .fsf import FSF, load as load_fsf
+
+# NumPy dtypes for field converters; fields with other converters get object
+# dtype.  We size string dtypes to the longest value.
+_CONVERTER_DTYPES = {
+    _to_bool: np.dtype(bool),
+    int: np.dtype(np.int64),
+    float: np.dtype(np.float64),
+    str: np.dtype(str),
+}
+
+
+def field_dtype(field_name):
+    """ Return NumPy dtype for ``fmri`` field `field_name`
+
+    The dtype follows from the converter that the parser uses for this field
+    name.  Strings have dtype ``np.dtype(str)``, with zero length.
+
+    Parameters
+    ----------
+    field_name : str
+        Name of field in ``fmri`` top.
+
+    Returns
+    -------
+    dtype : numpy dtype
+    """
+    return _CONVERTER_DTYPES.get(_infer_converter(field_name),
+                                 np.dtype(object))
+
+
+def _column(values, dtype):
+    # Array and mask from `values`, with None for missing values.
+    mask = np.array([v is None for v in values], dtype=bool)
+    if dtype.kind == 'U':
+        fill = ''
+    elif dtype.kind == 'O':
+        fill = None
+    else:
+        fill = dtype.type(0)
+    filled = [fill if m else v for v, m in zip(values, mask)]
+    if dtype.kind == 'U':
+        return np.array(filled, dtype=str), mask
+    col = np.empty(len(filled), dtype=dtype)
+    col[:] = filled
+    return col, mask
+
+
+def cohort_table(designs, fields=None, loader=load_fsf):
+    """ Return masked structured array of ``fmri`` fields for `designs`
+
+    Parameters
+    ----------
+    designs : iterable
+        Iterable of FSF objects, design filenames, or FEAT directories.
+    fields : None or sequence, optional
+        Names of ``fmri`` fields for columns of table.  If None, use all
+        ``fmri`` fields in `designs`, in order of first appearance.
+    loader : callable, optional
+        Callable accepting design filename or FEAT directory and returning
+        FSF object.  We use `loader` for elements of `designs` that are not
+        FSF objects.
+
+    Returns
+    -------
+    table : numpy.ma.MaskedArray
+        Structured array with one row per design, and one column per field.
+        Column dtypes follow from field types implied by the field name: bool
+        for ``_yn`` fields, int64 for integer fields, float64 for float
+        fields, fixed-width strings for string fields, and object for fields
+        with other converters.  Fields missing from a design are masked.
+    """
+    # Take the field values from each design as we go, so we do not keep
+    # the designs.
+    values = {} if fields is None else {name: [] for name in fields}
+    n = 0
+    for design in designs:
+        fmri = (design if isinstance(design, FSF) else loader(design)).fmri
+        if fields is None:
+            for name in fmri:
+                if name not in values:
+                    values[name] = [None] * n
+        for name, column in values.items():
+            column.append(fmri.get(name))
+        n += 1
+    fields = list(values)
+    columns, masks, dtypes = [], [], []
+    for name in fields:
+        col, mask = _column(values.pop(name), field_dtype(name))
+        columns.append(col)
+        masks.append(mask)
+        dtypes.append((name, col.dtype))
+    data = np.empty(n, dtype=dtypes)
+    mask = np.empty(n, dtype=[(name, bool) for name in fields])
+    for name, col, col_mask in zip(fields, columns, masks):
+        data[name] = col
+        mask[name] = col_mask
+    return np.ma.MaskedArray(data, mask=mask)
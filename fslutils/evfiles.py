@@ -0,0 +1,187 @@
+""" Read FEAT custom EV timing files
+
+Custom EV files have one value per line (1 column format) or onset,
+duration and amplitude per line (3 column format).  Read many files at once,
+for example, all the files for a cohort of first-level designs, with::
+
+    reader = EVReader()
+    values = reader.read_many(fnames)
+
+The reader caches parsed files by file identity, so timing files shared
+between designs are only read once.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .supporting import read_file, LRUCache, _file_identity
+from .featparser import _parse_matrix
+
+EVTiming = namedtuple('EVTiming', ['onsets', 'durations', 'amplitudes'])
+
+
+def parse_ev(contents):
+    """ Parse contents of custom EV file to 2D array
+
+    Parameters
+    ----------
+    contents : str
+        Contents of custom EV file, with the same number of whitespace
+        separated values on each non-empty line.
+
+    Returns
+    -------
+    values : array
+        Array shape (n_lines, n_columns).  Empty files give shape (0, 3).
+
+    Notes
+    -----
+    We parse all the values in one call, and take the number of columns from
+    the first non-empty line, so we check that the total number of values
+    fits the number of columns, but not the number of values on each line.
+    """
+    first_line = next((line for line in contents.splitlines()
+                       if line.strip()), None)
+    if first_line is None:
+        return np.zeros((0, 3))
+    return _parse_matrix(contents, None, len(first_line.split()), 'EV file')
+
+
+def ev_timing(values):
+    """ Return :class:`EVTiming` for 3 column EV `values`
+
+    Parameters
+    ----------
+    values : array
+        Array shape (n_events, 3), as returned by :func:`parse_ev`.
+
+    Returns
+    -------
+    timing : EVTiming
+        Named tuple with ``onsets``, ``durations`` and ``amplitudes`` arrays.
+        These are views of `values`.
+    """
+    values = np.asarray(values)
+    if values.ndim != 2 or values.shape[1] != 3:
+        raise ValueError('Expecting 3 column EV values')
+    return EVTiming(*values.T)
+
+
+def ev_filenames(fsf):
+    """ Return custom EV filenames for first-level `fsf`, in EV order
+
+    Parameters
+    ----------
+    fsf : FSF
+        First-level design.
+
+    Returns
+    -------
+    fnames : list
+        Filenames in ``custom`` fields, for EVs with 1 or 3 column format
+        (shapes 2 and 3).  Higher-level designs take EV values from the
+        design file, so have no custom EV files.
+    """
+    fmri = fsf.fmri
+    fnames = []
+    if fmri.get('level', 1) != 1:
+        return fnames
+    for ev_no in range(1, int(fmri.get('evs_orig', 0)) + 1):
+        if int(fmri.get('shape{}'.format(ev_no), -1)) in (2, 3):
+            fname = fmri.get('custom{}'.format(ev_no))
+            if fname is not None:
+                fnames.append(fname)
+    return fnames
+
+
+class EVReader(LRUCache):
+    """ Read custom EV files, with in-memory LRU cache
+
+    We key the cache on the real path of the file, and its inode, size and
+    modification time, so a changed file gets a new entry.  The returned
+    arrays are read-only, and shared between callers.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of parsed files to keep.  You can change this value
+        with the ``maxsize`` attribute.
+    """
+
+    def __init__(self, maxsize=4096):
+        super(EVReader, self).__init__(maxsize)
+
+    def read(self, fname):
+        """ Read custom EV file `fname`, using cache
+
+        Parameters
+        ----------
+        fname : str
+            Filename of custom EV file.
+
+        Returns
+        -------
+        values : array
+            Read-only array shape (n_lines, n_columns).  See
+            :func:`parse_ev`.
+        """
+        key = _file_identity(fname)
+        values = self.get(key)
+        if values is not None:
+            return values
+        values = parse_ev(read_file(fname))
+        values.flags.writeable = False
+        # Do not store if file changed as we read it.
+        if _file_identity(fname) == key:
+            values = self.put(key, values)
+        return values
+
+    def __call__(self, fname):
+        return self.read(fname)
+
+    def _read_or_none(self, fname):
+        try:
+            return self.read(fname)
+        except (OSError, ValueError):
+            return None
+
+    def read_many(self, fnames, workers=8, skip_errors=False):
+        """ Read custom EV files `fnames` with a pool of threads
+
+        We read each distinct filename once.
+
+        Parameters
+        ----------
+        fnames : iterable
+            Filenames of custom EV files.
+        workers : int, optional
+            Number of threads with which to read files.
+        skip_errors : {False, True}, optional
+            If True, return None for files we cannot read or parse, otherwise
+            raise the error.
+
+        Returns
+        -------
+        values : list
+            List of read-only arrays, one per filename in `fnames`.
+        """
+        fnames = list(fnames)
+        unique = list(dict.fromkeys(fnames))
+        read = self._read_or_none if skip_errors else self.read
+        with ThreadPoolExecutor(workers) as executor:
+            by_name = dict(zip(unique, executor.map(read, unique)))
+        return [by_name[fname] for fname in fnames]
+
+    def read_timings(self, fnames, workers=8):
+        """ Read 3 column EV files `fnames`, return list of :class:`EVTiming`
+
+        See :meth:`read_many` for parameters.
+        """
+        return [ev_timing(values)
+                for values in self.read_many(fnames, workers)]
+
+
+# Default reader shared by all designs.
+ev_reader = EVReader()
@@ -1,7 +1,10 @@
 """ Parser for FEAT designs
 """
 
-from re import compile as rcomp, VERBOSE
+from re import compile as rcomp, VERBOSE, MULTILINE
+from functools import lru_cache
+from numbers import Integral, Real
+import warnings
 
 import numpy as np
 
@@ -11,11 +14,20 @@ _DEF_RE = rcomp(
     \ (?P<content>.*)""",
     VERBOSE)
 
+# As for _DEF_RE, but for finding all definitions in a whole buffer.
+_DEF_ALL_RE = rcomp(
+    r"""^set \ (?P<top_name>[A-Za-z0-9_]+)
+    \((?P<field>[A-Za-z0-9_.]+)\)
+    \ (?P<content>[^\r\n]*)""",
+    VERBOSE | MULTILINE)
+
 _MAT_RE = rcomp(
     r"""/(?P<field>[A-Za-z0-9_]+)
     \s+(?P<content>.*)""",
     VERBOSE)
 
+_MATRIX_START_RE = rcomp(r'^[ \t]*/Matrix[ \t\r]*$', MULTILINE)
+
 
 def _to_bool(val):
     return bool(int(val))
@@ -68,44 +80,255 @@ _CONVERTER_REGEXPS = (
 )
 
 
+# Converters registered with ``register_converter``, most recent first.
+_EXTRA_CONVERTER_REGEXPS = []
+
+
+def _dispatch_pattern(regexp):
+    # Pattern matching from start of field name, given `regexp` for search.
+    pattern = regexp.pattern
+    if pattern.startswith('^'):
+        return '(?:{})'.format(pattern[1:])
+    return '.*?(?:{})'.format(pattern)
+
+
+def _build_dispatch():
+    """ Compile built-in converter regexps into one alternation
+
+    Alternatives are in order of priority, and are all anchored at the start
+    of the field name, so the first matching alternative corresponds to the
+    first regexp that would match in a search over the regexps in turn.  We
+    only do this for the built-in regexps, which have no flags, top-level
+    alternation or backreferences.
+    """
+    alternatives = []
+    converters = {}
+    for i, (regexp, converter) in enumerate(_CONVERTER_REGEXPS):
+        group_name = 'conv{}'.format(i)
+        alternatives.append('(?P<{}>{})'.format(
+            group_name, _dispatch_pattern(regexp)))
+        converters[group_name] = converter
+    return rcomp('|'.join(alternatives)), converters
+
+
+_DISPATCH = _build_dispatch()
+
+
+@lru_cache(maxsize=4096)
 def _infer_converter(field_name):
     if field_name in _CONVERTERS:
         return _CONVERTERS[field_name]
-    for regexp, converter in _CONVERTER_REGEXPS:
-        match = regexp.search(field_name)
-        if match is not None:
+    # Registered regexps can use any regexp features, so search with each.
+    for regexp, converter in _EXTRA_CONVERTER_REGEXPS:
+        if regexp.search(field_name):
             return converter
-    return str
+    dispatch_re, converters = _DISPATCH
+    match = dispatch_re.match(field_name)
+    if match is None:
+        return str
+    return converters[match.lastgroup]
+
 
+def register_converter(pattern, converter):
+    """ Register `converter` for FSF field names matching `pattern`
 
-def _process_fsf_line(line, out_dict):
-    match = _DEF_RE.match(line)
+    Registered converters take precedence over the built-in field name
+    patterns, and later registrations take precedence over earlier ones.
+    Field names with a known converter (in ``_CONVERTERS``) are not
+    affected.
+
+    Parameters
+    ----------
+    pattern : str or compiled regexp
+        Regular expression that will find a match (with ``search``) in field
+        names for which to use `converter`.  We use the flags of compiled
+        regexps.
+    converter : callable
+        Callable accepting field contents as a string, and returning the
+        converted value.
+    """
+    # Compile before registering, so invalid patterns raise, and leave the
+    # registered converters unchanged.
+    regexp = rcomp(pattern) if isinstance(pattern, str) else pattern
+    _EXTRA_CONVERTER_REGEXPS.insert(0, (regexp, converter))
+    _infer_converter.cache_clear()
+
+
+def unregister_converter(pattern):
+    """ Remove converters registered for `pattern`
+
+    Parameters
+    ----------
+    pattern : str or compiled regexp
+        Pattern previously passed to ``register_converter``.  For a compiled
+        regexp, we remove converters registered with the same pattern and
+        flags.
+    """
+    if isinstance(pattern, str):
+        keep = [(r, c) for r, c in _EXTRA_CONVERTER_REGEXPS
+                if r.pattern != pattern]
+    else:
+        keep = [(r, c) for r, c in _EXTRA_CONVERTER_REGEXPS
+                if (r.pattern, r.flags) != (pattern.pattern, pattern.flags)]
+    _EXTRA_CONVERTER_REGEXPS[:] = keep
+    _infer_converter.cache_clear()
+
+
+def _unquote(contents):
+    if contents[:1] == '"' and contents[-1:] == '"':
+        return contents[1:-1]
+    return contents
+
+
+def iter_fsf(fileobj):
+    """ Iterate over typed definitions in FSF design file `fileobj`
+
+    We read `fileobj` one line at a time, so memory use does not depend on the
+    size of the file.
+
+    Parameters
+    ----------
+    fileobj : file-like or iterable
+        File-like object open in text mode, or other iterable returning lines
+        of FSF file as strings.  To iterate over FSF contents in a string
+        ``contents``, use ``contents.splitlines()``.
+
+    Yields
+    ------
+    top_name : str
+        Name of top-level object for definition, such as ``fmri`` or
+        ``feat_files``.
+    field : str or int
+        Field name within `top_name`.  For list tops (see
+        ``FEAT_TOP_TYPES``), such as ``feat_files``, this is the 0-based index
+        of the list element.
+    value : object
+        Value for definition, converted to type implied by field name for dict
+        tops, and unquoted string for list tops.
+    """
+    for line in fileobj:
+        match = _DEF_ALL_RE.match(line)
+        if match is None:
+            continue
+        top_name, field_name, contents = match.groups()
+        contents = _unquote(contents)
+        if FEAT_TOP_TYPES[top_name] is list:
+            yield top_name, int(field_name) - 1, contents
+        else:
+            yield (top_name, field_name,
+                   _infer_converter(field_name)(contents))
+
+
+def dict_from_events(events):
+    """ Build FSF dictionary from iterable of definitions `events`
+
+    Parameters
+    ----------
+    events : iterable
+        Iterable returning ``(top_name, field, value)`` tuples, as for
+        ``iter_fsf``.
+
+    Returns
+    -------
+    fsf_dict : dict
+        Dict containing definitions from `events`, as for ``fsf_to_dict``.
+    """
+    fsf_dict = {}
+    for top_name, field, value in events:
+        if top_name not in fsf_dict:
+            fsf_dict[top_name] = FEAT_TOP_TYPES[top_name]()
+        top = fsf_dict[top_name]
+        if isinstance(top, list):
+            # List elements must be in order.
+            assert len(top) == field
+            top.append(value)
+        else:
+            top[field] = value
+    return fsf_dict
+
+
+# Families of numbered fields in ``fmri`` making up matrices, with dtype and
+# first index of matrix column in field name.  ``groupmem`` is a vector.
+MATRIX_FAMILIES = {
+    'evg': (float, 1),
+    'con_real': (float, 1),
+    'con_orig': (float, 1),
+    'ortho': (int, 0),
+    'conmask': (int, 1),
+    'groupmem': (int, 1),
+}
+
+_MATRIX_FIELD_RE = rcomp(
+    r"""^(?:(?P<family>evg|con_real|con_orig|ortho)(?P<row>\d+)\.
+    |(?P<mask_family>conmask)(?P<mask_row>\d+)_
+    |(?P<vector_family>groupmem)\.)
+    (?P<col>\d+)$""",
+    VERBOSE)
+
+
+def _matrix_field(field_name):
+    """ Return family, row, column strings for matrix field, or None
+    """
+    match = _MATRIX_FIELD_RE.match(field_name)
     if match is None:
-        return
-    top_name, field_name, contents = match.groups()
-    if (contents[0], contents[-1]) == ('"', '"'):
-        contents = contents[1:-1]
-    if top_name not in out_dict:
-        out_dict[top_name] = FEAT_TOP_TYPES[top_name]()
-    try:
-        field_name = int(field_name) - 1
-    except ValueError:
-        contents = _infer_converter(field_name)(contents)
-        out_dict[top_name][field_name] = contents
-        return
+        return None
+    family, row, mask_family, mask_row, vector_family, col = match.groups()
+    if mask_family is not None:
+        return mask_family, mask_row, col
+    if vector_family is not None:
+        return vector_family, None, col
+    return family, row, col
+
+
+def _build_matrix(family, rows, cols, values):
+    """ Build array for matrix `family` from lists of index and value strings
+
+    Rows and columns are 1-based in the field names, except for the columns
+    of ``ortho``, which are 0-based.  Missing elements are 0.  The returned
+    array is read-only.
+    """
+    dtype, col_base = MATRIX_FAMILIES[family]
+    cols = np.array(cols).astype(int) - col_base
+    values = np.array(values).astype(dtype)
+    if family == 'groupmem':
+        arr = np.zeros((cols.max() + 1,), dtype=dtype)
+        arr[cols] = values
     else:
-        # List element
-        assert len(out_dict[top_name]) == field_name
-        out_dict[top_name].append(contents)
+        rows = np.array(rows).astype(int) - 1
+        arr = np.zeros((rows.max() + 1, cols.max() + 1), dtype=dtype)
+        arr[rows, cols] = values
+    arr.flags.writeable = False
+    return arr
+
 
+def _fsf_to_dict_lines(fsf):
+    # Line-by-line parser; kept for testing and benchmarking.
+    return dict_from_events(iter_fsf(fsf.splitlines()))
 
-def fsf_to_dict(fsf):
+
+def _unix_newlines(text):
+    # `text` with CR-LF and CR-only line endings replaced by LF
+    if '\r' not in text:
+        return text
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def fsf_to_dict(fsf, arrays=False):
     """ Parse FSF design file in string `fsf` to dictionary
 
+    We find all the ``set`` definitions in one pass over the whole string,
+    then build the top-level dicts and lists from the matches.  Lines can end
+    with LF, CR-LF or CR.
+
     Parameters
     ----------
     fsf : str
         String containing contents of FSF design file.
+    arrays : {False, True}, optional
+        If True, collect numbered matrix fields in ``fmri`` (see
+        ``MATRIX_FAMILIES``) into arrays, rather than storing each element as
+        a separate field.  The arrays go into a dict, keyed by family name
+        (e.g. ``evg``, ``con_real``) in the ``fmri_arrays`` key of the output.
 
     Returns
     -------
@@ -113,31 +336,167 @@ def fsf_to_dict(fsf):
         Dict containing contents of FSF file.
     """
     fsf_dict = {}
-    for line in fsf.splitlines():
-        _process_fsf_line(line, fsf_dict)
+    list_items = {}
+    matrix_items = {}
+    for top_name, field_name, contents in _DEF_ALL_RE.findall(
+            _unix_newlines(fsf)):
+        contents = _unquote(contents)
+        if top_name not in fsf_dict:
+            fsf_dict[top_name] = FEAT_TOP_TYPES[top_name]()
+        top = fsf_dict[top_name]
+        if isinstance(top, dict):
+            if arrays and top_name == 'fmri':
+                matrix_field = _matrix_field(field_name)
+                if matrix_field is not None:
+                    family, row, col = matrix_field
+                    if family not in matrix_items:
+                        matrix_items[family] = ([], [], [])
+                    rows, cols, values = matrix_items[family]
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(contents)
+                    continue
+            top[field_name] = _infer_converter(field_name)(contents)
+        else:
+            list_items.setdefault(top_name, []).append(
+                (int(field_name) - 1, contents))
+    for top_name, items in list_items.items():
+        # List elements, in order, with 1-based indices in the file.
+        indices, values = zip(*items)
+        assert indices == tuple(range(len(indices)))
+        fsf_dict[top_name].extend(values)
+    if arrays:
+        fsf_dict['fmri_arrays'] = dict(
+            (family, _build_matrix(family, *items))
+            for family, items in matrix_items.items())
     return fsf_dict
 
 
-def _process_mat_line(line):
-    field_name, contents = _MAT_RE.match(line).groups()
-    converter = float if '.' in contents else int
-    contents = [converter(v) for v in contents.split()]
-    return field_name, contents if len(contents) > 1 else contents[0]
+# Strings we can write without quotes; FEAT writes numbers without quotes.
+_UNQUOTED_RE = rcomp(r'^-?\d+(\.\d*)?([eE][-+]?\d+)?$')
 
+# Templates for field names of matrix family elements, given row, column.
+_MATRIX_TEMPLATES = {
+    'evg': 'evg{}.{}',
+    'con_real': 'con_real{}.{}',
+    'con_orig': 'con_orig{}.{}',
+    'ortho': 'ortho{}.{}',
+    'conmask': 'conmask{}_{}',
+}
 
-def mat_to_dict(mat):
-    """ Parse FSF design matrix file in string `mat`, return as dict
+
+def _format_str(value):
+    if '\n' in value or '\r' in value:
+        raise ValueError('Cannot write value {!r} containing newline'.format(
+            value))
+    if _UNQUOTED_RE.match(value):
+        return value
+    return '"' + value + '"'
+
+
+# Formatters for the types that the parser returns.
+_FORMATTERS = {
+    bool: lambda value: '1' if value else '0',
+    int: int.__repr__,
+    float: float.__repr__,
+    str: _format_str,
+}
+
+
+def _format_value(value):
+    """ Return string for `value` in ``set`` definition
+    """
+    formatter = _FORMATTERS.get(type(value))
+    if formatter is not None:
+        return formatter(value)
+    if isinstance(value, (bool, np.bool_)):  # Before int; bools are ints
+        return _FORMATTERS[bool](value)
+    if isinstance(value, (Integral, np.integer)):
+        return str(int(value))
+    if isinstance(value, (Real, np.floating)):
+        return repr(float(value))
+    return _format_str(str(value))
+
+
+def _matrix_lines(family, arr):
+    """ Return ``set`` definition lines for matrix `family` array `arr`
+
+    We format all elements in one pass over the array.
+    """
+    dtype, col_base = MATRIX_FAMILIES[family]
+    if family == 'groupmem':
+        template = 'set fmri(groupmem.{}) {}'
+        cols = np.arange(col_base, arr.shape[0] + col_base)
+        return list(map(template.format, cols.tolist(),
+                        _format_array(arr, dtype)))
+    template = 'set fmri({}) {{}}'.format(_MATRIX_TEMPLATES[family])
+    rows, cols = np.indices(arr.shape).reshape((2, -1))
+    values = arr.ravel()
+    if family == 'conmask':
+        # FEAT writes the diagonal element ``conmask1_1`` only.
+        keep = (rows != cols) | (rows == 0)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+    return list(map(template.format, (rows + 1).tolist(),
+                    (cols + col_base).tolist(), _format_array(values, dtype)))
+
+
+def _format_array(arr, dtype):
+    # Strings for values in array `arr` with FSF field type `dtype`
+    values = arr.tolist()
+    return (map(float.__repr__, map(float, values)) if dtype is float
+            else map(str, map(int, values)))
+
+
+def dict_to_fsf(fsf_dict):
+    """ Write FSF design file contents from dictionary `fsf_dict`
+
+    This is the inverse of :func:`fsf_to_dict`, so that ``fsf_to_dict(
+    dict_to_fsf(fsf_dict))`` gives back `fsf_dict`.  We do not preserve
+    comments, or the order of definitions in the original design file; we
+    write ``fmri`` fields, then matrix fields from ``fmri_arrays`` (if
+    present), then the list tops such as ``feat_files``.
+
+    We write numbers and strings that look like numbers without quotes, and
+    other strings with double quotes, as FEAT does.
 
     Parameters
     ----------
-    mat : str
-        String containing contents of .mat design matrix file.
+    fsf_dict : dict
+        Dict containing contents of FSF file, as returned by
+        :func:`fsf_to_dict`.
 
     Returns
     -------
-    mat_dict : dict
-        Dict containing contents of mat file.
+    fsf : str
+        String containing contents of FSF design file.
     """
+    lines = []
+    for top_name, top in fsf_dict.items():
+        if top_name == 'fmri_arrays' or FEAT_TOP_TYPES[top_name] is list:
+            continue
+        template = 'set {}({{}}) {{}}'.format(top_name)
+        lines += map(template.format, top.keys(),
+                     map(_format_value, top.values()))
+    for family, arr in (fsf_dict.get('fmri_arrays') or {}).items():
+        lines += _matrix_lines(family, arr)
+    for top_name, top in fsf_dict.items():
+        if top_name == 'fmri_arrays' or FEAT_TOP_TYPES[top_name] is not list:
+            continue
+        template = 'set {}({{}}) "{{}}"'.format(top_name)
+        lines += map(template.format, range(1, len(top) + 1), top)
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _process_mat_line(line):
+    field_name, contents = _MAT_RE.match(line).groups()
+    converter = float if '.' in contents else int
+    contents = [converter(v) for v in contents.split()]
+    return field_name, contents if len(contents) > 1 else contents[0]
+
+
+def _mat_to_dict_lines(mat):
+    # Line-by-line parser; kept for testing and benchmarking.
     mat_dict = {}
     state = 'getfields'
     mat_lines = []
@@ -158,3 +517,205 @@ def mat_to_dict(mat):
         mat_dict[field_name] = contents
     mat_dict['Matrix'] = np.array(mat_lines)
     return mat_dict
+
+
+def _parse_mat_header(header):
+    mat_dict = {}
+    for line in header.splitlines():
+        line = line.strip()
+        if line == '':
+            continue
+        assert line.startswith('/')
+        field_name, contents = _process_mat_line(line)
+        mat_dict[field_name] = contents
+    return mat_dict
+
+
+def _parse_matrix(body, n_points, n_waves, name='/Matrix'):
+    """ Parse whitespace-separated numbers in `body` to array
+
+    Raise ValueError if `body` does not contain exactly ``n_points * n_waves``
+    numbers, or, if `n_points` is None, a multiple of `n_waves` numbers.  Use
+    `name` to refer to `body` in error messages.
+    """
+    with warnings.catch_warnings():
+        # Numpy warns for unparseable text, in some versions.
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(body, dtype=np.float64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            raise ValueError('Could not parse numbers in ' + name)
+    if n_points is None:
+        if values.size % n_waves:
+            raise ValueError('{} has {} values; expecting multiple of {} '
+                             'columns'.format(name, values.size, n_waves))
+        n_points = values.size // n_waves
+    elif values.size != n_points * n_waves:
+        raise ValueError(
+            '{} has {} values; expecting {} (/NumPoints) * {} '
+            '(/NumWaves)'.format(name, values.size, n_points, n_waves))
+    return values.reshape((n_points, n_waves))
+
+
+def _row_blocks(matrix, chunk_rows):
+    # Arrays for blocks of up to `chunk_rows` rows of array-like `matrix`
+    for start in range(0, len(matrix), chunk_rows):
+        yield np.asarray(matrix[start:start + chunk_rows], dtype=float)
+
+
+def _ppheights(arr):
+    """ Peak-to-peak heights over second to last axis of `arr`
+
+    The height is the maximum minus the minimum, or the absolute value for
+    constant columns.  `arr` can be one matrix, or a stack of matrices.
+    """
+    if arr.shape[-2] == 0:
+        return np.zeros(arr.shape[:-2] + arr.shape[-1:])
+    maxs = arr.max(axis=-2)
+    heights = maxs - arr.min(axis=-2)
+    constant = heights == 0
+    heights[constant] = np.abs(maxs[constant])
+    return heights
+
+
+def mat_ppheights(matrix, chunk_rows=4096):
+    """ Return peak-to-peak heights for columns of design `matrix`
+
+    The height is the maximum minus the minimum of the column, or the
+    absolute value of the column for constant columns.  FEAT calculates the
+    heights of first-level regressors from the oversampled model, so the
+    heights for first-level designs will differ somewhat from those that FEAT
+    writes.
+
+    Parameters
+    ----------
+    matrix : array-like
+        2D design matrix, such as an array, a memory-mapped array, or a
+        :class:`fslutils.matfile.MappedMatrix`.
+    chunk_rows : int, optional
+        Number of rows to read from `matrix` at a time.
+
+    Returns
+    -------
+    ppheights : array
+        Heights, one per column.
+    """
+    n_waves = matrix.shape[1]
+    mins = np.full(n_waves, np.inf)
+    maxs = np.full(n_waves, -np.inf)
+    for block in _row_blocks(matrix, chunk_rows):
+        if len(block):
+            mins = np.minimum(mins, block.min(axis=0))
+            maxs = np.maximum(maxs, block.max(axis=0))
+    if len(matrix) == 0:
+        return np.zeros(n_waves)
+    return _ppheights(np.stack([mins, maxs]))
+
+
+def iter_mat(matrix, ppheights=None, header=None, fmt='%e',
+             chunk_rows=4096):
+    """ Generate contents of .mat design matrix file in chunks of text
+
+    Use for writing very large matrices, without holding all of the text in
+    memory.  We format each chunk of rows in one pass, in FEAT's
+    tab-separated style.
+
+    Parameters
+    ----------
+    matrix : array-like
+        2D design matrix, such as an array, a memory-mapped array, or a
+        :class:`fslutils.matfile.MappedMatrix`.  We read `chunk_rows` rows at
+        a time.
+    ppheights : None or sequence, optional
+        Peak-to-peak heights of columns of `matrix`.  If None, calculate with
+        :func:`mat_ppheights`.
+    header : None or dict, optional
+        Other header fields to write after ``/PPheights``.
+    fmt : str, optional
+        Format for matrix and ``PPheights`` values.  The default is FEAT's
+        format.  Use ``'%.17e'`` to write values without loss of precision.
+    chunk_rows : int, optional
+        Number of rows to format in each chunk.
+
+    Yields
+    ------
+    text : str
+        Chunk of file contents; the header, then blocks of matrix rows.
+    """
+    n_points, n_waves = matrix.shape
+    if ppheights is None:
+        ppheights = mat_ppheights(matrix, chunk_rows)
+    ppheights = np.atleast_1d(ppheights)
+    if len(ppheights) != n_waves:
+        raise ValueError('Expecting {} PPheights; got {}'.format(
+            n_waves, len(ppheights)))
+    lines = ['/NumWaves\t{}'.format(n_waves),
+             '/NumPoints\t{}'.format(n_points),
+             '/PPheights\t\t' + '\t'.join(
+                 [fmt % v for v in ppheights.tolist()])]
+    for key, value in (header or {}).items():
+        values = [fmt % v if isinstance(v, float) else str(v)
+                  for v in np.atleast_1d(value).tolist()]
+        lines.append('/{}\t{}'.format(key, '\t'.join(values)))
+    yield '\n'.join(lines) + '\n\n/Matrix\n'
+    row_fmt = (fmt + '\t') * n_waves + '\n'
+    for block in _row_blocks(matrix, chunk_rows):
+        yield (row_fmt * len(block)) % tuple(block.ravel().tolist())
+
+
+def dict_to_mat(mat_dict, fmt='%e'):
+    """ Write .mat design matrix file contents from dictionary `mat_dict`
+
+    This is the inverse of :func:`mat_to_dict`.  Matrices read from FEAT
+    files give the same contents when written with the default `fmt`.
+
+    Parameters
+    ----------
+    mat_dict : dict
+        Dict with ``Matrix`` key, and optional ``PPheights`` key, as returned
+        by :func:`mat_to_dict`.  If there is no ``PPheights`` key, calculate
+        heights with :func:`mat_ppheights`.  We write other fields, except
+        ``NumWaves`` and ``NumPoints``, to the header.
+    fmt : str, optional
+        Format for values; see :func:`iter_mat`.
+
+    Returns
+    -------
+    mat : str
+        String containing contents of .mat design matrix file.
+    """
+    header = {key: value for key, value in mat_dict.items()
+              if key not in ('Matrix', 'NumWaves', 'NumPoints', 'PPheights')}
+    return ''.join(iter_mat(np.asarray(mat_dict['Matrix']),
+                            mat_dict.get('PPheights'), header, fmt))
+
+
+def mat_to_dict(mat):
+    """ Parse FSF design matrix file in string `mat`, return as dict
+
+    Parameters
+    ----------
+    mat : str
+        String containing contents of .mat design matrix file.
+
+    Returns
+    -------
+    mat_dict : dict
+        Dict containing contents of mat file.
+
+    Raises
+    ------
+    ValueError
+        If the number of values in the matrix does not match ``/NumPoints``
+        and ``/NumWaves``.
+    """
+    match = _MATRIX_START_RE.search(mat)
+    header = mat if match is None else mat[:match.start()]
+    mat_dict = _parse_mat_header(header)
+    if match is None or not {'NumPoints', 'NumWaves'} <= set(mat_dict):
+        # No matrix, or cannot get matrix shape from header.
+        return _mat_to_dict_lines(mat)
+    mat_dict['Matrix'] = _parse_matrix(mat[match.end():],
+                                       mat_dict['NumPoints'],
+                                       mat_dict['NumWaves'])
+    return mat_dict
@@ -2,44 +2,197 @@
 """
 
 from os.path import isdir, join as pjoin
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+from functools import wraps
+from types import MappingProxyType
 import re
+import sys
+import zlib
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+import asyncio
 
 import numpy as np
 
-from .supporting import read_file
-from .featparser import fsf_to_dict, FEAT_TOP_TYPES
+from .supporting import read_file, LRUCache, _file_identity
+# CacheInfo was defined here; import for backwards compatibility.
+from .supporting import CacheInfo  # noqa: F401
+from .cache import cached_fsf_dict, _fsf_to_arrays, _arrays_to_fsf
+from .featparser import (fsf_to_dict, dict_to_fsf, FEAT_TOP_TYPES,
+                         _matrix_field,
+                         _infer_converter, _unquote, _unix_newlines,
+                         _DEF_ALL_RE)
 
 
 END_NO = re.compile(r'(\d+)$')
 
-def _end_number(k):
-    # Key sorter using number at end of string
-    return int(END_NO.search(k).groups()[0])
+DIGITS = re.compile(r'\d+')
+
+
+def _numbered_index(fsfd):
+    """ Index keys in `fsfd` ending in a number by the stem before the number
+
+    Parameters
+    ----------
+    fsfd : dict
+        Dictionary with str keys.
+
+    Returns
+    -------
+    index : dict
+        Dict with keys being the stem of each key in `fsfd` ending in a number,
+        such as ``evg1.`` for ``evg1.2``, and values being a list of ``(number,
+        value)`` tuples, sorted by number, for all keys in `fsfd` with that
+        stem.
+    """
+    index = {}
+    for key, value in fsfd.items():
+        # Faster than matching ``END_NO`` for each key.
+        stem = key.rstrip('0123456789')
+        if len(stem) == len(key):
+            continue
+        index.setdefault(stem, []).append((int(key[len(stem):]), value))
+    for items in index.values():
+        items.sort(key=lambda item: item[0])
+    return index
+
+
+def _read_only(value):
+    """ Return read-only version of `value` for sharing between callers
+
+    Dicts become read-only mappings over dicts of the same type, with
+    read-only values.  Arrays become read-only, in place.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(value.__class__(
+            (key, _read_only(item)) for key, item in value.items()))
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    return value
+
+
+def _fresh_copy(value):
+    """ Return new dicts for read-only mappings in `value` from `_read_only`
+    """
+    if isinstance(value, MappingProxyType):
+        value = value.copy()
+        for key, item in value.items():
+            value[key] = _fresh_copy(item)
+    return value
+
+
+def _cached_property(method):
+    """ Make property from `method`, caching value in instance ``_cache``
+
+    We cache a read-only version of the value, and return new dicts for each
+    access, so callers can modify the returned dicts without changing the
+    cached value.  Arrays are read-only, and shared between callers.
+    """
+    name = method.__name__
+
+    @wraps(method)
+    def getter(self):
+        try:
+            value = self._cache[name]
+        except KeyError:
+            value = self._cache[name] = _read_only(method(self))
+        return _fresh_copy(value)
+
+    return property(getter)
+
+
+def _parsed_dict(fsf):
+    # Dict of parsed contents from FSF object, as from ``fsf_to_dict``.
+    fsf_dict = {}
+    for key in FSF._known_keys:
+        value = getattr(fsf, key, None)
+        if value is not None:
+            fsf_dict[key] = value
+    return fsf_dict
+
+
+def _freeze(fsf):
+    """ Make top-level dicts and lists of `fsf` read-only, return `fsf`
+
+    Dicts become read-only mappings, lists become tuples, and arrays become
+    read-only.  Copies of `fsf` (see :meth:`FSF.copy`) are not read-only.
+    """
+    for key in FSF._known_keys:
+        value = fsf.__dict__.get(key)
+        if isinstance(value, dict):
+            fsf.__dict__[key] = _read_only(value)
+        elif isinstance(value, list):
+            fsf.__dict__[key] = tuple(value)
+    return fsf
+
+
+def _design_filename(path):
+    # Design filename for design file or FEAT directory `path`
+    if isdir(path):  # Could be FEAT directory
+        return pjoin(path, 'design.fsf')
+    return path
 
 
 class FSF(object):
     """ Encapsulate FSF contents
+
+    Parameters
+    ----------
+    contents : str
+        Contents of FSF design file.
+    arrays : {False, True}, optional
+        If True, parse numbered matrix fields such as ``evg1.1`` and
+        ``con_real1.1`` straight into arrays in the ``fmri_arrays``
+        attribute, rather than into ``fmri``.  The matrix properties
+        (``evgs``, ``groupmem``, contrasts) then use these (read-only)
+        arrays.
+
+    Notes
+    -----
+    The values of the derived properties (``contrasts_real``, ``evgs`` and so
+    on) are cached on first access.  Each access returns new dicts, but the
+    arrays are read-only, and shared between callers.  Use ``set_fields`` to
+    modify ``fmri`` and keep these values up to date, or call ``invalidate``
+    after modifying ``fmri`` directly.
     """
 
-    _known_keys = list(FEAT_TOP_TYPES)
+    _known_keys = list(FEAT_TOP_TYPES) + ['fmri_arrays']
 
-    def __init__(self, contents):
+    _derived = ('contrasts_real', 'contrasts_orig', 'evgs', 'n_events',
+                'events', 'groupmem')
+
+    def __init__(self, contents, arrays=False):
+        self._set_parsed(contents, fsf_to_dict(contents, arrays))
+
+    def _set_parsed(self, contents, fsf_dict):
         self.contents = contents
-        for key, value in fsf_to_dict(contents).items():
+        self.fmri_arrays = None
+        for key, value in fsf_dict.items():
             if key not in self._known_keys:
                 raise ValueError('Unknown key {}'.format(key))
             self.__dict__[key] = value
+        self.invalidate()
         self.filename = None
 
     @classmethod
-    def from_string(cls, in_str):
+    def _from_parsed(cls, contents, fsf_dict):
+        """ Initialize from `contents` and result of parsing `contents`
+        """
+        fsf = cls.__new__(cls)
+        fsf._set_parsed(contents, fsf_dict)
+        return fsf
+
+    @classmethod
+    def from_string(cls, in_str, arrays=False):
         """ Initialize from string `in_str`, return as FSF object
+
+        See class docstring for `arrays` parameter.
         """
-        return cls(in_str)
+        return cls(in_str, arrays)
 
     @classmethod
-    def from_file(cls, file_ish):
+    def from_file(cls, file_ish, arrays=False, cache=None):
         """ Initialize from contents of `file_ish`, return as FSF object
 
         Set filename if available.
@@ -51,23 +204,91 @@ class FSF(object):
             FEAT directory, in which case we assume ``design.fsf`` as the
             design filename.  Can also be file-like object implementing
             ``read`` method.
+        arrays : {False, True}, optional
+            See class docstring.
+        cache : None or bool or 'user' or store, optional
+            If None or False, parse the file contents.  If True, use cached
+            parse results from a sidecar file next to the design file (see
+            :class:`fslutils.cache.SidecarStore`), writing the sidecar if
+            necessary.  If 'user', use the user cache directory (see
+            :func:`fslutils.cache.user_store`).  Otherwise, a cache store
+            object, as for :func:`fslutils.cache.cached_fsf_dict`.  We do not
+            use the cache for file-like `file_ish`.
         """
         if hasattr(file_ish, 'read'):
             filename = getattr(file_ish, 'name', None)
             contents = file_ish.read()
+            cache = None
+        else:
+            filename = _design_filename(file_ish)
+            contents = read_file(filename)
+        if cache is None or cache is False:
+            fsf = cls.from_string(contents, arrays)
         else:
-            if isdir(file_ish):  # Could be FEAT directory
-                file_ish = pjoin(file_ish, 'design.fsf')
-            filename = file_ish
-            contents = read_file(file_ish)
-        fsf = cls.from_string(contents)
+            fsf = cls._from_parsed(
+                contents, cached_fsf_dict(filename, contents, arrays, cache))
         fsf.filename = filename
         return fsf
 
-    def _numbered_vals(self, prefix):
-        fsfd = self.fmri
-        keys = [k for k in fsfd if k.startswith(prefix)]
-        return [fsfd[k] for k in sorted(keys, key=_end_number)]
+    def invalidate(self):
+        """ Reset cached derived values after change to ``fmri``
+        """
+        self._index = _numbered_index(getattr(self, 'fmri', {}))
+        self._cache = {}
+
+    def precompute(self):
+        """ Calculate and cache all derived properties, return self
+        """
+        for name in self._derived:
+            getattr(self, name)
+        return self
+
+    def copy(self):
+        """ Return copy of this object
+
+        The copy has its own ``fmri`` and ``fmri_arrays`` dicts and top-level
+        lists, so you can modify these without affecting this object, but it
+        shares the (read only) arrays and the cached derived values.
+        """
+        fsf = self.__class__.__new__(self.__class__)
+        fsf.__dict__.update(self.__dict__)
+        for key, value in self.__dict__.items():
+            if key in FEAT_TOP_TYPES:
+                fsf.__dict__[key] = FEAT_TOP_TYPES[key](value)
+        if self.fmri_arrays is not None:
+            fsf.fmri_arrays = {name: _read_only(arr) for name, arr
+                               in self.fmri_arrays.items()}
+        # Cached values are read-only (see ``_cached_property``).
+        fsf._cache = dict(self._cache)
+        return fsf
+
+    def compact(self, keep_contents='compress'):
+        """ Return :class:`CompactFSF` copy of this object
+
+        See :class:`CompactFSF` for `keep_contents`.
+        """
+        return CompactFSF.from_fsf(self, keep_contents)
+
+    def set_fields(self, fields):
+        """ Set values in ``fmri`` from dict `fields`, reset derived values
+
+        Parameters
+        ----------
+        fields : dict
+            Dict with field names as keys and field values as values.
+        """
+        if self.fmri_arrays is not None:
+            for field_name in fields:
+                if _matrix_field(field_name) is not None:
+                    raise ValueError(
+                        'Cannot set matrix field {} in arrays mode'.format(
+                            field_name))
+        self.fmri.update(fields)
+        self.invalidate()
+
+    def _numbered_vals(self, stem):
+        # Values for fields `stem` followed by a number, sorted by number.
+        return [value for number, value in self._index.get(stem, [])]
 
     def _get_contrasts(self, suffix='real'):
         contrasts = OrderedDict()
@@ -76,22 +297,32 @@ class FSF(object):
         names = self._numbered_vals('conname_{}.'.format(suffix))
         if not 'conname_{}.1'.format(suffix) in fsfd:
             return contrasts
+        if self.fmri_arrays is not None:
+            # Row i of array is contrast i + 1.  Contrasts after the last
+            # row have no fields, so are empty, as for fields in ``fmri``.
+            con_arr = self.fmri_arrays.get('con_' + suffix, np.zeros((0, 0)))
+            for i, name in enumerate(names):
+                contrasts[name] = (con_arr[i] if i < len(con_arr)
+                                   else np.array([]))
+            return contrasts
         for i, name in enumerate(names):
             contrasts[name] = np.array(
                 # 1-based indexing in FSF file
                 self._numbered_vals('con_{}{}.'.format(suffix, i + 1)))
         return contrasts
 
-    @property
+    @_cached_property
     def contrasts_real(self):
         return self._get_contrasts('real')
 
-    @property
+    @_cached_property
     def contrasts_orig(self):
         return self._get_contrasts('orig')
 
-    @property
+    @_cached_property
     def evgs(self):
+        if self.fmri_arrays is not None:
+            return self.fmri_arrays.get('evg', np.array([]))
         evgs = []
         # 1-based indexing in FSF file
         evg_no = 1
@@ -103,11 +334,11 @@ class FSF(object):
             evg_no += 1
         return np.array(evgs)
 
-    @property
+    @_cached_property
     def n_events(self):
         return len(self._numbered_vals('conname_real.'))
 
-    @property
+    @_cached_property
     def events(self):
         events = OrderedDict()
         fsfd = self.fmri
@@ -125,11 +356,610 @@ class FSF(object):
             events[name] = event
         return events
 
-    @property
+    @_cached_property
     def groupmem(self):
+        if self.fmri_arrays is not None:
+            return self.fmri_arrays.get('groupmem', np.array([]))
         return np.array(self._numbered_vals('groupmem.'))
 
 
+FIELD_NAME = re.compile(r'[A-Za-z0-9_.]+$')
+
+
+def _match_at(contents, offset):
+    # Top name, field and unquoted contents of definition at `offset`
+    top_name, field_name, value = _DEF_ALL_RE.match(contents, offset).groups()
+    return top_name, field_name, _unquote(value)
+
+
+def _top_offsets(contents, top_name):
+    # Dict of field name: offset of ``set`` definition for fields in
+    # `top_name`, in file order.  We search for the definitions after a
+    # newline, because the literal prefix makes the search much faster than
+    # a line-start anchor; we prepend a newline to find a definition on the
+    # first line.  The offset of the newline in the prepended string is the
+    # offset of the definition in `contents`.
+    regex = re.compile(r'\nset {}\((?P<field>[A-Za-z0-9_.]+)\) '.format(
+        re.escape(top_name)))
+    offsets = {}
+    for match in regex.finditer('\n' + contents):
+        offsets[match.group('field')] = match.start()
+    return offsets
+
+
+def _find_def(contents, top_name, field_name):
+    # Offset of last ``set`` definition of `field_name` in `top_name`, or None
+    if FIELD_NAME.match(field_name) is None:
+        return None
+    target = 'set {}({}) '.format(top_name, field_name)
+    offset = contents.rfind('\n' + target)
+    if offset != -1:
+        return offset + 1
+    return 0 if contents.startswith(target) else None
+
+
+class _LazyFields(MutableMapping):
+    """ Mapping of field names to values, decoding values on first access
+
+    We find unnumbered fields with a string search on first access.  We find
+    all the fields in the top when we need them; this is when you access a
+    numbered field, iterate, or delete a field.  We decode all fields in the
+    same family together, where the family of a field is its name with
+    numbers replaced by ``#``.  For example, accessing ``evg1.2`` decodes all
+    of the ``evg#.#`` fields.
+    """
+
+    def __init__(self, contents, top_name):
+        """ Initialize mapping
+
+        Parameters
+        ----------
+        contents : str
+            Contents of FSF file.
+        top_name : str
+            Name of top, such as ``fmri``, for the fields in this mapping.
+        """
+        self._contents = contents
+        self._top_name = top_name
+        # Fields in file order; offsets of undecoded fields, None otherwise.
+        # None until we find all fields.
+        self._offsets = None
+        self._values = {}
+        self._families = None
+
+    def _all_offsets(self):
+        if self._offsets is None:
+            offsets = _top_offsets(self._contents, self._top_name)
+            for name in self._values:
+                offsets[name] = None
+            self._offsets = offsets
+        return self._offsets
+
+    def _offset(self, field_name):
+        if self._offsets is None:
+            return _find_def(self._contents, self._top_name, field_name)
+        return self._offsets.get(field_name)
+
+    def _decode(self, field_name, offset):
+        value = _match_at(self._contents, offset)[2]
+        self._values[field_name] = _infer_converter(field_name)(value)
+        if self._offsets is not None:
+            self._offsets[field_name] = None
+
+    def _decode_family(self, field_name):
+        offsets = self._all_offsets()
+        if self._families is None:
+            self._families = {}
+            for name, offset in offsets.items():
+                if offset is not None:
+                    self._families.setdefault(
+                        DIGITS.sub('#', name), []).append(name)
+        for name in self._families.pop(DIGITS.sub('#', field_name)):
+            offset = offsets.get(name)
+            if offset is not None:
+                self._decode(name, offset)
+
+    def __getitem__(self, field_name):
+        try:
+            return self._values[field_name]
+        except KeyError:
+            pass
+        offset = self._offset(field_name)
+        if offset is None:
+            raise KeyError(field_name)
+        if DIGITS.search(field_name) is None:
+            self._decode(field_name, offset)
+        else:
+            self._decode_family(field_name)
+        return self._values[field_name]
+
+    def __setitem__(self, field_name, value):
+        self._values[field_name] = value
+        if self._offsets is not None:
+            self._offsets[field_name] = None
+
+    def __delitem__(self, field_name):
+        del self._all_offsets()[field_name]
+        self._values.pop(field_name, None)
+
+    def __contains__(self, field_name):
+        if self._offsets is None:
+            return (field_name in self._values or
+                    self._offset(field_name) is not None)
+        return field_name in self._offsets
+
+    def __iter__(self):
+        return iter(self._all_offsets())
+
+    def __len__(self):
+        return len(self._all_offsets())
+
+    def __repr__(self):
+        return '{}({} fields)'.format(self.__class__.__name__, len(self))
+
+
+class LazyFSF(FSF):
+    """ FSF object decoding fields on first access
+
+    At load, we only store `contents`.  We find and decode the tops (such as
+    ``fmri`` and ``feat_files``) when each is first accessed.  We parse and
+    convert fields in ``fmri`` when first accessed, along with all other
+    fields in the same numbered family (such as ``evg#.#``).  Otherwise the
+    object has the same interface as :class:`FSF`.
+
+    Parameters
+    ----------
+    contents : str
+        Contents of FSF design file.
+    arrays : {False}, optional
+        Lazy objects do not support arrays mode; must be False.
+    """
+
+    def __init__(self, contents, arrays=False):
+        if arrays:
+            raise ValueError('LazyFSF does not support arrays mode')
+        self.contents = contents
+        self.fmri_arrays = None
+        self.invalidate()
+        self.filename = None
+
+    @classmethod
+    def _from_parsed(cls, contents, fsf_dict):
+        raise ValueError('LazyFSF does not use parse caches')
+
+    def invalidate(self):
+        """ Reset cached derived values after change to ``fmri``
+        """
+        # Build index of numbered fields on first use, to avoid decoding.
+        self._index = None
+        self._cache = {}
+
+    def __getattr__(self, name):
+        # Find tops on first access.
+        if name not in FEAT_TOP_TYPES or 'contents' not in self.__dict__:
+            raise AttributeError(name)
+        contents = _unix_newlines(self.contents)
+        if FEAT_TOP_TYPES[name] is dict:
+            if '\nset {}('.format(name) not in '\n' + contents:
+                raise AttributeError(name)
+            value = _LazyFields(contents, name)
+        else:
+            offsets = _top_offsets(contents, name)
+            if not offsets:
+                raise AttributeError(name)
+            value = []
+            for i, offset in enumerate(offsets.values()):
+                top_name, field_name, item = _match_at(contents, offset)
+                # 1-based indices in file
+                assert int(field_name) - 1 == i
+                value.append(item)
+        self.__dict__[name] = value
+        return value
+
+    def _numbered_vals(self, stem):
+        # Values for fields `stem` followed by a number, sorted by number.
+        fmri = self.fmri
+        if self._index is None:
+            self._index = _numbered_index(dict((k, k) for k in fmri))
+        return [fmri[name] for number, name in self._index.get(stem, [])]
+
+
+class CompactFSF(FSF):
+    """ FSF object with compact memory representation
+
+    Compared to :class:`FSF`, we share (intern) field name strings between
+    instances, compress or drop the design file contents, and only index the
+    numbered fields when a derived property needs them.  Use with
+    ``arrays=True`` to store the matrix fields as arrays rather than as
+    Python numbers, for the smallest memory use.
+
+    Parameters
+    ----------
+    contents : str
+        Contents of FSF design file.
+    arrays : {False, True}, optional
+        See :class:`FSF`.
+    keep_contents : {'compress', True, False}, optional
+        If 'compress', store `contents` compressed with zlib, and decompress
+        on access to the ``contents`` attribute.  If True, store `contents`
+        unchanged.  If False, drop `contents`; the ``contents`` attribute is
+        then None.
+    """
+
+    def __init__(self, contents, arrays=False, keep_contents='compress'):
+        self._set_keep(keep_contents)
+        super(CompactFSF, self).__init__(contents, arrays)
+
+    def invalidate(self):
+        """ Reset cached derived values after change to ``fmri``
+        """
+        # Build index of numbered fields on first use, to save memory.
+        self._index = None
+        self._cache = {}
+
+    def _numbered_vals(self, stem):
+        # Values for fields `stem` followed by a number, sorted by number.
+        if self._index is None:
+            self._index = _numbered_index(self.fmri)
+        return super(CompactFSF, self)._numbered_vals(stem)
+
+    def _set_keep(self, keep_contents):
+        if keep_contents not in ('compress', True, False):
+            raise ValueError("keep_contents should be one of 'compress', "
+                             "True, False")
+        self._keep_contents = keep_contents
+
+    @property
+    def contents(self):
+        """ Contents of design file, or None if dropped
+        """
+        stored = self._stored_contents
+        if isinstance(stored, bytes):
+            return zlib.decompress(stored).decode('utf-8')
+        return stored
+
+    @contents.setter
+    def contents(self, contents):
+        keep = getattr(self, '_keep_contents', 'compress')
+        if contents is None or keep is False:
+            contents = None
+        elif keep == 'compress':
+            contents = zlib.compress(contents.encode('utf-8'))
+        self._stored_contents = contents
+
+    def _set_parsed(self, contents, fsf_dict):
+        fsf_dict = dict(fsf_dict)
+        for key in ('fmri', 'fmri_arrays'):
+            if fsf_dict.get(key) is not None:
+                fsf_dict[key] = {sys.intern(name): value
+                                 for name, value in fsf_dict[key].items()}
+        super(CompactFSF, self)._set_parsed(contents, fsf_dict)
+
+    @classmethod
+    def from_fsf(cls, fsf, keep_contents='compress'):
+        """ Initialize from FSF object `fsf`, return as CompactFSF object
+
+        See class docstring for `keep_contents`.
+        """
+        fsf_dict = _parsed_dict(fsf)
+        compact = cls.__new__(cls)
+        compact._set_keep(keep_contents)
+        compact._set_parsed(fsf.contents, fsf_dict)
+        for key in FEAT_TOP_TYPES:
+            if FEAT_TOP_TYPES[key] is list and key in fsf_dict:
+                setattr(compact, key, list(fsf_dict[key]))
+        compact.filename = fsf.filename
+        return compact
+
+    @classmethod
+    def from_string(cls, in_str, arrays=False, keep_contents='compress'):
+        """ Initialize from string `in_str`, return as CompactFSF object
+
+        See class docstring for `arrays` and `keep_contents` parameters.
+        """
+        return cls(in_str, arrays, keep_contents)
+
+    @classmethod
+    def from_file(cls, file_ish, arrays=False, cache=None,
+                  keep_contents='compress'):
+        """ Initialize from contents of `file_ish`, return as CompactFSF
+
+        See :meth:`FSF.from_file` for `file_ish`, `arrays` and `cache`, and
+        class docstring for `keep_contents`.
+        """
+        return cls.from_fsf(FSF.from_file(file_ish, arrays, cache),
+                            keep_contents)
+
+
+class MemoLoader(LRUCache):
+    """ Load FSF objects from files, with in-memory LRU cache
+
+    We key the cache on the real path of the design file (resolving FEAT
+    directories and symlinks), and its inode, size and modification time, so
+    a changed file gets a new entry.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of FSF objects to keep.  You can change this value
+        with the ``maxsize`` attribute.
+    copy : {True, False}, optional
+        If True, return a copy (see :meth:`FSF.copy`) of the cached object
+        for each call, otherwise, return the cached object itself.  A cached
+        object is shared between callers, so it is read-only: ``fmri`` is a
+        read-only mapping, and the top-level lists, such as ``feat_files``,
+        are tuples.
+    """
+
+    def __init__(self, maxsize=128, copy=True):
+        super(MemoLoader, self).__init__(maxsize)
+        self.copy = copy
+
+    def __call__(self, file_ish, arrays=False, cache=None):
+        """ Load FSF object from `file_ish`, using in-memory cache
+
+        See :meth:`FSF.from_file` for parameters.  We do not cache loads from
+        file-like objects.
+        """
+        if hasattr(file_ish, 'read'):
+            return FSF.from_file(file_ish, arrays, cache)
+        filename = _design_filename(file_ish)
+        key = _file_identity(filename) + (bool(arrays),)
+        fsf = self.get(key)
+        if fsf is None:
+            fsf = _freeze(FSF.from_file(filename, arrays, cache))
+            # Do not store if file changed as we read it.
+            if _file_identity(filename) + (bool(arrays),) == key:
+                fsf = self.put(key, fsf)
+        if not self.copy:
+            return fsf
+        fsf = fsf.copy()
+        fsf.filename = filename
+        return fsf
+
+
+LoadResult = namedtuple('LoadResult', ['path', 'fsf', 'error'])
+
+
+def _load_chunk(paths, arrays, cache):
+    """ Load and parse FSF files `paths` in worker process
+
+    Return list of ``(path, payload, error)`` tuples, where `payload` is None
+    or a tuple of the design filename, its contents and the parsed contents
+    encoded as arrays, and `error` is None or the exception from loading.
+    """
+    results = []
+    for path in paths:
+        try:
+            filename = _design_filename(path)
+            contents = read_file(filename)
+            if cache is None or cache is False:
+                fsf_dict = fsf_to_dict(contents, arrays)
+            else:
+                fsf_dict = cached_fsf_dict(filename, contents, arrays, cache)
+        except Exception as err:
+            results.append((path, None, err))
+            continue
+        # Arrays are faster to send between processes than dicts of values.
+        encoded = _fsf_to_arrays(fsf_dict)
+        if encoded is None:
+            payload = (filename, contents, fsf_dict, False)
+        else:
+            payload = (filename, contents, encoded, True)
+        results.append((path, payload, None))
+    return results
+
+
+def _result_from_chunk(path, payload, error):
+    if error is not None:
+        return LoadResult(path, None, error)
+    filename, contents, parsed, is_encoded = payload
+    fsf = FSF._from_parsed(contents, _arrays_to_fsf(parsed) if is_encoded
+                           else parsed)
+    fsf.filename = filename
+    return LoadResult(path, fsf, None)
+
+
+def iload_many(paths, workers=None, arrays=False, cache=None, ordered=True,
+               chunksize=16):
+    """ Load FSF files `paths` in process pool, yield results
+
+    Parameters
+    ----------
+    paths : iterable
+        Filenames of design files, or FEAT directories, as for
+        :meth:`FSF.from_file`.
+    workers : None or int, optional
+        Number of worker processes.  If None, use number of CPUs.  If 1 or
+        less, load in this process.
+    arrays : {False, True}, optional
+        See :meth:`FSF.from_file`.
+    cache : None or bool or 'user' or store, optional
+        See :meth:`FSF.from_file`.  The worker processes use copies of any
+        store object, so statistics in the store do not change.
+    ordered : {True, False}, optional
+        If True, yield results in the order of `paths`.  Otherwise, yield
+        results as soon as they are ready.
+    chunksize : int, optional
+        Number of paths for each worker process task.
+
+    Yields
+    ------
+    result : LoadResult
+        Named tuple with fields ``path`` (input path), ``fsf`` (loaded FSF
+        object, or None if loading failed) and ``error`` (None, or exception
+        from loading).
+
+    Notes
+    -----
+    Converters registered with
+    :func:`fslutils.featparser.register_converter` only apply in worker
+    processes that inherit them, as they do with the ``fork`` process start
+    method.
+    """
+    paths = list(paths)
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+    if workers is not None and workers <= 1:
+        for chunk in chunks:
+            for item in _load_chunk(chunk, arrays, cache):
+                yield _result_from_chunk(*item)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_load_chunk, chunk, arrays, cache)
+                   for chunk in chunks]
+        for future in (futures if ordered else as_completed(futures)):
+            for item in future.result():
+                yield _result_from_chunk(*item)
+
+
+def load_many(paths, workers=None, arrays=False, cache=None, chunksize=16):
+    """ Load FSF files `paths` in process pool, return results in order
+
+    See :func:`iload_many` for parameters.
+
+    Returns
+    -------
+    results : list
+        List of :class:`LoadResult` named tuples, one per path in `paths`, in
+        the same order.
+    """
+    return list(iload_many(paths, workers, arrays, cache, True, chunksize))
+
+
+def _read_design(path, read=read_file):
+    # Return design filename and contents for design file or FEAT directory
+    filename = _design_filename(path)
+    return filename, read(filename)
+
+
+async def _aparse(filename, contents, arrays, executor):
+    # Parse `contents` in `executor`, return FSF object
+    fsf_dict = await asyncio.get_running_loop().run_in_executor(
+        executor, fsf_to_dict, contents, arrays)
+    fsf = FSF._from_parsed(contents, fsf_dict)
+    fsf.filename = filename
+    return fsf
+
+
+async def aload(path, arrays=False, executor=None, read=read_file):
+    """ Load FSF object from file `path` in coroutine
+
+    We read the file in a thread, and parse in `executor`, so the event loop
+    can run other tasks in the meantime.
+
+    Parameters
+    ----------
+    path : str
+        Filename of design file, or FEAT directory containing ``design.fsf``.
+    arrays : {False, True}, optional
+        See :meth:`FSF.from_file`.
+    executor : None or executor, optional
+        Executor in which to parse the file contents.  If None, use the event
+        loop default executor.
+    read : callable, optional
+        Callable accepting filename and returning file contents as string.
+
+    Returns
+    -------
+    fsf : FSF
+        Loaded FSF object.
+    """
+    filename, contents = await asyncio.get_running_loop().run_in_executor(
+        None, _read_design, path, read)
+    return await _aparse(filename, contents, arrays, executor)
+
+
+async def aload_many(paths, limit=16, arrays=False, executor=None,
+                     read=read_file):
+    """ Load FSF objects from files `paths` in coroutine, overlapping reads
+
+    We read up to `limit` files at the same time, in a pool of threads, and
+    parse the contents in `executor`.  This is useful for files on high
+    latency file systems, where waiting for the files dominates parsing time.
+
+    Parameters
+    ----------
+    paths : iterable
+        Filenames of design files, or FEAT directories.
+    limit : int, optional
+        Maximum number of files to read at the same time.
+    arrays : {False, True}, optional
+        See :meth:`FSF.from_file`.
+    executor : None or executor, optional
+        Executor in which to parse the file contents.  If None, use the event
+        loop default executor.
+    read : callable, optional
+        Callable accepting filename and returning file contents as string.
+
+    Returns
+    -------
+    results : list
+        List of :class:`LoadResult` named tuples, one per path in `paths`, in
+        the same order.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(limit)
+
+    async def load_one(path, reader):
+        try:
+            async with semaphore:
+                filename, contents = await loop.run_in_executor(
+                    reader, _read_design, path, read)
+            fsf = await _aparse(filename, contents, arrays, executor)
+        except Exception as err:
+            return LoadResult(path, None, err)
+        return LoadResult(path, fsf, None)
+
+    with ThreadPoolExecutor(limit) as reader:
+        return await asyncio.gather(*[load_one(path, reader)
+                                      for path in paths])
+
+
+def dumps(fsf):
+    """ Return contents of FSF design file for FSF object `fsf`
+
+    This is the inverse of :func:`loads`.  We write the current field values,
+    including changes after loading, rather than the original ``contents``.
+    See :func:`fslutils.featparser.dict_to_fsf` for details of the output.
+
+    Parameters
+    ----------
+    fsf : FSF
+        FSF object to write.
+
+    Returns
+    -------
+    contents : str
+        Contents of design file.
+    """
+    return dict_to_fsf(_parsed_dict(fsf))
+
+
+def dump(fsf, file_ish):
+    """ Write FSF object `fsf` to `file_ish` as FSF design file
+
+    This is the inverse of :func:`load`.
+
+    Parameters
+    ----------
+    fsf : FSF
+        FSF object to write.
+    file_ish : object
+        Can be string, giving filename of design file, or of an existing FEAT
+        directory, in which case we write ``design.fsf`` in that directory.
+        Can also be file-like object, open in text mode, implementing
+        ``write`` method.
+    """
+    contents = dumps(fsf)
+    if hasattr(file_ish, 'write'):
+        file_ish.write(contents)
+        return
+    with open(_design_filename(file_ish), 'wt') as fobj:
+        fobj.write(contents)
+
+
 load = FSF.from_file
 
+memo_load = MemoLoader()
+
 loads = FSF.from_string
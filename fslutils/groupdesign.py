@@ -0,0 +1,215 @@
+""" Build higher-level design matrix and contrast files from FSF designs
+
+For higher-level (group) analyses, the FEAT design matrix is the matrix of EV
+values in the design, so we can build ``design.mat``, ``design.con`` and
+``design.grp`` without running ``feat_model``.  Build many designs with the
+same shape, such as permuted or bootstrapped designs, in one go with
+:func:`group_designs`.
+"""
+
+import os
+from os.path import join as pjoin
+from collections import namedtuple
+
+import numpy as np
+
+from .featparser import iter_mat, _ppheights
+
+GroupDesign = namedtuple('GroupDesign', ['matrix', 'ppheights', 'contrasts',
+                                         'con_names', 'con_ppheights',
+                                         'groupmem'])
+GroupDesign.__doc__ = """ Higher-level design matrix, contrasts and groups
+
+For :func:`group_designs`, each array has an extra first dimension, over
+designs.
+
+Attributes
+----------
+matrix : array
+    Design matrix, shape (n_points, n_waves).
+ppheights : array
+    Peak-to-peak heights of design matrix columns, shape (n_waves,).
+contrasts : array
+    Contrast matrix, shape (n_contrasts, n_waves).
+con_names : list
+    Contrast names.
+con_ppheights : array
+    Peak-to-peak heights of contrast regressors (matrix @ contrasts.T), shape
+    (n_contrasts,).
+groupmem : array
+    Variance group membership for each point, shape (n_points,).
+"""
+
+
+def _fsf_parts(fsf, con):
+    # Matrix, contrasts, contrast names, groupmem from higher-level `fsf`
+    if fsf.fmri.get('level', 1) == 1:
+        raise ValueError('Design is not a higher-level design')
+    contrasts = (fsf.contrasts_real if con == 'real'
+                 else fsf.contrasts_orig)
+    matrix = np.asarray(fsf.evgs, dtype=float)
+    n_waves = matrix.shape[1]
+    con_matrix = (np.array(list(contrasts.values()), dtype=float)
+                  if contrasts else np.zeros((0, n_waves)))
+    groupmem = fsf.groupmem
+    if len(groupmem) == 0:
+        groupmem = np.ones(len(matrix), dtype=int)
+    return matrix, con_matrix, list(contrasts), np.asarray(groupmem)
+
+
+def group_designs(designs, contrasts=None, con_names=None, groupmem=None,
+                  con='real'):
+    """ Build stack of higher-level designs in one set of array operations
+
+    Parameters
+    ----------
+    designs : sequence or array
+        Either a sequence of higher-level FSF objects, all with the same
+        number of points, EVs and contrasts, or an array of design matrices,
+        shape (N, n_points, n_waves), such as permuted or bootstrapped
+        versions of a design matrix.
+    contrasts : None or array, optional
+        For array `designs`, contrast matrix shape (n_contrasts, n_waves) for
+        all designs, or (N, n_contrasts, n_waves).  None means no contrasts.
+        Ignored for FSF `designs`.
+    con_names : None or sequence, optional
+        For array `designs`, contrast names.  None gives names ``C1``,
+        ``C2``, and so on.  Ignored for FSF `designs`.
+    groupmem : None or array, optional
+        For array `designs`, group membership, shape (n_points,) for all
+        designs, or (N, n_points).  None means all points in group 1.
+        Ignored for FSF `designs`.
+    con : {'real', 'orig'}, optional
+        For FSF `designs`, which contrasts to use.
+
+    Returns
+    -------
+    stacked : GroupDesign
+        Named tuple where each array has an extra first dimension of length
+        N, over designs.  ``con_names`` is a single list for all designs.
+    """
+    if isinstance(designs, np.ndarray):
+        matrices = np.asarray(designs, dtype=float)
+        n_designs, n_points, n_waves = matrices.shape
+        if contrasts is None:
+            contrasts = np.zeros((0, n_waves))
+        con_matrices = np.broadcast_to(
+            contrasts, (n_designs,) + np.shape(contrasts)[-2:])
+        if con_names is None:
+            con_names = ['C{}'.format(i + 1)
+                         for i in range(con_matrices.shape[1])]
+        if groupmem is None:
+            groupmem = np.ones(n_points, dtype=int)
+        groupmems = np.broadcast_to(groupmem, (n_designs, n_points))
+    else:
+        parts = [_fsf_parts(fsf, con) for fsf in designs]
+        if len(parts) == 0:
+            raise ValueError('Need at least one design')
+        shapes = set((p[0].shape, p[1].shape) for p in parts)
+        if len(shapes) > 1:
+            raise ValueError('Designs should have the same number of points, '
+                             'EVs and contrasts')
+        matrices = np.stack([p[0] for p in parts])
+        con_matrices = np.stack([p[1] for p in parts])
+        con_names = parts[0][2]
+        groupmems = np.stack([p[3] for p in parts])
+    n_designs, n_points, n_waves = matrices.shape
+    if con_matrices.strides[0] == 0:  # Same contrasts for all designs
+        con_regressors = (matrices.reshape((-1, n_waves)) @
+                          con_matrices[0].T).reshape(
+                              (n_designs, n_points, -1))
+    else:
+        con_regressors = matrices @ np.swapaxes(con_matrices, -1, -2)
+    return GroupDesign(matrices, _ppheights(matrices), con_matrices,
+                       list(con_names), _ppheights(con_regressors),
+                       groupmems)
+
+
+def group_design(fsf, con='real'):
+    """ Build higher-level design matrix, contrasts, groups from `fsf`
+
+    Parameters
+    ----------
+    fsf : FSF
+        Higher-level design.
+    con : {'real', 'orig'}, optional
+        Which contrasts to use.
+
+    Returns
+    -------
+    design : GroupDesign
+        Named tuple with design matrix and other outputs.
+    """
+    return unstack(group_designs([fsf], con=con))[0]
+
+
+def unstack(stacked):
+    """ Return list of GroupDesign, one per design in `stacked`
+    """
+    return [GroupDesign(stacked.matrix[i], stacked.ppheights[i],
+                        stacked.contrasts[i], stacked.con_names,
+                        stacked.con_ppheights[i], stacked.groupmem[i])
+            for i in range(len(stacked.matrix))]
+
+
+def format_mat(design):
+    """ Return contents of ``design.mat`` file for GroupDesign `design`
+    """
+    return ''.join(iter_mat(design.matrix, design.ppheights))
+
+
+def format_con(design):
+    """ Return contents of ``design.con`` file for GroupDesign `design`
+
+    We do not write the ``/RequiredEffect`` field of FEAT ``.con`` files,
+    which depends on FEAT's noise model for the efficiency calculation.
+    """
+    n_contrasts, n_waves = design.contrasts.shape
+    lines = ['/ContrastName{}\t{}'.format(i + 1, name)
+             for i, name in enumerate(design.con_names)]
+    lines += ['/NumWaves\t{}'.format(n_waves),
+              '/NumContrasts\t{}'.format(n_contrasts),
+              '/PPheights\t\t' + '\t'.join(
+                  '%e' % v for v in design.con_ppheights.tolist()),
+              '',
+              '/Matrix']
+    row_fmt = '%e\t' * n_waves + '\n'
+    return ('\n'.join(lines) + '\n' +
+            (row_fmt * n_contrasts) % tuple(design.contrasts.ravel().tolist()))
+
+
+def format_grp(design):
+    """ Return contents of ``design.grp`` file for GroupDesign `design`
+    """
+    n_points = len(design.groupmem)
+    return ('/NumWaves\t1\n/NumPoints\t{}\n\n/Matrix\n'.format(n_points) +
+            '{}\n' * n_points).format(*design.groupmem.tolist())
+
+
+def write_design(design, out_dir, basename='design'):
+    """ Write ``.mat``, ``.con``, ``.grp`` files for `design` in `out_dir`
+
+    Parameters
+    ----------
+    design : GroupDesign
+        Design to write.
+    out_dir : str
+        Output directory; we create it if it does not exist.
+    basename : str, optional
+        Filename without extension for the output files.
+
+    Returns
+    -------
+    fnames : list
+        Filenames of ``.mat``, ``.con`` and ``.grp`` files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    fnames = []
+    for ext, formatter in (('.mat', format_mat),
+                           ('.con', format_con),
+                           ('.grp', format_grp)):
+        fname = pjoin(out_dir, basename + ext)
+        with open(fname, 'wt') as fobj:
+            fobj.write(formatter(design))
+        fnames.append(fname)
+    return fnames
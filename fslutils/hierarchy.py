@@ -0,0 +1,192 @@
+""" Load trees of FEAT analyses, following inputs from group to first level
+"""
+
+from os.path import isdir, isfile, join as pjoin, realpath, dirname, splitext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .fsf import load as load_fsf
+from .matfile import load as load_mat
+
+
+def _mat_filename(path):
+    # Design matrix filename for FEAT directory or design filename `path`
+    if isdir(path):
+        return pjoin(path, 'design.mat')
+    return splitext(path)[0] + '.mat'
+
+
+def _analysis_dir(input_path, inputtype):
+    """ Return FEAT directory for analysis input `input_path`, or None
+
+    Parameters
+    ----------
+    input_path : str
+        Path from ``feat_files`` of higher-level analysis.
+    inputtype : int
+        Value of ``inputtype`` field of higher-level analysis. 1 means inputs
+        are FEAT directories; 2 means inputs are cope images.
+
+    Returns
+    -------
+    feat_dir : None or str
+        FEAT directory containing design for analysis generating
+        `input_path`, or None if we cannot find a design.
+    """
+    if inputtype == 1:
+        for candidate in (input_path, input_path + '.feat'):
+            if isfile(pjoin(candidate, 'design.fsf')):
+                return candidate
+        return None
+    # Cope image; look for containing .gfeat, then .feat directory.
+    parents = []
+    path = dirname(input_path)
+    while path != dirname(path):
+        parents.append(path)
+        path = dirname(path)
+    for suffix in ('.gfeat', '.feat'):
+        for parent in parents:
+            if (parent.endswith(suffix) and
+                    isfile(pjoin(parent, 'design.fsf'))):
+                return parent
+    return None
+
+
+class FeatNode(object):
+    """ Node in tree of FEAT analyses
+
+    Attributes
+    ----------
+    path : str
+        FEAT directory, or design filename, for this analysis.
+    fsf : None or FSF
+        Loaded design, or None if loading failed.
+    mat : None or dict
+        Loaded design matrix, or None if there is no design matrix file.
+    error : None or Exception
+        Error from loading design or design matrix, if any.
+    inputs : list
+        :class:`FeatNode` objects for analyses providing the inputs to this
+        analysis, in order of first use in ``feat_files``.  Inputs with no
+        design we can find are in `missing`.
+    missing : list
+        Paths in ``feat_files`` for which we could not find a design.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fsf = None
+        self.mat = None
+        self.error = None
+        self.inputs = []
+        self.missing = []
+        self._input_dirs = []
+
+    @property
+    def level(self):
+        """ Analysis level from design, or None if design not loaded
+        """
+        return None if self.fsf is None else self.fsf.fmri.get('level')
+
+    def walk(self):
+        """ Iterate over this node and all its inputs, depth first
+
+        We yield each node only once, even if it is an input to more than one
+        analysis.
+        """
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            yield node
+            stack.extend(reversed(node.inputs))
+
+    def at_level(self, level):
+        """ Return list of nodes in tree with analysis level `level`
+        """
+        return [node for node in self.walk() if node.level == level]
+
+    def __repr__(self):
+        return '{}({!r}, level={}, n_inputs={})'.format(
+            self.__class__.__name__, self.path, self.level, len(self.inputs))
+
+
+def _load_node(node, fsf_loader, mat_loader):
+    """ Load design and design matrix for `node`, find input directories
+    """
+    try:
+        node.fsf = fsf_loader(node.path)
+        mat_fname = _mat_filename(node.path)
+        if isfile(mat_fname):
+            node.mat = mat_loader(mat_fname)
+    except Exception as err:
+        node.error = err
+        return node
+    fmri = node.fsf.fmri
+    if fmri.get('level', 1) == 1:  # Inputs are 4D images
+        return node
+    inputtype = int(fmri.get('inputtype', 1))
+    for input_path in getattr(node.fsf, 'feat_files', []):
+        feat_dir = _analysis_dir(input_path, inputtype)
+        if feat_dir is None:
+            node.missing.append(input_path)
+        else:
+            node._input_dirs.append(feat_dir)
+    return node
+
+
+def load_hierarchy(path, workers=8, fsf_loader=load_fsf, mat_loader=load_mat):
+    """ Load tree of FEAT analyses starting at `path`
+
+    Starting at the analysis at `path`, we follow the ``feat_files`` inputs
+    of each higher-level analysis to the analyses that generated them, down
+    to the first-level analyses.  We load designs concurrently in a thread
+    pool.  Inputs used by more than one analysis (or more than once) share
+    one node, with one loaded design.
+
+    Parameters
+    ----------
+    path : str
+        FEAT directory, or design filename, of top analysis.
+    workers : int, optional
+        Number of threads with which to load designs.
+    fsf_loader : callable, optional
+        Callable accepting FEAT directory or design filename and returning
+        FSF object.  For example, use :data:`fslutils.fsf.memo_load` to share
+        loaded designs between calls.
+    mat_loader : callable, optional
+        Callable accepting design matrix filename and returning dict.
+
+    Returns
+    -------
+    root : FeatNode
+        Node for analysis at `path`.
+    """
+    nodes = {}
+
+    def get_node(path):
+        key = realpath(path)
+        is_new = key not in nodes
+        if is_new:
+            nodes[key] = FeatNode(path)
+        return nodes[key], is_new
+
+    root = get_node(path)[0]
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {executor.submit(_load_node, root, fsf_loader, mat_loader)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = future.result()
+                input_ids = set()
+                for feat_dir in node._input_dirs:
+                    input_node, is_new = get_node(feat_dir)
+                    if id(input_node) not in input_ids:
+                        input_ids.add(id(input_node))
+                        node.inputs.append(input_node)
+                    if is_new:
+                        pending.add(executor.submit(
+                            _load_node, input_node, fsf_loader, mat_loader))
+    return root
@@ -0,0 +1,301 @@
+""" Haemodynamic response function kernels for FEAT convolution codes
+
+FEAT's ``convolve`` field codes are:
+
+* 0 : no convolution;
+* 1 : Gaussian, with ``gausssigma`` and ``gaussdelay`` fields;
+* 2 : Gamma, with ``gammasigma`` and ``gammadelay`` fields;
+* 3 : Double-gamma HRF;
+* 4 : Gamma basis functions, with ``basisfnum`` and ``basisfwidth`` fields;
+* 5 : Sine basis functions, with ``basisfnum`` and ``basisfwidth`` fields;
+* 6 : FIR basis functions, with ``basisfnum`` and ``basisfwidth`` fields;
+* 7 : Optimal / custom basis functions, from the file in the ``bfcustom``
+  field.
+
+Codes 4 to 7 give more than one kernel, and therefore more than one design
+matrix column, for each EV.
+
+Use :data:`kernel_cache` to get kernels for many designs; this computes each
+kernel once, and shares the resulting read-only array.
+"""
+
+from math import lgamma
+
+import numpy as np
+
+from .supporting import LRUCache, _file_identity
+
+# Default parameters for convolution codes, from FEAT.
+GAUSS_DEFAULTS = {'sigma': 2.8, 'delay': 5.0}
+GAMMA_DEFAULTS = {'sigma': 3.0, 'delay': 6.0}
+BASIS_DEFAULTS = {'fnum': 3, 'fwidth': 15.0}
+# Double gamma; positive gamma, then negative gamma scaled by 1 / ratio.
+DOUBLE_GAMMA = {'delay1': 6.0, 'sigma1': 6 ** 0.5, 'delay2': 16.0,
+                'sigma2': 4.0, 'ratio': 6.0}
+# Time between samples in FLOBS basis function files.
+CUSTOM_BASIS_TRES = 0.05
+
+BASIS_CODES = (4, 5, 6, 7)
+
+# Parameters for each code, as (name, FSF field stem) pairs.
+_CODE_FIELDS = {
+    1: (('sigma', 'gausssigma'), ('delay', 'gaussdelay')),
+    2: (('sigma', 'gammasigma'), ('delay', 'gammadelay')),
+    4: (('fnum', 'basisfnum'), ('fwidth', 'basisfwidth')),
+    5: (('fnum', 'basisfnum'), ('fwidth', 'basisfwidth')),
+    6: (('fnum', 'basisfnum'), ('fwidth', 'basisfwidth')),
+    7: (('bfcustom', 'bfcustom'),),
+}
+
+
+def gamma_pdf(t, delay, sigma):
+    """ Gamma probability density at times `t` with mean `delay`, sd `sigma`
+
+    Parameters
+    ----------
+    t : array
+        Times in seconds.
+    delay : float
+        Mean of gamma distribution, in seconds.
+    sigma : float
+        Standard deviation of gamma distribution, in seconds.
+
+    Returns
+    -------
+    pdf : array
+        Density at `t`; 0 for `t` <= 0.
+    """
+    shape = (delay / sigma) ** 2
+    scale = sigma ** 2 / delay
+    t = np.asarray(t, dtype=float)
+    pdf = np.zeros(t.shape)
+    pos = t > 0
+    log_t = np.log(t[pos])
+    pdf[pos] = np.exp((shape - 1) * log_t - t[pos] / scale - lgamma(shape) -
+                      shape * np.log(scale))
+    return pdf
+
+
+def _kernel_length(code, params):
+    # Kernel duration in seconds covering effectively all of the response.
+    if code == 1:
+        return params['delay'] + 4 * params['sigma']
+    if code == 2:
+        return params['delay'] + 6 * params['sigma']
+    if code == 4:
+        return params['fwidth'] * 2
+    if code in (5, 6):
+        return params['fwidth']
+    return DOUBLE_GAMMA['delay2'] + 4 * DOUBLE_GAMMA['sigma2']
+
+
+def _code_params(code, params):
+    # Parameters for `code`, filled with defaults
+    params = params or {}
+    if code == 1:
+        return dict(GAUSS_DEFAULTS, **params)
+    if code == 2:
+        return dict(GAMMA_DEFAULTS, **params)
+    if code in (4, 5, 6):
+        params = dict(BASIS_DEFAULTS, **params)
+        params['fnum'] = int(params['fnum'])
+        return params
+    if code == 7:
+        if 'bfcustom' not in params:
+            raise ValueError('Need bfcustom file for convolution code 7')
+        return params
+    if code not in (0, 3):
+        raise ValueError('Convolution code {} not supported'.format(code))
+    return params
+
+
+def kernels(code, tres, phase=0., params=None):
+    """ Return convolution kernels for FEAT convolution `code`
+
+    Parameters
+    ----------
+    code : int
+        FEAT convolution code (see module docstring).
+    tres : float
+        Time between kernel samples, in seconds.
+    phase : float, optional
+        FEAT convolution phase in seconds.  Positive values shift the
+        convolved model earlier in time.
+    params : None or dict, optional
+        Parameters for the kernels, with keys ``sigma`` and ``delay`` for
+        Gaussian (code 1) and gamma (code 2) kernels; ``fnum`` (number of
+        functions) and ``fwidth`` (window in seconds) for gamma, sine and FIR
+        basis functions (codes 4 to 6); and ``bfcustom`` (basis function
+        filename) for custom basis functions (code 7).  Missing keys take
+        FEAT's defaults.
+
+    Returns
+    -------
+    kernels : array
+        Kernels sampled every `tres` seconds, shape (n_functions, n_samples).
+        Single kernels (codes 1 to 3), and gamma and FIR basis functions,
+        sum to 1.  Sine basis functions have maximum absolute value 1.  For
+        code 0, the kernel is a single 1, so convolution has no effect, apart
+        from the phase shift.  We cannot shift the model earlier in time for
+        code 0, so positive phases have no effect for this code.
+    """
+    params = _code_params(code, params)
+    if code == 0:
+        n_shift = int(round(-phase / tres))
+        kern = np.zeros((1, max(n_shift, 0) + 1))
+        kern[0, -1] = 1
+        return kern
+    if code == 7:
+        # Basis functions in columns, at their own sampling rate.
+        values = np.loadtxt(params['bfcustom'], ndmin=2)
+        file_times = np.arange(len(values)) * CUSTOM_BASIS_TRES
+        times = np.arange(0, file_times[-1] + tres, tres) + phase
+        return np.array([np.interp(times, file_times, col, left=0, right=0)
+                         for col in values.T])
+    times = np.arange(0, _kernel_length(code, params), tres) + phase
+    if code == 1:
+        kerns = np.exp(-(times - params['delay']) ** 2 /
+                       (2 * params['sigma'] ** 2))[None]
+        kerns[:, times < 0] = 0
+    elif code == 2:
+        kerns = gamma_pdf(times, params['delay'], params['sigma'])[None]
+    elif code == 3:
+        kerns = (gamma_pdf(times, DOUBLE_GAMMA['delay1'],
+                           DOUBLE_GAMMA['sigma1']) -
+                 gamma_pdf(times, DOUBLE_GAMMA['delay2'],
+                           DOUBLE_GAMMA['sigma2']) /
+                 DOUBLE_GAMMA['ratio'])[None]
+    elif code == 4:
+        # Gamma functions with means spaced over the window, sd half mean.
+        fnum, fwidth = params['fnum'], params['fwidth']
+        delays = fwidth * np.arange(1, fnum + 1) / (fnum + 1)
+        kerns = np.array([gamma_pdf(times, d, d / 2) for d in delays])
+    elif code == 5:
+        # Half-sine harmonics over the window.
+        harmonics = np.arange(1, params['fnum'] + 1)[:, None]
+        kerns = np.sin(np.pi * harmonics * times / params['fwidth'])
+        kerns[:, (times < 0) | (times >= params['fwidth'])] = 0
+        return kerns / np.abs(kerns).max(axis=1, keepdims=True)
+    else:
+        # Consecutive boxcars filling the window.
+        fnum, fwidth = params['fnum'], params['fwidth']
+        bins = np.floor(times / fwidth * fnum)
+        kerns = (bins == np.arange(fnum)[:, None]).astype(float)
+    return kerns / kerns.sum(axis=1, keepdims=True)
+
+
+def kernel(code, tres, phase=0., params=None):
+    """ Return single convolution kernel for FEAT convolution `code`
+
+    As for :func:`kernels`, for codes 0 to 3, returning 1D array.
+    """
+    if code in BASIS_CODES:
+        raise ValueError('Code {} gives basis functions; use kernels'.format(
+            code))
+    return kernels(code, tres, phase, params)[0]
+
+
+def ev_params(fmri, ev_no):
+    """ Convolution code, phase and kernel parameters for EV `ev_no`
+
+    Parameters
+    ----------
+    fmri : mapping
+        ``fmri`` fields for design.
+    ev_no : int
+        1-based EV number.
+
+    Returns
+    -------
+    code : int
+        FEAT convolution code.
+    phase : float
+        Convolution phase in seconds.
+    params : tuple
+        Sorted ``(name, value)`` pairs of kernel parameters in `fmri`, for
+        :func:`kernels`.
+    """
+    code = int(fmri.get('convolve{}'.format(ev_no), 0))
+    phase = float(fmri.get('convolve_phase{}'.format(ev_no)) or 0)
+    params = []
+    for name, stem in _CODE_FIELDS.get(code, ()):
+        value = fmri.get(stem + str(ev_no))
+        if value is not None:
+            params.append((name, value if name == 'bfcustom'
+                           else float(value)))
+    return code, phase, tuple(sorted(params))
+
+
+class KernelCache(LRUCache):
+    """ LRU cache of sampled kernels and kernel spectra
+
+    We key the cache on the convolution code, phase, TR, oversampling and
+    kernel parameters.  For custom basis functions (code 7), we key on the
+    identity of the ``bfcustom`` file (real path, inode, size and
+    modification time), so a changed file gets a new entry.  Returned arrays
+    are read-only, and shared between callers and threads.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of arrays to keep.  You can change this value with the
+        ``maxsize`` attribute.
+    """
+
+    def __init__(self, maxsize=256):
+        super(KernelCache, self).__init__(maxsize)
+
+    def _params_key(self, params):
+        # Cache key for sorted `params`, using identity of custom basis file.
+        return tuple((name, _file_identity(value) if name == 'bfcustom'
+                      else value) for name, value in params)
+
+    def _get(self, key, maker):
+        value = self.get(key)
+        if value is None:
+            value = maker()
+            value.flags.writeable = False
+            value = self.put(key, value)
+        return value
+
+    def __call__(self, code, tr, oversampling, phase=0., params=()):
+        """ Return read-only kernels, sampled `oversampling` times per `tr`
+
+        Parameters
+        ----------
+        code : int
+            FEAT convolution code.
+        tr : float
+            TR in seconds.
+        oversampling : int
+            Number of kernel samples per TR.
+        phase : float, optional
+            Convolution phase in seconds.
+        params : tuple or dict, optional
+            Kernel parameters, as for :func:`kernels`.
+
+        Returns
+        -------
+        kernels : array
+            Read-only array shape (n_functions, n_samples).
+        """
+        params = tuple(sorted(dict(params).items()))
+        key = (code, phase, tr, oversampling, self._params_key(params))
+        return self._get(key, lambda: kernels(
+            code, tr / oversampling, phase, dict(params)))
+
+    def spectrum(self, code, tr, oversampling, phase=0., params=(),
+                 n_fft=None):
+        """ Return read-only real FFT of kernels, zero-padded to `n_fft`
+
+        Parameters are as for calling the cache, with `n_fft` giving the FFT
+        length.  The returned array has shape (n_functions, n_fft // 2 + 1).
+        """
+        params = tuple(sorted(dict(params).items()))
+        key = (code, phase, tr, oversampling, self._params_key(params), n_fft)
+        return self._get(key, lambda: np.fft.rfft(
+            self(code, tr, oversampling, phase, params), n_fft, axis=1))
+
+
+# Default cache shared by all designs.
+kernel_cache = KernelCache()
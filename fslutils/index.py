@@ -0,0 +1,303 @@
+""" SQLite index of FEAT design metadata
+
+Use the index to find designs by their ``fmri`` field values without parsing
+every design file for every query::
+
+    index = DesignIndex('designs.sqlite')
+    index.crawl('/data/site1', '/data/site2')
+    paths = index.query(level=1, tr=2, smooth__gt=5)
+
+Repeated crawls only parse new designs, and designs with changed
+modification time or size.
+"""
+
+import os
+from os.path import join as pjoin, abspath
+from fnmatch import fnmatch
+import sqlite3
+from collections import namedtuple
+
+from .supporting import read_file
+from .featparser import fsf_to_dict, FEAT_TOP_TYPES
+from .fsf import load as load_fsf
+
+# Increment when changing the database layout; we rebuild out-of-date
+# indices.
+INDEX_FORMAT = 1
+
+_SCHEMA = """
+CREATE TABLE designs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE fields (
+    design_id INTEGER NOT NULL REFERENCES designs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value
+);
+CREATE TABLE list_items (
+    design_id INTEGER NOT NULL REFERENCES designs(id) ON DELETE CASCADE,
+    top TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    value TEXT
+);
+CREATE INDEX fields_name_value ON fields(name, value);
+CREATE INDEX fields_design ON fields(design_id);
+CREATE INDEX list_items_top_value ON list_items(top, value);
+CREATE INDEX list_items_design ON list_items(design_id);
+"""
+
+_OPERATORS = {
+    'eq': '=',
+    'ne': '!=',
+    'gt': '>',
+    'ge': '>=',
+    'lt': '<',
+    'le': '<=',
+    'like': 'LIKE',
+}
+
+_LIST_TOPS = tuple(top for top, top_type in FEAT_TOP_TYPES.items()
+                   if top_type is list)
+
+CrawlInfo = namedtuple('CrawlInfo',
+                       ['added', 'updated', 'removed', 'unchanged', 'failed'])
+
+
+class DesignHandle(object):
+    """ Indexed design, with ``fmri`` fields from index
+
+    Load the full design with the :meth:`load` method.
+
+    Attributes
+    ----------
+    path : str
+        Design filename.
+    fmri : dict
+        Field values for ``fmri`` top, as stored in index.  The index stores
+        boolean values as integers 0 and 1.
+    """
+
+    def __init__(self, path, fmri):
+        self.path = path
+        self.fmri = fmri
+
+    def load(self, arrays=False, cache=None):
+        """ Load and return FSF object for design
+
+        See :meth:`fslutils.fsf.FSF.from_file` for parameters.
+        """
+        return load_fsf(self.path, arrays=arrays, cache=cache)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.path)
+
+
+def _parse_criterion(key):
+    # Split criterion keyword such as "smooth__gt" into field name, operator
+    name, sep, op = key.rpartition('__')
+    if sep and op in _OPERATORS:
+        return name, _OPERATORS[op]
+    return key, '='
+
+
+class DesignIndex(object):
+    """ SQLite index of FEAT design files
+
+    Parameters
+    ----------
+    db_path : str, optional
+        Filename of SQLite database.  We create the database if it does not
+        exist.  Default is an in-memory database.
+    """
+
+    def __init__(self, db_path=':memory:'):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._check_schema()
+
+    def _check_schema(self):
+        conn = self._conn
+        version, = conn.execute('PRAGMA user_version').fetchone()
+        if version == INDEX_FORMAT:
+            return
+        with conn:
+            for table in ('list_items', 'fields', 'designs'):
+                conn.execute('DROP TABLE IF EXISTS ' + table)
+            conn.executescript(_SCHEMA)
+            conn.execute('PRAGMA user_version = {}'.format(INDEX_FORMAT))
+
+    def close(self):
+        """ Close database connection
+        """
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM designs').fetchone()[0]
+
+    def _insert(self, path, stat):
+        # Parse design at `path`, insert into index, return error or None.
+        conn = self._conn
+        try:
+            fsf_dict = fsf_to_dict(read_file(path))
+        except Exception as err:
+            error = '{}: {}'.format(type(err).__name__, err)
+            fsf_dict = {}
+        else:
+            error = None
+        design_id = conn.execute(
+            'INSERT INTO designs (path, mtime_ns, size, error) '
+            'VALUES (?, ?, ?, ?)',
+            (path, stat.st_mtime_ns, stat.st_size, error)).lastrowid
+        conn.executemany(
+            'INSERT INTO fields VALUES (?, ?, ?)',
+            [(design_id, name, value)
+             for name, value in fsf_dict.get('fmri', {}).items()])
+        conn.executemany(
+            'INSERT INTO list_items VALUES (?, ?, ?, ?)',
+            [(design_id, top, idx, value)
+             for top in _LIST_TOPS
+             for idx, value in enumerate(fsf_dict.get(top, []))])
+        return error
+
+    def crawl(self, *roots, patterns=('*.fsf',)):
+        """ Index designs in directory trees `roots`
+
+        We parse designs not yet in the index, and designs with modification
+        time or size different from the indexed version.  We drop indexed
+        designs below `roots` that no longer exist.
+
+        Parameters
+        ----------
+        \\*roots : str
+            Directories to search for design files.
+        patterns : sequence, optional
+            Glob patterns for design filenames.
+
+        Returns
+        -------
+        info : CrawlInfo
+            Named tuple with counts of ``added``, ``updated``, ``removed`` and
+            ``unchanged`` designs, and ``failed``, a list of design filenames
+            we could not parse, or could not ``stat``.  We do not index files
+            we could not ``stat``.
+        """
+        conn = self._conn
+        added, updated, unchanged, failed = 0, 0, 0, []
+        removed = 0
+        with conn:
+            for root in roots:
+                root = abspath(root)
+                # Paths below root sort between root + sep and the next
+                # character after sep.  Avoid LIKE, which ignores case and
+                # treats characters in root as wildcards.
+                prefix = pjoin(root, '')
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                indexed = {
+                    path: (design_id, mtime_ns, size)
+                    for design_id, path, mtime_ns, size in conn.execute(
+                        'SELECT id, path, mtime_ns, size FROM designs '
+                        'WHERE path >= ? AND path < ?', (prefix, upper))}
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        if not any(fnmatch(filename, p) for p in patterns):
+                            continue
+                        path = pjoin(dirpath, filename)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:  # Dangling link, or file removed
+                            failed.append(path)
+                            continue
+                        previous = indexed.pop(path, None)
+                        if previous is not None:
+                            design_id, mtime_ns, size = previous
+                            if (mtime_ns, size) == (stat.st_mtime_ns,
+                                                    stat.st_size):
+                                unchanged += 1
+                                continue
+                            conn.execute('DELETE FROM designs WHERE id = ?',
+                                         (design_id,))
+                            updated += 1
+                        else:
+                            added += 1
+                        if self._insert(path, stat) is not None:
+                            failed.append(path)
+                conn.executemany('DELETE FROM designs WHERE id = ?',
+                                 [(v[0],) for v in indexed.values()])
+                removed += len(indexed)
+        return CrawlInfo(added, updated, removed, unchanged, failed)
+
+    def _select_ids(self, criteria):
+        # SQL and parameters selecting design ids matching `criteria`
+        clauses, params = [], []
+        for key, value in sorted(criteria.items()):
+            name, op = _parse_criterion(key)
+            if name in _LIST_TOPS:
+                clauses.append(
+                    'EXISTS (SELECT 1 FROM list_items l '
+                    'WHERE l.design_id = d.id AND l.top = ? '
+                    'AND l.value {} ?)'.format(op))
+            else:
+                clauses.append(
+                    'EXISTS (SELECT 1 FROM fields f '
+                    'WHERE f.design_id = d.id AND f.name = ? '
+                    'AND f.value {} ?)'.format(op))
+            params += [name, value]
+        sql = 'SELECT d.id, d.path FROM designs d'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return sql + ' ORDER BY d.path', params
+
+    def query(self, **criteria):
+        """ Return sorted list of design filenames matching `criteria`
+
+        Parameters
+        ----------
+        \\*\\*criteria : dict
+            Keys are ``fmri`` field names, optionally with a suffix
+            ``__<op>``, where ``<op>`` is one of ``eq, ne, gt, ge, lt, le,
+            like``.  Without a suffix, the operator is ``eq``.  For example
+            ``tr=2, smooth__gt=5``.  Keys can also be list tops, such as
+            ``feat_files``; these match if any list element matches.  All
+            criteria must match.
+
+        Returns
+        -------
+        paths : list
+            Matching design filenames.
+        """
+        sql, params = self._select_ids(criteria)
+        return [path for design_id, path in self._conn.execute(sql, params)]
+
+    def handles(self, **criteria):
+        """ Return list of :class:`DesignHandle` for designs matching criteria
+
+        See :meth:`query` for `criteria`.
+        """
+        sql, params = self._select_ids(criteria)
+        rows = self._conn.execute(sql, params).fetchall()
+        fmris = {design_id: {} for design_id, path in rows}
+        field_sql = ('SELECT f.design_id, f.name, f.value FROM fields f '
+                     'WHERE f.design_id IN (SELECT id FROM ({}))'.format(sql))
+        for design_id, name, value in self._conn.execute(field_sql, params):
+            fmris[design_id][name] = value
+        return [DesignHandle(path, fmris[design_id])
+                for design_id, path in rows]
+
+    def errors(self):
+        """ Return dict of design filename: error message for failed parses
+        """
+        return dict(self._conn.execute(
+            'SELECT path, error FROM designs WHERE error IS NOT NULL '
+            'ORDER BY path'))
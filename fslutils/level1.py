@@ -0,0 +1,359 @@
+""" Build first-level FEAT design matrices from FSF designs
+
+We follow the steps of ``feat_model`` for the original EVs of a first-level
+design:
+
+* build the EV waveforms on a time grid oversampled relative to the TR;
+* convolve with the HRF kernel for the EV's ``convolve`` code (see
+  :mod:`fslutils.hrf`), using FFT convolution for all EVs at once;
+* sample the convolved waveforms once per volume;
+* high-pass filter EVs with ``tempfilt_yn`` set, if the design has
+  ``temphp_yn`` set, and remove the mean;
+* orthogonalize EVs as set in the ``ortho`` fields;
+* add temporal derivatives, orthogonalized with respect to their EV, for EVs
+  with ``deriv_yn`` set.
+
+Use::
+
+    design = level1_design(load('design.fsf'))
+    matfile.save(design, 'design.mat')
+
+We do not read motion parameters or confound files from FEAT directories;
+pass these as `confounds` to :func:`level1_design`.
+"""
+
+import numpy as np
+
+from .featparser import _ppheights
+from .hrf import ev_params, kernel_cache
+from .evfiles import ev_filenames, ev_reader
+
+# Number of time points per TR for the oversampled EV waveforms.
+OVERSAMPLING = 20
+
+# EV shape codes
+SQUARE, SINUSOID, CUSTOM_1, CUSTOM_3, INTERACTION, EMPTY = 0, 1, 2, 3, 4, 10
+
+
+def _fmri_float(fmri, name, default=0.):
+    value = fmri.get(name)
+    return default if value is None else float(value)
+
+
+def _custom_values(ev_no, title, fmri, ev_files, read_ev):
+    # Custom EV values for EV number `ev_no`
+    source = None
+    if ev_files is not None:
+        source = ev_files.get(ev_no, ev_files.get(title))
+    if source is None:
+        source = fmri['custom{}'.format(ev_no)]
+    if isinstance(source, str):
+        return read_ev(source)
+    return np.atleast_2d(np.asarray(source, dtype=float))
+
+
+def _periodic(fmri, ev_no, times, shape):
+    # Square wave or sinusoid waveform at `times`
+    skip = _fmri_float(fmri, 'skip{}'.format(ev_no))
+    phase = _fmri_float(fmri, 'phase{}'.format(ev_no))
+    stop = _fmri_float(fmri, 'stop{}'.format(ev_no), -1.)
+    shifted = times - skip + phase
+    if shape == SQUARE:
+        off = _fmri_float(fmri, 'off{}'.format(ev_no), 30.)
+        on = _fmri_float(fmri, 'on{}'.format(ev_no), 30.)
+        values = (np.mod(shifted, off + on) >= off).astype(float)
+    else:
+        period = _fmri_float(fmri, 'period{}'.format(ev_no), 60.)
+        values = (np.sin(2 * np.pi * shifted / period) + 1) / 2
+    values[times < skip] = 0
+    if stop >= 0:
+        values[times >= skip + stop] = 0
+    return values
+
+
+def _event_rows(events, tres, n_hr):
+    """ Start, stop indices and amplitudes on time grid for 3 column `events`
+    """
+    if events.size == 0:
+        return (np.zeros(0, dtype=int),) * 2 + (np.zeros(0),)
+    if events.shape[1] != 3:
+        raise ValueError('Expecting 3 columns in custom EV file')
+    onsets, durations, amplitudes = events.T
+    starts = np.round(onsets / tres).astype(int)
+    stops = np.maximum(np.round((onsets + durations) / tres).astype(int),
+                       starts + 1)
+    return (np.clip(starts, 0, n_hr), np.clip(stops, 0, n_hr), amplitudes)
+
+
+def _waveforms(fmri, n_evs, oversampling, tres, n_hr, ev_files, read_ev):
+    """ Oversampled waveforms for original EVs, shape (n_evs, n_hr)
+
+    We build all 3 column EVs with one ``bincount`` of amplitude changes at
+    event starts and stops, and a cumulative sum.
+    """
+    times = np.arange(n_hr) * tres
+    waveforms = np.zeros((n_evs, n_hr))
+    rows, starts, stops, amplitudes = [], [], [], []
+    for i in range(n_evs):
+        ev_no = i + 1
+        shape = int(fmri['shape{}'.format(ev_no)])
+        if shape in (SQUARE, SINUSOID):
+            waveforms[i] = _periodic(fmri, ev_no, times, shape)
+        elif shape in (CUSTOM_1, CUSTOM_3):
+            title = fmri.get('evtitle{}'.format(ev_no))
+            values = _custom_values(ev_no, title, fmri, ev_files, read_ev)
+            if shape == CUSTOM_1:
+                values = values.ravel()[:n_hr // oversampling]
+                waveforms[i, :len(values) * oversampling] = np.repeat(
+                    values, oversampling)
+                continue
+            ev_starts, ev_stops, ev_amps = _event_rows(values, tres, n_hr)
+            rows.append(np.full(len(ev_starts), i))
+            starts.append(ev_starts)
+            stops.append(ev_stops)
+            amplitudes.append(ev_amps)
+        elif shape != EMPTY:
+            raise ValueError('EV shape {} for EV {} not supported'.format(
+                shape, ev_no))
+    if rows:
+        rows = np.concatenate(rows) * (n_hr + 1)
+        amplitudes = np.concatenate(amplitudes)
+        changes = np.bincount(
+            np.concatenate([rows + np.concatenate(starts),
+                            rows + np.concatenate(stops)]),
+            weights=np.concatenate([amplitudes, -amplitudes]),
+            minlength=n_evs * (n_hr + 1)).reshape((n_evs, n_hr + 1))
+        waveforms += np.cumsum(changes[:, :-1], axis=1)
+    return waveforms
+
+
+def _convolve_evs(waveforms, specs, tr, oversampling, cache):
+    """ Convolve EV waveforms with kernels from `cache`
+
+    Returns convolved rows, one per kernel, shape (n_rows, n_hr), and the EV
+    index for each row.  We get the kernel spectra from `cache`, so we only
+    transform the waveforms.
+    """
+    n_evs, n_hr = waveforms.shape
+    if n_evs == 0:
+        return np.zeros(waveforms.shape), np.zeros(0, dtype=int)
+    kerns = [cache(code, tr, oversampling, phase, params)
+             for code, phase, params in specs]
+    max_len = max(k.shape[1] for k in kerns)
+    n_fft = 1 << int(np.ceil(np.log2(n_hr + max_len - 1)))
+    owners = np.repeat(np.arange(n_evs), [len(k) for k in kerns])
+    spectra = np.concatenate(
+        [cache.spectrum(code, tr, oversampling, phase, params, n_fft)
+         for code, phase, params in specs])
+    spectrum = np.fft.rfft(waveforms, n_fft, axis=1)[owners] * spectra
+    return np.fft.irfft(spectrum, n_fft, axis=1)[:, :n_hr], owners
+
+
+def highpass_basis(n_points, cutoff):
+    """ Low-frequency basis that the high-pass filter removes
+
+    We filter by removing the fit of a constant, a linear trend, and discrete
+    cosines with periods longer than `cutoff`.  This approximates the FSL
+    Gaussian-weighted running line filter (``fslmaths -bptf``) that FEAT
+    uses, which also removes lines and drifts slower than the cutoff, but
+    needs only an (n_points, k) basis, rather than an (n_points, n_points)
+    filter matrix.
+
+    Parameters
+    ----------
+    n_points : int
+        Number of time points.
+    cutoff : float
+        High-pass filter cutoff period in volumes.  For FEAT, this is the
+        ``paradigm_hp`` cutoff in seconds divided by the TR.
+
+    Returns
+    -------
+    basis : array
+        Array shape (n_points, k).  See :func:`highpass_filter`.
+    """
+    index = np.arange(n_points)
+    # Cosine k has period 2 * n_points / k volumes.
+    n_cosines = min(int(2. * n_points / cutoff), max(n_points - 2, 0))
+    cosines = np.cos(np.pi * np.outer(index + 0.5, np.arange(1, n_cosines + 1))
+                     / n_points)
+    return np.column_stack([np.ones(n_points), index - (n_points - 1) / 2.,
+                            cosines])
+
+
+def highpass_filter(arr, basis):
+    """ Residuals of columns of `arr` after regression on `basis`
+
+    Parameters
+    ----------
+    arr : array
+        Array shape (n_points, n_columns).
+    basis : array
+        Array shape (n_points, k), as returned by :func:`highpass_basis`.
+
+    Returns
+    -------
+    filtered : array
+        High-pass filtered `arr`, ``arr - basis @ lstsq(basis, arr)``.
+    """
+    return arr - basis @ np.linalg.lstsq(basis, arr, rcond=None)[0]
+
+
+def _orthogonalize(columns, others):
+    # Residuals of `columns` after regression on columns of `others`
+    betas = np.linalg.lstsq(others, columns, rcond=None)[0]
+    return columns - others @ betas
+
+
+def _ortho_targets(fsf, n_evs):
+    # Dict of EV index: list of EV indices to orthogonalize with respect to
+    if fsf.fmri_arrays is None:
+        fmri = fsf.fmri
+
+        def is_set(i, j):
+            return int(fmri.get('ortho{}.{}'.format(i, j), 0))
+    else:
+        # Field ``ortho{i}.{j}`` is in row i - 1, column j.
+        ortho = fsf.fmri_arrays.get('ortho', np.zeros((0, 0), dtype=int))
+
+        def is_set(i, j):
+            return (i <= ortho.shape[0] and j < ortho.shape[1] and
+                    ortho[i - 1, j])
+
+    targets = {}
+    for i in range(1, n_evs + 1):
+        wrt = [j - 1 for j in range(1, n_evs + 1)
+               if j != i and is_set(i, j)]
+        if wrt:
+            targets[i - 1] = wrt
+    return targets
+
+
+def level1_design(fsf, ev_files=None, confounds=None,
+                  oversampling=OVERSAMPLING, slice_time=0.5,
+                  read_ev=ev_reader, cache=kernel_cache):
+    """ Build first-level design matrix from `fsf`
+
+    Parameters
+    ----------
+    fsf : FSF
+        First-level design.
+    ev_files : None or dict, optional
+        Dict with keys of EV numbers (1-based) or EV titles, and values of
+        custom EV filenames, or arrays of custom EV values.  These override
+        the ``custom`` fields of `fsf`.  Use this when the design refers to
+        files that have moved.
+    confounds : None or array, optional
+        Array shape (npts, n_confounds) of confound regressors, such as
+        motion parameters, to add after the EVs.  We filter these with the
+        design's high-pass filter, and remove the mean.
+    oversampling : int, optional
+        Number of time points per TR for building and convolving EVs.
+    slice_time : float, optional
+        Time within each TR at which to sample the model, as a fraction of
+        the TR.
+    read_ev : callable, optional
+        Callable accepting custom EV filename and returning 2D array of
+        values.  The default reader caches parsed files; see
+        :class:`fslutils.evfiles.EVReader`.
+    cache : KernelCache, optional
+        Cache from which to get HRF kernels; see
+        :class:`fslutils.hrf.KernelCache`.
+
+    Returns
+    -------
+    mat_dict : dict
+        Dict as for :func:`fslutils.matfile.load`, with keys ``NumWaves``,
+        ``NumPoints``, ``PPheights`` and ``Matrix``.  For EVs and their
+        derivatives, ``PPheights`` are peak-to-peak heights of the
+        oversampled convolved waveforms, before filtering.  For confounds,
+        they are the peak-to-peak heights of the matrix columns.  EVs with
+        basis function convolution (codes 4 to 7) have one column per basis
+        function, and no temporal derivatives.
+    """
+    fmri = fsf.fmri
+    if fmri.get('level', 1) != 1:
+        raise ValueError('Design is not a first-level design')
+    tr = float(fmri['tr'])
+    n_points = int(fmri['npts'])
+    n_evs = int(fmri['evs_orig'])
+    tres = tr / oversampling
+    n_hr = n_points * oversampling
+    waveforms = _waveforms(fmri, n_evs, oversampling, tres, n_hr, ev_files,
+                           read_ev)
+    specs = [ev_params(fmri, i + 1) for i in range(n_evs)]
+    convolved, owners = _convolve_evs(waveforms, specs, tr, oversampling,
+                                      cache)
+    derivs = np.gradient(convolved, axis=1) * oversampling
+    sample_at = (np.arange(n_points) * oversampling +
+                 min(int(round(slice_time * oversampling)), oversampling - 1))
+    evs = convolved[:, sample_at].T
+    ev_derivs = derivs[:, sample_at].T
+    # High-pass filter and demean.
+    basis = None
+    if fmri.get('temphp_yn') and n_points:
+        basis = highpass_basis(n_points, float(fmri['paradigm_hp']) / tr)
+        to_filter = np.array([bool(fmri.get('tempfilt_yn{}'.format(i + 1)))
+                              for i in range(n_evs)], dtype=bool)[owners]
+        evs[:, to_filter] = highpass_filter(evs[:, to_filter], basis)
+        ev_derivs[:, to_filter] = highpass_filter(ev_derivs[:, to_filter],
+                                                  basis)
+    evs -= evs.mean(axis=0)
+    ev_derivs -= ev_derivs.mean(axis=0)
+    for i, wrt in _ortho_targets(fsf, n_evs).items():
+        cols = owners == i
+        evs[:, cols] = _orthogonalize(evs[:, cols],
+                                      evs[:, np.isin(owners, wrt)])
+    columns, heights = [], []
+    ev_heights = _ppheights(convolved.T)
+    deriv_heights = _ppheights(derivs.T)
+    n_funcs = np.bincount(owners, minlength=n_evs)
+    for row, i in enumerate(owners):
+        columns.append(evs[:, row])
+        heights.append(ev_heights[row])
+        if n_funcs[i] == 1 and fmri.get('deriv_yn{}'.format(i + 1)):
+            columns.append(_orthogonalize(ev_derivs[:, row],
+                                          evs[:, row:row + 1]))
+            heights.append(deriv_heights[row])
+    matrix = np.column_stack(columns) if columns else np.zeros((n_points, 0))
+    if confounds is not None:
+        confounds = np.asarray(confounds, dtype=float).reshape((n_points, -1))
+        if basis is not None:
+            confounds = highpass_filter(confounds, basis)
+        confounds = confounds - confounds.mean(axis=0)
+        matrix = np.column_stack([matrix, confounds])
+        heights += _ppheights(confounds).tolist()
+    return {'NumWaves': matrix.shape[1],
+            'NumPoints': n_points,
+            'PPheights': [float(h) for h in heights],
+            'Matrix': matrix}
+
+
+def level1_designs(fsfs, workers=8, reader=ev_reader, **kwargs):
+    """ Build first-level design matrices for FSF objects `fsfs`
+
+    We first read all the custom EV files for `fsfs` in one batch, with a
+    pool of threads, then build the designs from the cached files.  We raise
+    errors for missing or invalid custom EV files when building the design
+    that needs them.
+
+    Parameters
+    ----------
+    fsfs : iterable
+        Iterable of first-level FSF objects.
+    workers : int, optional
+        Number of threads with which to read custom EV files.
+    reader : EVReader, optional
+        Reader for custom EV files.
+    \\*\\*kwargs : dict
+        Other keyword arguments for :func:`level1_design`.
+
+    Returns
+    -------
+    mat_dicts : list
+        List of dicts, one per design, as returned by :func:`level1_design`.
+    """
+    fsfs = list(fsfs)
+    reader.read_many([fname for fsf in fsfs for fname in ev_filenames(fsf)],
+                     workers, skip_errors=True)
+    return [level1_design(fsf, read_ev=reader, **kwargs) for fsf in fsfs]
@@ -0,0 +1,265 @@
+""" Read FEAT design matrix (.mat) files
+"""
+
+from os.path import isdir, join as pjoin
+import mmap
+import asyncio
+
+import numpy as np
+
+from .supporting import read_file
+from .featparser import (mat_to_dict, iter_mat, _parse_mat_header,
+                         _parse_matrix, _MATRIX_START_RE)
+from .cache import cached_mat_dict
+
+
+def load(file_ish, cache=None):
+    """ Load .mat design matrix file from `file_ish`, return as dict
+
+    Parameters
+    ----------
+    file_ish : object
+        Can be string, giving filename of design matrix file, or of the
+        containing FEAT directory, in which case we assume ``design.mat`` as
+        the filename.  Can also be file-like object implementing ``read``
+        method.
+    cache : None or bool or 'user' or store, optional
+        If None or False, parse the file contents.  Otherwise, use cached
+        parse results, as for the `cache` parameter of
+        :meth:`fslutils.fsf.FSF.from_file`.
+
+    Returns
+    -------
+    mat_dict : dict
+        Dict containing contents of mat file.  See
+        :func:`fslutils.featparser.mat_to_dict`.
+    """
+    if hasattr(file_ish, 'read'):
+        return mat_to_dict(file_ish.read())
+    if isdir(file_ish):  # Could be FEAT directory
+        file_ish = pjoin(file_ish, 'design.mat')
+    contents = read_file(file_ish)
+    if cache is None or cache is False:
+        return mat_to_dict(contents)
+    return cached_mat_dict(file_ish, contents, cache)
+
+
+def save(mat_ish, file_ish, ppheights=None, fmt='%e', chunk_rows=4096):
+    """ Save design matrix `mat_ish` to `file_ish` as .mat file
+
+    We write the matrix in chunks of rows, so we can write very large
+    matrices, such as memory-mapped arrays, without formatting all the text
+    in memory.
+
+    Parameters
+    ----------
+    mat_ish : dict or array-like
+        Dict with ``Matrix`` key, as returned by :func:`load`, or 2D array-like
+        design matrix.  For a dict, we write the dict ``PPheights`` and other
+        header fields, unless `ppheights` is not None.
+    file_ish : object
+        Can be string, giving filename of design matrix file, or of an
+        existing FEAT directory, in which case we write ``design.mat`` in that
+        directory.  Can also be file-like object, open in text mode,
+        implementing ``write`` method.
+    ppheights : None or sequence, optional
+        Peak-to-peak heights of matrix columns.  If None, and `mat_ish` does
+        not give heights, calculate from the matrix (see
+        :func:`fslutils.featparser.mat_ppheights`).
+    fmt : str, optional
+        Format for values; see :func:`fslutils.featparser.iter_mat`.
+    chunk_rows : int, optional
+        Number of matrix rows to format and write at a time.
+    """
+    header = None
+    if isinstance(mat_ish, dict):
+        header = {key: value for key, value in mat_ish.items()
+                  if key not in ('Matrix', 'NumWaves', 'NumPoints',
+                                 'PPheights')}
+        if ppheights is None:
+            ppheights = mat_ish.get('PPheights')
+        mat_ish = mat_ish['Matrix']
+    if not hasattr(mat_ish, 'shape'):
+        mat_ish = np.asarray(mat_ish)
+    chunks = iter_mat(mat_ish, ppheights, header, fmt, chunk_rows)
+    if hasattr(file_ish, 'write'):
+        for chunk in chunks:
+            file_ish.write(chunk)
+        return
+    if isdir(file_ish):  # Could be FEAT directory
+        file_ish = pjoin(file_ish, 'design.mat')
+    with open(file_ish, 'wt') as fobj:
+        for chunk in chunks:
+            fobj.write(chunk)
+
+
+async def aload(path, executor=None, read=read_file):
+    """ Load .mat design matrix file from `path` in coroutine
+
+    We read the file in a thread, and parse in `executor`, so the event loop
+    can run other tasks in the meantime.
+
+    Parameters
+    ----------
+    path : str
+        Filename of design matrix file, or FEAT directory containing
+        ``design.mat``.
+    executor : None or executor, optional
+        Executor in which to parse the file contents.  If None, use the event
+        loop default executor.
+    read : callable, optional
+        Callable accepting filename and returning file contents as string.
+
+    Returns
+    -------
+    mat_dict : dict
+        Dict containing contents of mat file.
+    """
+    if isdir(path):  # Could be FEAT directory
+        path = pjoin(path, 'design.mat')
+    loop = asyncio.get_running_loop()
+    contents = await loop.run_in_executor(None, read, path)
+    return await loop.run_in_executor(executor, mat_to_dict, contents)
+
+
+class MappedMatrix(object):
+    """ Array-like view of design matrix in memory-mapped .mat file
+
+    We read and parse rows from the file only when they are indexed.  Indexing
+    with a slice or index array for the rows parses the text from the first to
+    the last requested row; column indices select from the parsed rows.
+    ``np.asarray(mapped)`` reads the whole matrix.
+    """
+
+    dtype = np.dtype(np.float64)
+    ndim = 2
+
+    def __init__(self, filename, offset, n_points, n_waves):
+        """ Initialize matrix
+
+        Parameters
+        ----------
+        filename : str
+            Filename of .mat file.
+        offset : int
+            Offset in bytes of first byte after ``/Matrix`` line.
+        n_points : int
+            Number of rows in matrix.
+        n_waves : int
+            Number of columns in matrix.
+        """
+        self.filename = filename
+        self.offset = offset
+        self.shape = (n_points, n_waves)
+        self._mmap = None
+        self._starts = None
+        self._ends = None
+
+    def _get_mmap(self):
+        if self._mmap is None:
+            with open(self.filename, 'rb') as fobj:
+                self._mmap = mmap.mmap(fobj.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _index_rows(self):
+        # Find start and end byte offsets of each row in file.
+        mm = self._get_mmap()
+        buf = np.frombuffer(mm, dtype=np.uint8)[self.offset:]
+        ends = np.flatnonzero(buf == ord('\n'))
+        if buf.size and buf[-1] != ord('\n'):  # No final newline
+            ends = np.append(ends, buf.size)
+        starts = np.concatenate(([0], ends[:-1] + 1)) if len(ends) else ends
+        del buf
+        if len(starts) != self.shape[0] or np.any(starts == ends):
+            # Drop blank lines.
+            keep = np.array([mm[self.offset + s:self.offset + e].strip() != b''
+                             for s, e in zip(starts, ends)], dtype=bool)
+            starts, ends = starts[keep], ends[keep]
+        if len(starts) != self.shape[0]:
+            raise ValueError(
+                '/Matrix has {} rows; expecting {} (/NumPoints)'.format(
+                    len(starts), self.shape[0]))
+        self._starts = starts + self.offset
+        self._ends = ends + self.offset
+
+    def _read_rows(self, start, stop):
+        """ Parse rows from `start` up to not including `stop`
+        """
+        if self._starts is None:
+            self._index_rows()
+        n_rows = stop - start
+        if n_rows <= 0:
+            return np.zeros((0, self.shape[1]))
+        body = self._get_mmap()[self._starts[start]:self._ends[stop - 1]]
+        return _parse_matrix(body.decode('ascii'), n_rows, self.shape[1])
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        row_key, col_key = key[0], key[1:]
+        rows = np.arange(self.shape[0])[row_key]
+        if rows.ndim == 0:  # Single row
+            return self._read_rows(rows, rows + 1)[0][col_key]
+        if rows.size == 0:
+            block = np.zeros((0, self.shape[1]))
+        else:
+            first = rows.min()
+            block = self._read_rows(first, rows.max() + 1)
+            if not (isinstance(row_key, slice) and row_key.step in (None, 1)):
+                block = block[rows - first]
+        return block[(slice(None),) + col_key]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self._read_rows(0, self.shape[0])
+        return arr if dtype is None else arr.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def close(self):
+        """ Close memory map, if open
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._starts = self._ends = None
+
+    def __repr__(self):
+        return '{}({!r}, shape={})'.format(
+            self.__class__.__name__, self.filename, self.shape)
+
+
+def load_mapped(filename):
+    """ Load .mat file at `filename`, with lazy memory-mapped matrix
+
+    Only parse the header fields (``NumWaves``, ``NumPoints``, ``PPheights``)
+    on load.  The matrix is a :class:`MappedMatrix`, reading rows from the
+    file when indexed.
+
+    Parameters
+    ----------
+    filename : str
+        Filename of .mat file.
+
+    Returns
+    -------
+    mat_dict : dict
+        Dict with header fields of mat file, and ``Matrix`` key with
+        :class:`MappedMatrix` value.
+    """
+    header = []
+    with open(filename, 'rb') as fobj:
+        for line in iter(fobj.readline, b''):
+            line = line.decode('ascii')
+            if _MATRIX_START_RE.match(line):
+                offset = fobj.tell()
+                break
+            header.append(line)
+        else:
+            raise ValueError('No /Matrix line in ' + filename)
+    mat_dict = _parse_mat_header(''.join(header))
+    mat_dict['Matrix'] = MappedMatrix(filename, offset,
+                                      mat_dict['NumPoints'],
+                                      mat_dict['NumWaves'])
+    return mat_dict
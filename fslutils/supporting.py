@@ -1,6 +1,11 @@
 """ Classes and functions for code support (including tests)
 """
 
+import os
+from os.path import realpath
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
 
 class Bunch(object):
     """ Class to represent dictionary as object
@@ -54,3 +59,75 @@ def read_file(fname):
     with open(fname, 'rt') as fobj:
         contents = fobj.read()
     return contents
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def _file_identity(filename):
+    """ Return tuple identifying `filename` and its current state
+
+    The tuple has the real path of the file, and its inode, size and
+    modification time, so a changed file gets a new identity.
+    """
+    path = realpath(filename)
+    stat = os.stat(path)
+    return path, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class LRUCache(object):
+    """ Thread-safe least recently used cache, with hit and miss statistics
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries to keep.  You can change this value with the
+        ``maxsize`` attribute.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._hits = self._misses = 0
+
+    def get(self, key):
+        """ Return value for `key`, or None if not in cache
+
+        We count a hit or a miss, and mark `key` as most recently used.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """ Store `value` for `key`, return stored value
+
+        If another thread stored a value for `key` since our miss, we keep and
+        return that value, so callers share the same value.  We drop least
+        recently used entries over ``maxsize``.
+        """
+        with self._lock:
+            value = self._entries.setdefault(key, value)
+            while len(self._entries) > max(self.maxsize, 0):
+                self._entries.popitem(last=False)
+            return value
+
+    def cache_info(self):
+        """ Return hits, misses, maxsize and current size of cache
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.maxsize,
+                             len(self._entries))
+
+    def cache_clear(self):
+        """ Clear cache and statistics
+        """
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = 0
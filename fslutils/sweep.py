@@ -0,0 +1,228 @@
+""" Generate variants of a template design for parameter sweeps
+
+For example, to write designs for all combinations of smoothing and high-pass
+filter values::
+
+    template = load('design.fsf')
+    overrides = grid({'smooth': [4, 6, 8], 'paradigm_hp': [60, 100]})
+    fnames = write_variants(template, overrides, 'sweep/{index:03d}.fsf')
+"""
+
+import os
+from os.path import dirname
+from collections import ChainMap
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor
+
+from .featparser import dict_to_fsf, FEAT_TOP_TYPES, _matrix_field
+from .fsf import (FSF, LazyFSF, _parsed_dict, _design_filename,
+                  _numbered_index)
+
+
+def grid(values):
+    """ Return list of override dicts for all combinations of `values`
+
+    Parameters
+    ----------
+    values : dict
+        Dict with field names as keys, and sequences of values for that field
+        as values.
+
+    Returns
+    -------
+    overrides : list
+        List of dicts, one for each combination of values, with the last
+        field varying fastest.
+    """
+    names = list(values)
+    return [dict(zip(names, combination))
+            for combination in product(*(values[name] for name in names))]
+
+
+def table(columns):
+    """ Return list of override dicts for rows of table `columns`
+
+    Parameters
+    ----------
+    columns : dict
+        Dict with field names as keys, and equal-length sequences of values
+        as values.  Row ``i`` has the ``i``th value for each field.
+
+    Returns
+    -------
+    overrides : list
+        List of dicts, one per row.
+    """
+    names = list(columns)
+    lengths = set(len(columns[name]) for name in names)
+    if len(lengths) > 1:
+        raise ValueError('All columns should have the same length')
+    return [dict(zip(names, row))
+            for row in zip(*(columns[name] for name in names))]
+
+
+def _split_overrides(template, overrides):
+    """ Split `overrides` into ``fmri`` fields and list tops
+
+    Check that we can apply overrides to `template`.
+    """
+    fields, lists = {}, {}
+    for name, value in overrides.items():
+        if FEAT_TOP_TYPES.get(name) is list:
+            lists[name] = list(value)
+            continue
+        if (template.fmri_arrays is not None and
+                _matrix_field(name) is not None):
+            raise ValueError(
+                'Cannot set matrix field {} in arrays mode'.format(name))
+        fields[name] = value
+    return fields, lists
+
+
+def _template_index(template):
+    # Numbered field index of `template` with values, as for ``FSF._index``
+    if isinstance(template, LazyFSF) or template._index is None:
+        return _numbered_index(template.fmri)
+    return template._index
+
+
+def _override_index(index, fields):
+    # Numbered field `index` updated for override `fields`
+    by_stem = {}
+    for name, value in fields.items():
+        stem = name.rstrip('0123456789')
+        if len(stem) != len(name):
+            by_stem.setdefault(stem, {})[int(name[len(stem):])] = value
+    if not by_stem:
+        return index
+    index = dict(index)
+    for stem, values in by_stem.items():
+        items = dict(index.get(stem, ()))
+        items.update(values)
+        index[stem] = sorted(items.items(), key=lambda item: item[0])
+    return index
+
+
+def _variant(template, index, overrides):
+    # FSF object for `template` with `overrides`, sharing template structure
+    # and the unchanged entries of the template's numbered field `index`.
+    fields, lists = _split_overrides(template, overrides)
+    fsf = FSF.__new__(FSF)
+    fsf.__dict__.update(_parsed_dict(template))
+    fsf.__dict__.update(lists)
+    fsf.fmri = ChainMap(fields, template.fmri)
+    fsf.fmri_arrays = template.fmri_arrays
+    fsf.contents = None
+    fsf.filename = None
+    fsf._index = _override_index(index, fields)
+    fsf._cache = {}
+    return fsf
+
+
+def iter_variants(template, overrides):
+    """ Generate FSF objects for `template` with each of `overrides`
+
+    We do not parse or copy the template for each variant.  Instead, the
+    ``fmri`` attribute of each variant is a ``ChainMap`` looking up the
+    override values first, then the template values.  We index the numbered
+    fields of the template once, and update the index for the overridden
+    fields of each variant.  The variants share the template's list tops
+    (unless overridden) and arrays, so treat these as read-only, or use the
+    ``copy`` method of the variant.  The ``contents`` of the variants are
+    None; use :func:`fslutils.fsf.dumps` to get design file contents.
+
+    Parameters
+    ----------
+    template : FSF
+        Template design.
+    overrides : iterable
+        Iterable of dicts, where keys are ``fmri`` field names or list top
+        names (such as ``feat_files``), and values are values for that field
+        or top.  See :func:`grid` and :func:`table`.
+
+    Yields
+    ------
+    variant : FSF
+        FSF object for template with overrides.
+    """
+    index = _template_index(template)
+    for override in overrides:
+        yield _variant(template, index, override)
+
+
+class _Renderer(object):
+    """ Write design file contents for variants of template
+
+    We format the template fields once, then replace the lines for the
+    overridden fields for each variant.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        fsf_dict = _parsed_dict(template)
+        fmri = fsf_dict.pop('fmri', {})
+        self._positions = {name: i for i, name in enumerate(fmri)}
+        self._fmri_lines = dict_to_fsf({'fmri': fmri}).splitlines()
+        arrays = fsf_dict.pop('fmri_arrays', None)
+        self._arrays_text = dict_to_fsf(
+            {'fmri_arrays': arrays}) if arrays else ''
+        self._list_texts = {top: dict_to_fsf({top: values})
+                            for top, values in fsf_dict.items()}
+
+    def __call__(self, overrides):
+        fields, lists = _split_overrides(self.template, overrides)
+        lines = list(self._fmri_lines)
+        new_lines = []
+        positions = self._positions
+        for name, value in fields.items():
+            line = dict_to_fsf({'fmri': {name: value}})[:-1]
+            if name in positions:
+                lines[positions[name]] = line
+            else:
+                new_lines.append(line)
+        list_texts = dict(self._list_texts)
+        for top, values in lists.items():
+            list_texts[top] = dict_to_fsf({top: values})
+        lines += new_lines
+        lines.append(self._arrays_text)
+        return '\n'.join(lines) + ''.join(list_texts.values())
+
+
+def write_variants(template, overrides, out_pattern, workers=4):
+    """ Write design files for `template` with each of `overrides`
+
+    Parameters
+    ----------
+    template : FSF
+        Template design.
+    overrides : iterable
+        Iterable of dicts; see :func:`iter_variants`.
+    out_pattern : str
+        Pattern for output filenames, formatted with ``index``, the 0-based
+        index of the override, and the override values, as keywords.  For
+        example ``'sweep/{index:04d}_s{smooth}.fsf'``.  We make any missing
+        directories.  If the output filename is an existing directory, we
+        write ``design.fsf`` in that directory.
+    workers : int, optional
+        Number of threads with which to write designs.
+
+    Returns
+    -------
+    fnames : list
+        Filenames of written designs, in order of `overrides`.
+    """
+    render = _Renderer(template)
+
+    def write_one(index_override):
+        index, override = index_override
+        fname = _design_filename(out_pattern.format(index=index, **override))
+        contents = render(override)
+        out_dir = dirname(fname)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        with open(fname, 'wt') as fobj:
+            fobj.write(contents)
+        return fname
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(write_one, enumerate(overrides)))
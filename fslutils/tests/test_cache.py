@@ -0,0 +1,258 @@
+""" Test caches of parse results
+"""
+
+import os
+from os.path import join as pjoin, dirname, basename, exists
+from glob import glob
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy.testing import assert_array_equal
+
+from fslutils.supporting import read_file
+from fslutils.featparser import (fsf_to_dict, mat_to_dict, register_converter,
+                                 unregister_converter)
+from fslutils.fsf import LazyFSF, load
+from fslutils import matfile, cache
+from fslutils.cache import (SidecarStore, DirectoryStore, user_store,
+                            cached_fsf_dict, _fsf_to_arrays, _arrays_to_fsf,
+                            _file_key)
+
+import pytest
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def _types_equal(d1, d2):
+    return [(k, type(v)) for k, v in d1.items()] == [
+        (k, type(v)) for k, v in d2.items()]
+
+
+def assert_fsf_dict_equal(actual, expected):
+    assert set(actual) == set(expected)
+    for top_name, top in expected.items():
+        if top_name == 'fmri_arrays':
+            assert set(actual[top_name]) == set(top)
+            for family, arr in top.items():
+                assert_array_equal(actual[top_name][family], arr)
+                assert actual[top_name][family].dtype == arr.dtype
+                assert not actual[top_name][family].flags.writeable
+            continue
+        assert actual[top_name] == top
+        if isinstance(top, dict):
+            assert list(actual[top_name]) == list(top)
+            assert _types_equal(actual[top_name], top)
+
+
+def copy_data(tmpdir, pattern):
+    fnames = []
+    for fname in glob(pjoin(DATA_DIR, pattern)):
+        out_fname = pjoin(str(tmpdir), basename(fname))
+        shutil.copy2(fname, out_fname)
+        fnames.append(out_fname)
+    return fnames
+
+
+def test_fsf_arrays_round_trip():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        for arrays in (False, True):
+            fsf_dict = fsf_to_dict(contents, arrays)
+            assert_fsf_dict_equal(_arrays_to_fsf(_fsf_to_arrays(fsf_dict)),
+                                  fsf_dict)
+    # Cannot encode unexpected types
+    assert _fsf_to_arrays({'fmri': {'foo': [1]}}) is None
+
+
+def test_sidecar_fsf(tmpdir):
+    for fname in copy_data(tmpdir, '*.fsf'):
+        sidecar = fname + SidecarStore.suffix
+        contents = read_file(fname)
+        for arrays in (False, True):
+            exp_dict = fsf_to_dict(contents, arrays)
+            assert_fsf_dict_equal(cached_fsf_dict(fname, contents, arrays),
+                                  exp_dict)
+            assert exists(sidecar)
+            mtime = os.stat(sidecar).st_mtime_ns
+            # Cached value same as fresh parse.
+            assert_fsf_dict_equal(cached_fsf_dict(fname, contents, arrays),
+                                  exp_dict)
+            assert os.stat(sidecar).st_mtime_ns == mtime
+        fsf = load(fname, cache=True)
+        exp_fsf = load(fname)
+        assert fsf.filename == fname
+        assert fsf.contents == exp_fsf.contents
+        assert fsf.fmri == exp_fsf.fmri
+        assert_array_equal(fsf.evgs, exp_fsf.evgs)
+    # Stale entry detected from contents, even with same size and mtime.
+    fname = pjoin(str(tmpdir), 'one_sess_level1.fsf')
+    stat = os.stat(fname)
+    contents = read_file(fname)
+    assert load(fname, cache=True).fmri['tr'] == 2
+    new_contents = contents.replace('fmri(tr) 2.000000', 'fmri(tr) 3.000000')
+    assert len(new_contents) == len(contents)
+    with open(fname, 'wt') as fobj:
+        fobj.write(new_contents)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load(fname, cache=True).fmri['tr'] == 3
+    assert load(fname, cache=True).fmri['tr'] == 3
+    # Corrupt sidecar ignored, and replaced.
+    sidecar = fname + SidecarStore.suffix
+    with open(sidecar, 'wt') as fobj:
+        fobj.write('rubbish')
+    assert load(fname, cache=True).fmri['tr'] == 3
+    with open(sidecar, 'rb') as fobj:
+        assert fobj.read() != b'rubbish'
+    # File-like objects, and LazyFSF, don't use cache.
+    with open(fname, 'rt') as fobj:
+        assert load(fobj, cache=True).fmri['tr'] == 3
+    with pytest.raises(ValueError):
+        LazyFSF.from_file(fname, cache=True)
+    assert LazyFSF.from_file(fname).fmri['tr'] == 3
+
+
+def test_sidecar_converters(tmpdir):
+    fname = copy_data(tmpdir, 'one_sess_level1.fsf')[0]
+    assert load(fname, cache=True).fmri['custom1'].endswith('.txt')
+    try:
+        register_converter('^custom', len)
+        # Registered converter not stored in cache, so not used.
+        assert load(fname, cache=True).fmri['custom1'] == 105
+    finally:
+        unregister_converter('^custom')
+    assert load(fname, cache=True).fmri['custom1'].endswith('.txt')
+
+
+@pytest.mark.skipif(hasattr(os, 'geteuid') and os.geteuid() == 0,
+                    reason='root can write to read-only directories')
+def test_sidecar_unwritable(tmpdir):
+    fname = copy_data(tmpdir, 'one_sess_group.fsf')[0]
+    os.chmod(str(tmpdir), 0o555)
+    try:
+        fsf = load(fname, cache=True)
+        assert len(fsf.feat_files) == 24
+    finally:
+        os.chmod(str(tmpdir), 0o755)
+    assert os.listdir(str(tmpdir)) == ['one_sess_group.fsf']
+
+
+def test_sidecar_mat(tmpdir, monkeypatch):
+    # Small files parsed without cache.
+    fname = copy_data(tmpdir, 'one_sess_group.mat')[0]
+    assert_array_equal(matfile.load(fname, cache=True)['Matrix'],
+                       mat_to_dict(read_file(fname))['Matrix'])
+    assert not exists(fname + SidecarStore.suffix)
+    monkeypatch.setattr(cache, 'MAT_CACHE_MIN_SIZE', 0)
+    for fname in copy_data(tmpdir, '*.mat'):
+        exp_dmat = mat_to_dict(read_file(fname))
+        for i in range(2):
+            dmat = matfile.load(fname, cache=True)
+            assert exists(fname + SidecarStore.suffix)
+            assert set(dmat) == set(exp_dmat)
+            for key, value in exp_dmat.items():
+                assert_array_equal(dmat[key], value)
+                assert type(dmat[key]) is type(value)
+            assert dmat['NumWaves'] == exp_dmat['NumWaves']
+    assert_array_equal(matfile.load(fname)['Matrix'], exp_dmat['Matrix'])
+    with open(fname, 'rt') as fobj:
+        assert_array_equal(matfile.load(fobj)['Matrix'], exp_dmat['Matrix'])
+    feat_dir = pjoin(str(tmpdir), 'my.feat')
+    os.mkdir(feat_dir)
+    shutil.copy(fname, pjoin(feat_dir, 'design.mat'))
+    assert_array_equal(matfile.load(feat_dir, cache=True)['Matrix'],
+                       exp_dmat['Matrix'])
+
+
+def test_directory_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'MAT_CACHE_MIN_SIZE', 0)
+    cache_dir = pjoin(str(tmpdir), 'cache')
+    store = DirectoryStore(cache_dir)
+    assert store.max_bytes == 2 ** 28
+    fnames = copy_data(tmpdir, '*.fsf')
+    for fname in fnames:
+        exp_fsf = load(fname)
+        for i in range(2):
+            fsf = load(fname, cache=store)
+            assert fsf.fmri == exp_fsf.fmri
+            assert fsf.feat_files == exp_fsf.feat_files
+    n = len(fnames)
+    assert store.stats() == dict(hits=n, misses=n, writes=n, evictions=0)
+    assert len(os.listdir(cache_dir)) == n
+    # Content addressed; copy of file uses same entry.
+    copy_fname = pjoin(str(tmpdir), 'copy.fsf')
+    shutil.copy(fnames[0], copy_fname)
+    assert load(copy_fname, cache=store).fmri == load(fnames[0]).fmri
+    assert store.hits == n + 1
+    # Mat files use the same store.
+    mat_fname = copy_data(tmpdir, 'one_sess_group.mat')[0]
+    for i in range(2):
+        dmat = matfile.load(mat_fname, cache=store)
+        assert_array_equal(dmat['Matrix'], mat_to_dict(
+            read_file(mat_fname))['Matrix'])
+    assert store.hits == n + 2
+    assert store.total_bytes() == sum(
+        os.stat(pjoin(cache_dir, f)).st_size for f in os.listdir(cache_dir))
+    store.clear()
+    assert os.listdir(cache_dir) == []
+    assert store.evictions == n + 1
+
+
+def _entry_path(store, fname):
+    return store._path(_file_key(fname, read_file(fname), 'fsf',
+                                 arrays=False))
+
+
+def test_directory_store_eviction(tmpdir):
+    cache_dir = pjoin(str(tmpdir), 'cache')
+    fnames = sorted(copy_data(tmpdir, '*.fsf'))
+    store = DirectoryStore(cache_dir, max_bytes=10 ** 9)
+    for fname in fnames:
+        load(fname, cache=store)
+    # Set times of use so entries are in order of fnames.
+    paths = [_entry_path(store, fname) for fname in fnames]
+    for i, path in enumerate(paths):
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+    # Using the first file makes it the most recently used.
+    load(fnames[0], cache=store)
+    keep = [paths[0], paths[-2], paths[-1]]
+    store.max_bytes = sum(os.stat(path).st_size for path in keep)
+    store.evict()
+    assert sorted(os.listdir(cache_dir)) == sorted(basename(p) for p in keep)
+    assert store.evictions == len(fnames) - 3
+    # Evict on write when over budget.
+    store = DirectoryStore(cache_dir, max_bytes=1)
+    load(fnames[1], cache=store)
+    assert os.listdir(cache_dir) == []
+
+
+def test_directory_store_threads(tmpdir):
+    cache_dir = pjoin(str(tmpdir), 'cache')
+    fnames = copy_data(tmpdir, '*.fsf')
+    exp_fmris = dict((f, load(f).fmri) for f in fnames)
+    store = DirectoryStore(cache_dir, max_bytes=10 ** 6)
+
+    def check(fname):
+        return load(fname, cache=store).fmri == exp_fmris[fname]
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(check, fnames * 10))
+    assert [f for f in os.listdir(cache_dir) if f.startswith('.')] == []
+
+
+def test_user_store(tmpdir, monkeypatch):
+    cache_dir = pjoin(str(tmpdir), 'user_cache')
+    monkeypatch.setenv('FSLUTILS_CACHE_DIR', cache_dir)
+    monkeypatch.setenv('FSLUTILS_CACHE_SIZE', '1000000')
+    monkeypatch.setattr(cache, '_USER_STORE', None)
+    store = user_store()
+    assert store is user_store()
+    assert store.path == cache_dir
+    assert store.max_bytes == 10 ** 6
+    fname = copy_data(tmpdir, 'one_sess_group.fsf')[0]
+    assert load(fname, cache='user').fmri == load(fname).fmri
+    assert load(fname, cache='user').fmri == load(fname).fmri
+    assert store.stats()['hits'] == 1
+    assert len(os.listdir(cache_dir)) == 1
+    monkeypatch.delenv('FSLUTILS_CACHE_DIR')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    assert DirectoryStore().path == pjoin(str(tmpdir), 'fslutils')
@@ -0,0 +1,66 @@
+""" Test tables of fmri fields across designs
+"""
+
+from os.path import join as pjoin, dirname
+from glob import glob
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from fslutils.fsf import load, loads, LazyFSF
+from fslutils.supporting import read_file
+from fslutils.cohort import cohort_table, field_dtype
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+QC_FIELDS = ['level', 'npts', 'tr', 'smooth', 'z_thresh', 'paradigm_hp',
+             'motionevs', 'mixed_yn', 'robust_yn', 'version', 'con_real1.1']
+
+
+def test_field_dtype():
+    assert field_dtype('level') == np.int64
+    assert field_dtype('tr') == np.float64
+    assert field_dtype('robust_yn') == bool
+    assert field_dtype('mixed_yn') == np.int64
+    assert field_dtype('evg1.1') == np.float64
+    assert field_dtype('outputdir').kind == 'U'
+
+
+def test_cohort_table():
+    paths = sorted(glob(pjoin(DATA_DIR, '*.fsf')))
+    fsfs = [load(p) for p in paths]
+    table = cohort_table(paths, QC_FIELDS)
+    assert isinstance(table, np.ma.MaskedArray)
+    assert table.shape == (len(paths),)
+    assert table.dtype.names == tuple(QC_FIELDS)
+    for name in QC_FIELDS:
+        if name != 'version':
+            assert table.dtype[name] == field_dtype(name)
+        assert table.dtype[name].itemsize <= 8 or name == 'version'
+    for row, fsf in zip(table, fsfs):
+        for name in QC_FIELDS:
+            if name in fsf.fmri:
+                assert row[name] == fsf.fmri[name]
+            else:
+                assert row[name] is np.ma.masked
+    assert_array_equal(table['level'], [f.fmri['level'] for f in fsfs])
+    assert_array_equal(table['tr'], [f.fmri['tr'] for f in fsfs])
+    assert table['smooth'].mean() == np.mean([f.fmri['smooth'] for f in fsfs])
+    # FSF objects, including lazy ones, and paths give the same table.
+    lazy = [LazyFSF(read_file(p)) for p in paths]
+    for designs in (fsfs, lazy, fsfs[:2] + paths[2:]):
+        other = cohort_table(designs, QC_FIELDS)
+        assert_array_equal(other.data, table.data)
+        assert_array_equal(other.mask, table.mask)
+    # Default is all fields, in order of first appearance.
+    table = cohort_table(fsfs)
+    assert table.dtype.names[:3] == tuple(fsfs[0].fmri)[:3]
+    assert set(table.dtype.names) == set(
+        name for fsf in fsfs for name in fsf.fmri)
+    # Missing fields, and no designs.
+    table = cohort_table([loads('set fmri(level) 1\n'), fsfs[0]],
+                         ['level', 'npts', 'outputdir'])
+    assert_array_equal(table.mask['npts'], [True, False])
+    assert_array_equal(table.mask['outputdir'], [True, False])
+    assert table['level'].tolist() == [1, 2]
+    assert cohort_table([], ['tr']).shape == (0,)
@@ -0,0 +1,94 @@
+""" Test reading custom EV files
+"""
+
+import os
+from os.path import join as pjoin, dirname
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import pytest
+
+from fslutils.fsf import load
+from fslutils.evfiles import (parse_ev, ev_timing, ev_filenames, EVReader,
+                              EVTiming)
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def test_parse_ev():
+    values = parse_ev('0 2 1\n10.5\t2 -1\n\n  20 0.5 1e1\n')
+    assert_array_equal(values, [[0, 2, 1], [10.5, 2, -1], [20, 0.5, 10]])
+    assert_array_equal(parse_ev('1\n2\n3\n'), [[1], [2], [3]])
+    assert parse_ev('').shape == (0, 3)
+    assert parse_ev('\n  \n').shape == (0, 3)
+    with pytest.raises(ValueError):
+        parse_ev('0 2 1\n10 2\n')
+    with pytest.raises(ValueError):
+        parse_ev('0 2 1\n10 2 onset\n')
+
+
+def test_ev_timing():
+    timing = ev_timing(parse_ev('0 2 1\n10 3 -1\n'))
+    assert isinstance(timing, EVTiming)
+    assert_array_equal(timing.onsets, [0, 10])
+    assert_array_equal(timing.durations, [2, 3])
+    assert_array_equal(timing.amplitudes, [1, -1])
+    with pytest.raises(ValueError):
+        ev_timing(parse_ev('1\n2\n'))
+
+
+def test_ev_filenames():
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    fnames = ev_filenames(fsf)
+    assert fnames == [fsf.fmri['custom{}'.format(i)] for i in range(1, 5)]
+    fsf.set_fields({'shape2': 10})
+    assert ev_filenames(fsf) == [fnames[0]] + fnames[2:]
+    assert ev_filenames(load(pjoin(DATA_DIR, 'one_sess_group.fsf'))) == []
+
+
+def test_ev_reader(tmp_path):
+    fnames = []
+    for i in range(5):
+        fname = str(tmp_path / 'ev{}.txt'.format(i))
+        np.savetxt(fname, np.arange(9).reshape((3, 3)) + i)
+        fnames.append(fname)
+    reader = EVReader()
+    values = reader.read(fnames[0])
+    assert_array_equal(values, np.arange(9).reshape((3, 3)))
+    assert not values.flags.writeable
+    assert reader(fnames[0]) is values
+    assert tuple(reader.cache_info()) == (1, 1, 4096, 1)
+    # Shared files read once.
+    all_values = reader.read_many(fnames * 3, workers=4)
+    assert len(all_values) == 15
+    for i, arr in enumerate(all_values):
+        assert_array_equal(arr, np.arange(9).reshape((3, 3)) + i % 5)
+        assert arr is all_values[i % 5]
+    assert reader.cache_info().currsize == 5
+    assert reader.cache_info().misses == 5
+    # Symlink to file gives same entry.
+    link = str(tmp_path / 'link.txt')
+    os.symlink(fnames[1], link)
+    assert reader.read(link) is all_values[1]
+    # Changed file gets new entry.
+    with open(fnames[2], 'wt') as fobj:
+        fobj.write('1 2 3\n')
+    assert_array_equal(reader.read(fnames[2]), [[1, 2, 3]])
+    timings = reader.read_timings(fnames[:2])
+    assert_array_equal(timings[1].onsets, [1, 4, 7])
+    # Errors.
+    missing = str(tmp_path / 'missing.txt')
+    with pytest.raises(OSError):
+        reader.read_many([fnames[0], missing])
+    assert reader.read_many([fnames[0], missing],
+                            skip_errors=True)[1] is None
+    # LRU.
+    reader.maxsize = 2
+    fname = str(tmp_path / 'new.txt')
+    np.savetxt(fname, np.ones((2, 3)))
+    new_values = reader.read(fname)
+    assert reader.cache_info().currsize == 2
+    assert reader.read(fname) is new_values
+    reader.cache_clear()
+    assert tuple(reader.cache_info()) == (0, 0, 2, 0)
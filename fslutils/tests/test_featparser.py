@@ -1,14 +1,24 @@
 """ Tests parsing of FEAT output files
 """
 
+import re
 from os.path import join as pjoin, dirname
 from glob import glob
 
 import numpy as np
+from numpy.testing import assert_array_equal
+
+import pytest
 
 from fslutils.supporting import read_file
 from fslutils.featparser import (fsf_to_dict, mat_to_dict, _infer_converter,
-                                 _DEF_RE, _to_bool, FEAT_TOP_TYPES)
+                                 _DEF_RE, _to_bool, FEAT_TOP_TYPES,
+                                 _fsf_to_dict_lines, _CONVERTERS,
+                                 _CONVERTER_REGEXPS, register_converter,
+                                 unregister_converter, MATRIX_FAMILIES,
+                                 _matrix_field, iter_fsf, dict_from_events,
+                                 _mat_to_dict_lines, dict_to_fsf,
+                                 dict_to_mat, iter_mat, mat_ppheights)
 
 
 DATA_DIR = pjoin(dirname(__file__), 'data')
@@ -44,6 +54,83 @@ def test__infer_converter():
     assert _infer_converter('confoundevs') == int
 
 
+def _linear_converter(field_name):
+    # Reference implementation searching regexps in turn.
+    if field_name in _CONVERTERS:
+        return _CONVERTERS[field_name]
+    for regexp, converter in _CONVERTER_REGEXPS:
+        if regexp.search(field_name) is not None:
+            return converter
+    return str
+
+
+def test__infer_converter_dispatch():
+    # Combined dispatch gives the same answer as searching in turn.
+    field_names = ['evg1.1_yn', 'groupmem.3', 'con_real2.10', 'con_orig1.1',
+                   'evg12.2', 'shape1', 'convolve2', 'convolve_phase3',
+                   'tempfilt_yn1', 'deriv_yn', 'custom1', 'xevg1.1']
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        field_names += list(fsf_to_dict(read_file(design_fname))['fmri'])
+    for field_name in field_names:
+        assert (_infer_converter(field_name) ==
+                _linear_converter(field_name))
+    # Yes / no test has priority over following regexps.
+    assert _infer_converter('evg1.1_yn') == _to_bool
+    assert _infer_converter('xevg1.1') == str
+
+
+def test_register_converter():
+    try:
+        register_converter(r'^my_site\d+', float)
+        assert _infer_converter('my_site1') == float
+        assert fsf_to_dict('set fmri(my_site2) 3') == {
+            'fmri': {'my_site2': 3.0}}
+        # Takes precedence over built-in patterns, not over known fields.
+        register_converter('evg', str)
+        assert _infer_converter('evg1.1') == str
+        register_converter('^level$', float)
+        assert _infer_converter('level') == int
+        # Most recent registration wins.
+        register_converter(r'^my_site\d+', int)
+        assert _infer_converter('my_site1') == int
+    finally:
+        for pattern in (r'^my_site\d+', 'evg', '^level$'):
+            unregister_converter(pattern)
+    assert _infer_converter('my_site1') == str
+    assert _infer_converter('evg1.1') == float
+    with pytest.raises(ValueError):
+        fsf_to_dict('set fmri(evg1.1) one')
+
+
+def test_register_converter_patterns():
+    # Any regexp that works with search works for registration.
+    case_re = re.compile('MYFIELD', re.I)
+    patterns = [r'foo\d|bar\d', case_re, '(?i)^abc', r'^(a)\1']
+    try:
+        for pattern in patterns:
+            register_converter(pattern, float)
+        for name in ('xbar1', 'foo2', 'x_myfield', 'ABCd', 'aa1'):
+            assert _infer_converter(name) == float
+        assert _infer_converter('ab1') == str
+        # Invalid patterns raise, and leave registrations unchanged.
+        with pytest.raises(re.error):
+            register_converter('(unclosed', int)
+        assert _infer_converter('xbar1') == float
+        assert fsf_to_dict('set fmri(tr) 2') == {'fmri': {'tr': 2.0}}
+    finally:
+        for pattern in patterns:
+            unregister_converter(pattern)
+    assert _infer_converter('x_myfield') == str
+    # Compiled patterns only unregister with matching flags.
+    try:
+        register_converter(case_re, float)
+        unregister_converter(re.compile('MYFIELD'))
+        assert _infer_converter('myfield') == float
+    finally:
+        unregister_converter(case_re)
+    assert _infer_converter('myfield') == str
+
+
 def test_converter_types():
     fname = pjoin(DATA_DIR, 'with_confevs.fsf')
     design = fsf_to_dict(read_file(fname))
@@ -62,6 +149,136 @@ def test_fsf_to_dict_all():
         assert design['fmri']['version'] == '6.00'
 
 
+def test_fsf_to_dict_vs_lines():
+    # Whole-buffer parser gives same result as line-by-line parser.
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        assert fsf_to_dict(contents) == _fsf_to_dict_lines(contents)
+        # Windows line endings.
+        crlf = contents.replace('\n', '\r\n')
+        assert fsf_to_dict(crlf) == _fsf_to_dict_lines(crlf)
+        # Old Mac (CR only) line endings.
+        cr = contents.replace('\n', '\r')
+        assert fsf_to_dict(cr) == _fsf_to_dict_lines(cr)
+    # Definitions must start at beginning of line.
+    assert fsf_to_dict('# set fmri(level) 1\n set fmri(tr) 2\n') == {}
+    assert fsf_to_dict('set fmri(level) 1') == {'fmri': {'level': 1}}
+
+
+def test_fsf_to_dict_arrays():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        design = fsf_to_dict(contents)
+        a_design = fsf_to_dict(contents, arrays=True)
+        fmri, a_fmri = design['fmri'], a_design.pop('fmri')
+        arrays = a_design.pop('fmri_arrays')
+        # Other tops unchanged
+        assert a_design == dict((k, v) for k, v in design.items()
+                                if k != 'fmri')
+        assert set(arrays).issubset(MATRIX_FAMILIES)
+        # Every field is either in fmri or in the arrays.
+        for field_name, value in fmri.items():
+            if field_name in a_fmri:
+                assert a_fmri[field_name] == value
+                continue
+            family, row, col = _matrix_field(field_name)
+            arr = arrays[family]
+            dtype, col_base = MATRIX_FAMILIES[family]
+            assert arr.dtype == np.dtype(dtype)
+            assert not arr.flags.writeable
+            index = int(col) - col_base
+            if row is not None:
+                index = (int(row) - 1, index)
+            assert arr[index] == dtype(value)
+    design = fsf_to_dict(read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf')),
+                         arrays=True)
+    arrays = design['fmri_arrays']
+    assert arrays['evg'].shape == (48, 24)
+    assert arrays['con_real'].shape == (24, 24)
+    assert arrays['ortho'].shape == (24, 25)
+    assert arrays['conmask'].shape == (24, 24)
+    assert arrays['groupmem'].shape == (48,)
+    assert 'evg1.1' not in design['fmri']
+    assert 'conname_real.1' in design['fmri']
+
+
+def test_dict_to_fsf():
+    for fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(fname)
+        fsf_dict = fsf_to_dict(contents)
+        out = dict_to_fsf(fsf_dict)
+        assert fsf_to_dict(out) == fsf_dict
+        assert out.count('\n') == sum(len(v) for v in fsf_dict.values())
+        arr_dict = fsf_to_dict(contents, arrays=True)
+        arr_back = fsf_to_dict(dict_to_fsf(arr_dict), arrays=True)
+        assert arr_back['fmri'] == arr_dict['fmri']
+        assert arr_back['feat_files'] == arr_dict['feat_files']
+        assert set(arr_back['fmri_arrays']) == set(arr_dict['fmri_arrays'])
+        for family, arr in arr_dict['fmri_arrays'].items():
+            assert arr_back['fmri_arrays'][family].dtype == arr.dtype
+            assert_array_equal(arr_back['fmri_arrays'][family], arr)
+        # Arrays written as fields
+        assert fsf_to_dict(dict_to_fsf(arr_dict)) == fsf_dict
+    # Quoting and formatting
+    out = dict_to_fsf({
+        'fmri': {'version': '6.00', 'outputdir': '/some/path',
+                 'evtitle1': '', 'level': 2, 'tr': 0.1, 'mc_yn': True,
+                 'smooth': np.float64(2.5), 'npts': np.int32(10),
+                 'inmelodic': False, 'help_yn': np.bool_(True),
+                 'featwatcher_yn': np.bool_(False),
+                 'smooth_mm': np.float32(0.5)},
+        'feat_files': ['one', '2']})
+    assert out == '\n'.join([
+        'set fmri(version) 6.00',
+        'set fmri(outputdir) "/some/path"',
+        'set fmri(evtitle1) ""',
+        'set fmri(level) 2',
+        'set fmri(tr) 0.1',
+        'set fmri(mc_yn) 1',
+        'set fmri(smooth) 2.5',
+        'set fmri(npts) 10',
+        'set fmri(inmelodic) 0',
+        'set fmri(help_yn) 1',
+        'set fmri(featwatcher_yn) 0',
+        'set fmri(smooth_mm) 0.5',
+        'set feat_files(1) "one"',
+        'set feat_files(2) "2"',
+        ''])
+    out = dict_to_fsf({'fmri': {}, 'fmri_arrays': {
+        'evg': np.array([[1, 2.5], [3, 4]]),
+        'ortho': np.array([[0, 1]]),
+        'conmask': np.array([[1]]),
+        'groupmem': np.array([1, 2])}})
+    assert out.splitlines() == [
+        'set fmri(evg1.1) 1.0', 'set fmri(evg1.2) 2.5',
+        'set fmri(evg2.1) 3.0', 'set fmri(evg2.2) 4.0',
+        'set fmri(ortho1.0) 0', 'set fmri(ortho1.1) 1',
+        'set fmri(conmask1_1) 1',
+        'set fmri(groupmem.1) 1', 'set fmri(groupmem.2) 2']
+    with pytest.raises(ValueError):
+        dict_to_fsf({'fmri': {'evtitle1': 'two\nlines'}})
+
+
+def test_iter_fsf():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        with open(design_fname, 'rt') as fobj:
+            events = list(iter_fsf(fobj))
+        assert events == list(iter_fsf(contents.splitlines()))
+        assert dict_from_events(events) == fsf_to_dict(contents)
+    with open(pjoin(DATA_DIR, 'one_sess_group.fsf'), 'rt') as fobj:
+        events = iter_fsf(fobj)
+        assert next(events) == ('fmri', 'version', '6.00')
+        assert next(events) == ('fmri', 'inmelodic', False)
+        # Filter events
+        feat_files = [e for e in events if e[0] == 'feat_files']
+    assert feat_files[0] == (
+        'feat_files', 0,
+        '/home/people/brettmz/replication/feat/1/balloon/sub-01_balloon.feat')
+    assert dict_from_events(feat_files) == {
+        'feat_files': [v for t, f, v in feat_files]}
+
+
 def test_fsf_to_dict_one_sess_group():
     # Specific tests.
     design = fsf_to_dict(read_file(pjoin(DATA_DIR, 'one_sess_group.fsf')))
@@ -101,6 +318,32 @@ def test_mat_to_dict_all():
         assert len(dmat['PPheights']) == dmat['NumWaves']
 
 
+def test_mat_to_dict_vs_lines():
+    for fname in glob(pjoin(DATA_DIR, '*.mat')):
+        contents = read_file(fname)
+        for mat in (contents, contents.replace('\n', '\r\n')):
+            dmat = mat_to_dict(mat)
+            exp_dmat = _mat_to_dict_lines(mat)
+            assert set(dmat) == set(exp_dmat)
+            for key, value in exp_dmat.items():
+                assert_array_equal(dmat[key], value)
+            assert dmat['Matrix'].dtype == np.float64
+    header = '/NumWaves 2\n/NumPoints 3\n/PPheights 1 1\n\n/Matrix\n'
+    dmat = mat_to_dict(header + '1 2\n3 4\n5 6\n')
+    assert_array_equal(dmat['Matrix'], [[1, 2], [3, 4], [5, 6]])
+    # Wrong number of values for shape.
+    with pytest.raises(ValueError):
+        mat_to_dict(header + '1 2\n3 4\n')
+    with pytest.raises(ValueError):
+        mat_to_dict(header + '1 2\n3 4\n5 6\n7 8\n')
+    # Invalid values
+    with pytest.raises(ValueError):
+        mat_to_dict(header + '1 2\n3 four\n5 6\n')
+    # Without shape in header, fall back to line parser.
+    dmat = mat_to_dict('/PPheights 1 1\n\n/Matrix\n1 2\n3 4\n')
+    assert_array_equal(dmat['Matrix'], [[1, 2], [3, 4]])
+
+
 def test_mat_to_dict_group(bart_pumps):
     dmat = mat_to_dict(read_file(pjoin(DATA_DIR, 'one_sess_group.mat')))
     exp_x = np.ones((24, 2))
@@ -117,3 +360,40 @@ def test_mat_to_dict_level1():
 def test_mat_to_dict_mid():
     dmat = mat_to_dict(read_file(pjoin(DATA_DIR, 'two_sess_mid.mat')))
     assert dmat['Matrix'].shape == (48, 24)
+
+
+def test_dict_to_mat():
+    for fname in glob(pjoin(DATA_DIR, '*.mat')):
+        contents = read_file(fname)
+        mat_dict = mat_to_dict(contents)
+        assert dict_to_mat(mat_dict) == contents
+        chunks = list(iter_mat(mat_dict['Matrix'], mat_dict['PPheights'],
+                               chunk_rows=10))
+        assert len(chunks) == 1 + np.ceil(mat_dict['NumPoints'] / 10)
+        assert ''.join(chunks) == contents
+    # Heights from matrix
+    for basename in ('one_sess_group.mat', 'two_sess_mid.mat'):
+        mat_dict = mat_to_dict(read_file(pjoin(DATA_DIR, basename)))
+        assert_array_equal(mat_ppheights(mat_dict['Matrix'], chunk_rows=5),
+                           mat_dict['PPheights'])
+        del mat_dict['PPheights']
+        assert dict_to_mat(mat_dict) == read_file(pjoin(DATA_DIR, basename))
+    assert_array_equal(mat_ppheights(np.zeros((0, 2))), [0, 0])
+    assert_array_equal(mat_ppheights([[-2, 0], [-2, 1]] * np.ones((1, 2))),
+                       [2, 1])
+    # Exact round trip with enough precision.
+    rng = np.random.RandomState(12)
+    matrix = rng.normal(size=(7, 3))
+    mat_dict = mat_to_dict(dict_to_mat({'Matrix': matrix}, fmt='%.17e'))
+    assert_array_equal(mat_dict['Matrix'], matrix)
+    assert mat_dict['NumWaves'] == 3
+    assert mat_dict['NumPoints'] == 7
+    assert_array_equal(mat_dict['PPheights'], np.ptp(matrix, axis=0))
+    # Other header fields
+    mat_dict = mat_to_dict(dict_to_mat({'Matrix': matrix[:, :1],
+                                        'PPheights': 2.0,
+                                        'Extra': [1.5, 2.5]}))
+    assert mat_dict['PPheights'] == 2
+    assert mat_dict['Extra'] == [1.5, 2.5]
+    with pytest.raises(ValueError):
+        dict_to_mat({'Matrix': matrix, 'PPheights': [1, 2]})
@@ -1,7 +1,12 @@
 """ Test FSF object
 """
 
+import os
 from os.path import join as pjoin, dirname
+import shutil
+import asyncio
+from threading import Lock
+import time
 from glob import glob
 from collections import OrderedDict
 from io import StringIO
@@ -9,8 +14,13 @@ from io import StringIO
 import numpy as np
 from numpy.testing import assert_array_equal
 
+import pytest
+
 from fslutils.supporting import read_file
-from fslutils.fsf import (FSF, load, loads)
+from fslutils.fsf import (FSF, LazyFSF, CompactFSF, MemoLoader, load, loads,
+                          memo_load, load_many, iload_many, LoadResult,
+                          aload, aload_many, _numbered_index, dump,
+                          dumps)
 
 
 DATA_DIR = pjoin(dirname(__file__), 'data')
@@ -48,6 +58,420 @@ def test_fsf_all():
     assert fsf.filename == pjoin(DATA_DIR, 'level1.feat', 'design.fsf')
 
 
+def test_fsf_arrays():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        fsf = load(design_fname)
+        assert fsf.fmri_arrays is None
+        a_fsf = load(design_fname, arrays=True)
+        for attr in ('evgs', 'groupmem'):
+            assert_array_equal(getattr(a_fsf, attr), getattr(fsf, attr))
+        for attr in ('contrasts_real', 'contrasts_orig'):
+            contrasts = getattr(fsf, attr)
+            a_contrasts = getattr(a_fsf, attr)
+            assert list(a_contrasts) == list(contrasts)
+            for name, values in contrasts.items():
+                assert_array_equal(a_contrasts[name], values)
+        assert a_fsf.events == fsf.events
+        assert a_fsf.n_events == fsf.n_events
+    # Arrays attached to object
+    fsf = loads(read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf')), arrays=True)
+    assert fsf.evgs is fsf.fmri_arrays['evg']
+    assert_array_equal(fsf.evgs, np.kron(np.eye(24), np.ones((2, 1))))
+    # Contrasts without rows give the same result as for fields in ``fmri``.
+    contents = ('set fmri(conname_real.1) "one"\n'
+                'set fmri(conname_real.2) "two"\n'
+                'set fmri(con_real1.1) 1\n'
+                'set fmri(conname_orig.1) "orig"\n')
+    fsf, a_fsf = loads(contents), loads(contents, arrays=True)
+    for attr in ('contrasts_real', 'contrasts_orig'):
+        contrasts = getattr(fsf, attr)
+        a_contrasts = getattr(a_fsf, attr)
+        assert list(a_contrasts) == list(contrasts)
+        for name, values in contrasts.items():
+            assert_array_equal(a_contrasts[name], values)
+    assert_array_equal(a_fsf.contrasts_real['two'], [])
+    assert_array_equal(a_fsf.contrasts_orig['orig'], [])
+
+
+def test_numbered_index():
+    fsfd = {'evg1.2': 12, 'evg1.10': 110, 'evg1.1': 11, 'evg10.1': 101,
+            'evtitle2': 'two', 'evtitle1': 'one', 'level': 1}
+    index = _numbered_index(fsfd)
+    assert index == {'evg1.': [(1, 11), (2, 12), (10, 110)],
+                     'evg10.': [(1, 101)],
+                     'evtitle': [(1, 'one'), (2, 'two')]}
+    fsf = loads('set fmri(level) 1')
+    fsf._index = index
+    assert fsf._numbered_vals('evg1.') == [11, 12, 110]
+    assert fsf._numbered_vals('evtitle') == ['one', 'two']
+    assert fsf._numbered_vals('evg2.') == []
+
+
+def test_fsf_cache():
+    fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf'))
+    assert fsf._cache == {}
+    evgs = fsf.evgs
+    assert fsf.evgs is evgs
+    # Cached arrays are read-only
+    with pytest.raises(ValueError):
+        evgs[0, 0] = 99
+    contrasts = fsf.contrasts_real
+    with pytest.raises(ValueError):
+        contrasts['Group mean'][0] = 99
+    # New dicts for each access, sharing arrays.
+    assert fsf.contrasts_real is not contrasts
+    assert fsf.contrasts_real['Group mean'] is contrasts['Group mean']
+    contrasts.clear()
+    assert list(fsf.contrasts_real) == ['Group mean']
+    events = fsf.events
+    for event in events.values():
+        event.clear()
+    assert fsf.events == load(pjoin(DATA_DIR, 'one_sess_group.fsf')).events
+    # Setting fields resets cache and index.
+    fsf.set_fields({'evg1.2': 99.0, 'conname_real.1': 'Mean'})
+    assert fsf.evgs is not evgs
+    assert fsf.evgs[0, 1] == 99
+    assert list(fsf.contrasts_real) == ['Mean']
+    # Direct modification needs invalidate.
+    fsf.fmri['groupmem.1'] = 2
+    assert fsf.groupmem[0] == 1
+    fsf.invalidate()
+    assert fsf.groupmem[0] == 2
+    # Precompute fills cache, returns object
+    assert fsf.precompute() is fsf
+    assert set(fsf._cache) == set(FSF._derived)
+    # Cannot set matrix fields in arrays mode.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf'), arrays=True)
+    with pytest.raises(ValueError):
+        fsf.set_fields({'evg1.2': 99.0})
+    fsf.set_fields({'conname_real.1': 'Mean'})
+    assert list(fsf.contrasts_real) == ['Mean']
+
+
+def test_lazy_fsf():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        fsf = load(design_fname)
+        lazy = LazyFSF.from_file(design_fname)
+        assert lazy.filename == design_fname
+        assert lazy.fmri._values == {}
+        assert len(lazy.fmri) == len(fsf.fmri)
+        assert list(lazy.fmri) == list(fsf.fmri)
+        assert lazy.feat_files == fsf.feat_files
+        for attr in ('evgs', 'groupmem'):
+            assert_array_equal(getattr(lazy, attr), getattr(fsf, attr))
+        for attr in ('contrasts_real', 'contrasts_orig'):
+            contrasts = getattr(fsf, attr)
+            lazy_contrasts = getattr(lazy, attr)
+            assert list(lazy_contrasts) == list(contrasts)
+            for name, values in contrasts.items():
+                assert_array_equal(lazy_contrasts[name], values)
+        assert lazy.events == fsf.events
+        assert lazy.n_events == fsf.n_events
+        assert lazy.fmri == fsf.fmri
+    lazy = LazyFSF(read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf')))
+    assert lazy.fmri['outputdir'] == ('/home/people/brettmz/replication/'
+                                      'feat/2/SS_combined')
+    assert list(lazy.fmri._values) == ['outputdir']
+    # Accessing numbered field decodes whole family
+    assert lazy.fmri['evg1.1'] == 1
+    assert len(lazy.fmri._values) == 1 + 48 * 24
+    assert 'feat_files' not in lazy.__dict__
+    assert len(lazy.feat_files) == 48
+    assert 'feat_files' in lazy.__dict__
+    with pytest.raises(AttributeError):
+        lazy.initial_highres_files
+    with pytest.raises(KeyError):
+        lazy.fmri['not_a_field']
+    # Setting and deleting fields
+    lazy.set_fields({'evg1.1': 2.0, 'new_field': 'foo'})
+    assert lazy.fmri['evg1.1'] == 2
+    assert lazy.evgs[0, 0] == 2
+    assert list(lazy.fmri)[-1] == 'new_field'
+    del lazy.fmri['new_field']
+    assert 'new_field' not in lazy.fmri
+    # Fields found without scanning whole file; first line, last definition.
+    lazy = LazyFSF('set fmri(level) 1\nset fmri(level) 2\n'
+                   '# set fmri(tr) 3\nset fmri(tr) 2.5\n')
+    assert lazy.fmri['level'] == 2
+    assert lazy.fmri['tr'] == 2.5
+    assert 'npts' not in lazy.fmri
+    assert lazy.fmri._offsets is None
+    assert list(lazy.fmri) == ['level', 'tr']
+    for newline in ('\r\n', '\r'):
+        other = LazyFSF('set fmri(level) 1{0}set feat_files(1) "a"{0}'
+                        'set fmri(tr) 2.5{0}'.format(newline))
+        assert other.fmri['tr'] == 2.5
+        assert other.feat_files == ['a']
+        assert other.fmri == {'level': 1, 'tr': 2.5}
+    with pytest.raises(AttributeError):
+        lazy.feat_files
+    with pytest.raises(ValueError):
+        LazyFSF('set fmri(level) 1', arrays=True)
+
+
+def test_lazy_fsf_copy():
+    # Copies decode tops independently.
+    lazy = LazyFSF(read_file(pjoin(DATA_DIR, 'two_sess_mid.fsf')))
+    copied = lazy.copy()
+    assert len(copied.feat_files) == 48
+    assert len(lazy.feat_files) == 48
+    copied = lazy.copy()
+    assert copied.feat_files == lazy.feat_files
+    assert copied.feat_files is not lazy.feat_files
+    assert lazy.fmri['level'] == 2
+    copied = lazy.copy()
+    copied.set_fields({'level': 1})
+    assert copied.fmri['level'] == 1
+    assert lazy.fmri['level'] == 2
+    assert_array_equal(copied.evgs, lazy.evgs)
+
+
+def test_fsf_copy():
+    fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf')).precompute()
+    fsf2 = fsf.copy()
+    assert fsf2.filename == fsf.filename
+    assert fsf2.fmri == fsf.fmri
+    assert fsf2.fmri is not fsf.fmri
+    assert fsf2.feat_files is not fsf.feat_files
+    assert fsf2.evgs is fsf.evgs
+    fsf2.set_fields({'evg1.2': 99.0})
+    fsf2.feat_files.append('another.feat')
+    assert fsf2.evgs[0, 1] == 99
+    assert fsf.evgs[0, 1] != 99
+    assert len(fsf.feat_files) == 24
+    # Other attributes copied too.
+    fsf.subject = 'sub-01'
+    assert fsf.copy().subject == 'sub-01'
+
+
+def test_compact_fsf():
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        for arrays in (False, True):
+            fsf = FSF(contents, arrays)
+            for keep in ('compress', True, False):
+                compact = CompactFSF(contents, arrays, keep)
+                assert 'contents' not in compact.__dict__
+                assert compact.contents == (None if keep is False
+                                            else contents)
+                assert compact.fmri == fsf.fmri
+                assert compact.feat_files == fsf.feat_files
+                assert_array_equal(compact.evgs, fsf.evgs)
+                assert_array_equal(compact.groupmem, fsf.groupmem)
+                assert compact.events == fsf.events
+    fname = pjoin(DATA_DIR, 'two_sess_mid.fsf')
+    fsf = load(fname)
+    compact = CompactFSF.from_file(fname)
+    # Numbered fields indexed on first use.
+    assert compact._index is None
+    assert_array_equal(compact.evgs, fsf.evgs)
+    assert compact._index is not None
+    compact.invalidate()
+    assert compact._index is None
+    assert isinstance(compact._stored_contents, bytes)
+    assert len(compact._stored_contents) < len(fsf.contents) / 5
+    assert compact.filename == fname
+    assert compact.fmri == fsf.fmri
+    # Field names shared between instances.
+    compact2 = fsf.compact(keep_contents=False)
+    assert isinstance(compact2, CompactFSF)
+    assert compact2.contents is None
+    assert compact2.filename == fname
+    for name1, name2 in zip(compact.fmri, compact2.fmri):
+        assert name1 is name2
+    compact3 = CompactFSF.from_fsf(LazyFSF(fsf.contents), keep_contents=True)
+    assert compact3.contents is fsf.contents
+    assert compact3.fmri == fsf.fmri
+    assert compact3.feat_files == fsf.feat_files
+    # Copies
+    copied = compact.copy()
+    assert copied.contents == fsf.contents
+    assert copied.fmri == fsf.fmri and copied.fmri is not compact.fmri
+    copied.set_fields({'evg1.1': 99.0})
+    assert copied.evgs[0, 0] == 99
+    assert compact.evgs[0, 0] != 99
+    with pytest.raises(ValueError):
+        CompactFSF(fsf.contents, keep_contents='zip')
+
+
+def test_dumps_dump(tmpdir):
+    for design_fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        contents = read_file(design_fname)
+        for fsf in (FSF(contents), FSF(contents, arrays=True),
+                    LazyFSF(contents), CompactFSF(contents, True, False)):
+            arrays = fsf.fmri_arrays is not None
+            back = loads(dumps(fsf), arrays=arrays)
+            assert back.fmri == fsf.fmri
+            assert back.feat_files == fsf.feat_files
+            assert_array_equal(back.evgs, fsf.evgs)
+            assert back.contrasts_real.keys() == fsf.contrasts_real.keys()
+    # We write current values
+    fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf'))
+    fsf.set_fields({'outputdir': '/new/output', 'evg2.2': 99.0})
+    fsf.feat_files[0] = '/new/input.feat'
+    back = loads(dumps(fsf))
+    assert back.fmri['outputdir'] == '/new/output'
+    assert back.evgs[1, 1] == 99
+    assert back.feat_files[0] == '/new/input.feat'
+    # To filename, FEAT directory, file object
+    fname = pjoin(str(tmpdir), 'out.fsf')
+    dump(fsf, fname)
+    assert load(fname).fmri == fsf.fmri
+    feat_dir = str(tmpdir.mkdir('analysis.feat'))
+    dump(fsf, feat_dir)
+    assert load(feat_dir).fmri == fsf.fmri
+    sio = StringIO()
+    dump(fsf, sio)
+    assert sio.getvalue() == dumps(fsf)
+
+
+def test_memo_load(tmpdir):
+    memo = MemoLoader(maxsize=2)
+    feat_dir = pjoin(str(tmpdir), 'level1.feat')
+    os.mkdir(feat_dir)
+    design_fname = pjoin(feat_dir, 'design.fsf')
+    shutil.copy2(pjoin(DATA_DIR, 'one_sess_level1.fsf'), design_fname)
+    link_fname = pjoin(str(tmpdir), 'link.fsf')
+    os.symlink(design_fname, link_fname)
+    exp_fsf = load(design_fname)
+    # FEAT directory, design file and symlink share one entry.
+    for file_ish in (feat_dir, design_fname, link_fname):
+        fsf = memo(file_ish)
+        assert fsf.fmri == exp_fsf.fmri
+    assert fsf.filename == link_fname
+    assert memo(feat_dir).filename == design_fname
+    assert memo.cache_info() == (3, 1, 2, 1)
+    # Copies by default
+    fsf = memo(design_fname)
+    fsf.set_fields({'tr': 3.0})
+    assert memo(design_fname).fmri['tr'] == 2
+    # Shared if requested.
+    memo.copy = False
+    shared = memo(design_fname)
+    assert memo(link_fname) is shared
+    # Shared object is read-only.
+    with pytest.raises(TypeError):
+        shared.fmri['tr'] = 3.0
+    with pytest.raises(AttributeError):
+        shared.set_fields({'tr': 3.0})
+    assert isinstance(shared.feat_files, tuple)
+    assert shared.evgs.flags.writeable is False
+    copied = shared.copy()
+    copied.set_fields({'tr': 3.0})
+    assert shared.fmri['tr'] == 2
+    # Derived values of copies do not change shared object.
+    memo.copy = True
+    names = list(shared.contrasts_real)
+    memo(design_fname).contrasts_real.clear()
+    assert list(shared.contrasts_real) == names
+    assert list(memo(design_fname).contrasts_real) == names
+    memo.copy = False
+    # Arrays mode is a separate entry.
+    a_shared = memo(design_fname, arrays=True)
+    assert a_shared.fmri_arrays is not None
+    with pytest.raises(TypeError):
+        a_shared.fmri_arrays['con_real'] = None
+    with pytest.raises(ValueError):
+        a_shared.fmri_arrays['con_real'][0, 0] = 99
+    a_copied = a_shared.copy()
+    del a_copied.fmri_arrays['con_real']
+    assert 'con_real' in a_shared.fmri_arrays
+    memo.copy = True
+    assert memo.cache_info().currsize == 2
+    # Changed file gives new entry.
+    with open(design_fname, 'at') as fobj:
+        fobj.write('set fmri(new_field) 1\n')
+    assert memo(design_fname).fmri['new_field'] == '1'
+    # LRU entry dropped.
+    assert memo.cache_info() == (9, 3, 2, 2)
+    # Arrays entry is for old file, so is a miss.
+    assert memo(design_fname, arrays=True).fmri['new_field'] == '1'
+    assert memo.cache_info() == (9, 4, 2, 2)
+    memo.cache_clear()
+    assert memo.cache_info() == (0, 0, 2, 0)
+    # File-like objects not cached.
+    with open(design_fname, 'rt') as fobj:
+        assert memo(fobj).fmri['new_field'] == '1'
+    assert memo.cache_info() == (0, 0, 2, 0)
+    # Module-level instance
+    memo_load.cache_clear()
+    assert memo_load(design_fname).fmri['new_field'] == '1'
+    assert memo_load.cache_info().misses == 1
+    memo_load.cache_clear()
+
+
+def test_load_many():
+    paths = sorted(glob(pjoin(DATA_DIR, '*.fsf')))
+    paths += [pjoin(DATA_DIR, 'level1.feat'), pjoin(DATA_DIR, 'missing.fsf')]
+    paths = paths * 3
+    for workers in (1, 2):
+        results = load_many(paths, workers=workers, chunksize=4)
+        assert [r.path for r in results] == paths
+        for result in results:
+            assert isinstance(result, LoadResult)
+            if result.path.endswith('missing.fsf'):
+                assert result.fsf is None
+                assert isinstance(result.error, IOError)
+                continue
+            assert result.error is None
+            exp_fsf = load(result.path)
+            assert result.fsf.filename == exp_fsf.filename
+            assert result.fsf.contents == exp_fsf.contents
+            assert result.fsf.fmri == exp_fsf.fmri
+            assert result.fsf.feat_files == exp_fsf.feat_files
+            assert_array_equal(result.fsf.evgs, exp_fsf.evgs)
+        # Unordered results
+        results = list(iload_many(paths, workers=workers, ordered=False,
+                                  chunksize=2))
+        assert sorted(r.path for r in results) == sorted(paths)
+    # Arrays mode
+    results = load_many(paths[:3], workers=2, arrays=True)
+    for result in results:
+        assert_array_equal(result.fsf.evgs, load(result.path).evgs)
+        for arr in result.fsf.fmri_arrays.values():
+            assert not arr.flags.writeable
+
+
+def test_aload():
+    fname = pjoin(DATA_DIR, 'one_sess_group.fsf')
+    fsf = asyncio.run(aload(fname))
+    assert fsf.filename == fname
+    assert fsf.fmri == load(fname).fmri
+    fsf = asyncio.run(aload(pjoin(DATA_DIR, 'level1.feat'), arrays=True))
+    assert fsf.filename == pjoin(DATA_DIR, 'level1.feat', 'design.fsf')
+    assert fsf.fmri_arrays is not None
+
+
+def test_aload_many():
+    paths = sorted(glob(pjoin(DATA_DIR, '*.fsf')))
+    paths += [pjoin(DATA_DIR, 'level1.feat'), pjoin(DATA_DIR, 'missing.fsf')]
+    paths = paths * 4
+    lock = Lock()
+    counts = dict(current=0, max=0)
+
+    def slow_read(fname):
+        with lock:
+            counts['current'] += 1
+            counts['max'] = max(counts['max'], counts['current'])
+        time.sleep(0.01)
+        with lock:
+            counts['current'] -= 1
+        return read_file(fname)
+
+    results = asyncio.run(aload_many(paths, limit=3, read=slow_read))
+    assert [r.path for r in results] == paths
+    assert 1 < counts['max'] <= 3
+    for result in results:
+        if result.path.endswith('missing.fsf'):
+            assert result.fsf is None
+            assert isinstance(result.error, IOError)
+            continue
+        assert result.error is None
+        exp_fsf = load(result.path)
+        assert result.fsf.filename == exp_fsf.filename
+        assert result.fsf.fmri == exp_fsf.fmri
+
+
 def test_fsf_one_sess_group(bart_pumps):
     # Specific tests.
     fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf'))
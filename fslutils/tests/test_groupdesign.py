@@ -0,0 +1,112 @@
+""" Test building higher-level designs
+"""
+
+from os.path import join as pjoin, dirname
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import pytest
+
+from fslutils.supporting import read_file
+from fslutils.featparser import mat_to_dict
+from fslutils.fsf import load
+from fslutils.matfile import load as load_mat
+from fslutils.groupdesign import (group_design, group_designs, unstack,
+                                  format_mat, format_con, format_grp,
+                                  write_design, GroupDesign)
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def _parse_con(contents):
+    # Names, header fields, matrix from .con file contents
+    header, body = contents.split('/Matrix\n')
+    fields = dict(line[1:].split('\t', 1) for line in header.splitlines()
+                  if line)
+    matrix = np.array([[float(v) for v in line.split()]
+                       for line in body.splitlines()])
+    return fields, matrix
+
+
+def test_group_design():
+    for basename in ('one_sess_group', 'two_sess_mid'):
+        fsf = load(pjoin(DATA_DIR, basename + '.fsf'))
+        mat_fname = pjoin(DATA_DIR, basename + '.mat')
+        mat_dict = load_mat(mat_fname)
+        design = group_design(fsf)
+        assert isinstance(design, GroupDesign)
+        assert_array_equal(design.matrix, mat_dict['Matrix'])
+        assert_array_equal(design.ppheights, mat_dict['PPheights'])
+        assert format_mat(design) == read_file(mat_fname)
+        assert design.con_names == list(fsf.contrasts_real)
+        assert_array_equal(design.contrasts,
+                           list(fsf.contrasts_real.values()))
+        assert_array_equal(design.groupmem, fsf.groupmem)
+        fields, con_matrix = _parse_con(format_con(design))
+        assert fields['ContrastName1'] == design.con_names[0]
+        assert int(fields['NumWaves']) == design.matrix.shape[1]
+        assert int(fields['NumContrasts']) == len(design.con_names)
+        assert_array_equal(con_matrix, design.contrasts)
+        grp = mat_to_dict(format_grp(design))
+        assert_array_equal(grp['Matrix'][:, 0], fsf.groupmem)
+    # Group mean contrast has height 1; mid-level contrasts pick out
+    # indicator columns.
+    design = group_design(load(pjoin(DATA_DIR, 'one_sess_group.fsf')))
+    assert_array_equal(design.con_ppheights, [1])
+    design = group_design(load(pjoin(DATA_DIR, 'two_sess_mid.fsf')))
+    assert_array_equal(design.con_ppheights, np.ones(24))
+    with pytest.raises(ValueError):
+        group_design(load(pjoin(DATA_DIR, 'one_sess_level1.fsf')))
+
+
+def test_group_designs():
+    fsf = load(pjoin(DATA_DIR, 'one_sess_group.fsf'))
+    design = group_design(fsf)
+    # Sign flips of the covariate, as for permutations.
+    rng = np.random.RandomState(42)
+    n_designs = 50
+    signs = rng.choice([-1, 1], size=(n_designs, len(design.matrix)))
+    matrices = np.repeat(design.matrix[None], n_designs, axis=0)
+    matrices[:, :, 1] *= signs
+    stacked = group_designs(matrices, design.contrasts, design.con_names,
+                            design.groupmem)
+    assert stacked.matrix.shape == matrices.shape
+    assert stacked.ppheights.shape == (n_designs, 2)
+    assert stacked.con_ppheights.shape == (n_designs, 1)
+    assert stacked.con_names == design.con_names
+    for i, one in enumerate(unstack(stacked)):
+        assert_array_equal(one.matrix, matrices[i])
+        assert_array_equal(one.ppheights[0], 1)
+        assert one.ppheights[1] == np.ptp(matrices[i, :, 1])
+        assert_array_equal(one.contrasts, design.contrasts)
+        assert_array_equal(one.groupmem, design.groupmem)
+    # Defaults for array designs
+    stacked = group_designs(matrices[:3])
+    assert stacked.contrasts.shape == (3, 0, 2)
+    assert stacked.con_names == []
+    assert_array_equal(stacked.groupmem, np.ones((3, 24)))
+    stacked = group_designs(matrices[:2], contrasts=np.eye(2))
+    assert stacked.con_names == ['C1', 'C2']
+    assert_array_equal(stacked.con_ppheights[:, 0], [1, 1])
+    # FSF designs
+    mid = load(pjoin(DATA_DIR, 'two_sess_mid.fsf'))
+    stacked = group_designs([mid, mid.copy()])
+    assert stacked.matrix.shape == (2, 48, 24)
+    assert_array_equal(stacked.matrix[1], group_design(mid).matrix)
+    with pytest.raises(ValueError):
+        group_designs([mid, fsf])
+    with pytest.raises(ValueError):
+        group_designs([])
+
+
+def test_write_design(tmpdir):
+    out_dir = pjoin(str(tmpdir), 'model')
+    design = group_design(load(pjoin(DATA_DIR, 'two_sess_mid.fsf')))
+    fnames = write_design(design, out_dir)
+    assert fnames == [pjoin(out_dir, 'design' + ext)
+                      for ext in ('.mat', '.con', '.grp')]
+    assert read_file(fnames[0]) == read_file(
+        pjoin(DATA_DIR, 'two_sess_mid.mat'))
+    assert read_file(fnames[1]) == format_con(design)
+    assert read_file(fnames[2]) == format_grp(design)
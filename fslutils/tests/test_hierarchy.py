@@ -0,0 +1,107 @@
+""" Test loading of FEAT analysis trees
+"""
+
+import os
+from os.path import join as pjoin, dirname
+import shutil
+
+from fslutils.supporting import read_file
+from fslutils.fsf import MemoLoader
+from fslutils.hierarchy import load_hierarchy, FeatNode
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+FEAT_ROOT = '/home/people/brettmz/replication/feat'
+
+
+def _make_analysis(feat_dir, design_basename, root):
+    # Make FEAT directory with design from data directory, paths in `root`
+    os.makedirs(feat_dir)
+    contents = read_file(pjoin(DATA_DIR, design_basename))
+    with open(pjoin(feat_dir, 'design.fsf'), 'wt') as fobj:
+        fobj.write(contents.replace(FEAT_ROOT, root))
+    mat_fname = pjoin(DATA_DIR, design_basename[:-4] + '.mat')
+    if os.path.exists(mat_fname):
+        shutil.copy(mat_fname, pjoin(feat_dir, 'design.mat'))
+
+
+def make_tree(root):
+    """ Make group -> mid -> level 1 tree of analyses in `root`
+    """
+    # Group analysis with cope inputs from mid-level gfeat directory.
+    group_dir = pjoin(root, 'group', 'SS.gfeat')
+    _make_analysis(group_dir, 'two_sess_group.fsf', root)
+    mid_dir = pjoin(root, '2', 'SS_combined.gfeat')
+    _make_analysis(mid_dir, 'two_sess_mid.fsf', root)
+    # Level 1 inputs to mid level; leave one out.
+    for sub_no in range(1, 30):
+        for sess_no in (1, 2):
+            if (sub_no, sess_no) == (29, 2):
+                continue
+            _make_analysis(
+                pjoin(root, '1', 'SS',
+                      'sub-{:02d}_SS{}.feat'.format(sub_no, sess_no)),
+                'one_sess_level1.fsf', root)
+    return group_dir, mid_dir
+
+
+def test_load_hierarchy(tmpdir):
+    root = str(tmpdir)
+    group_dir, mid_dir = make_tree(root)
+    for workers in (1, 4):
+        tree = load_hierarchy(group_dir, workers=workers)
+        assert isinstance(tree, FeatNode)
+        assert tree.path == group_dir
+        assert tree.level == 2
+        assert tree.error is None
+        assert tree.missing == []
+        assert tree.mat is None  # No design.mat in test data
+        # All cope inputs come from the same mid-level analysis.
+        assert len(tree.inputs) == 1
+        mid = tree.inputs[0]
+        assert mid.path == mid_dir
+        assert mid.fsf.fmri['outputdir'] == pjoin(root, '2', 'SS_combined')
+        assert mid.mat['Matrix'].shape == (48, 24)
+        assert len(mid.inputs) == 47
+        assert mid.missing == [pjoin(root, '1', 'SS', 'sub-29_SS2.feat')]
+        assert [n.path for n in mid.inputs] == [
+            f for f in mid.fsf.feat_files if not f.endswith('sub-29_SS2.feat')]
+        for node in mid.inputs:
+            assert node.level == 1
+            assert node.inputs == []
+            assert node.mat['Matrix'].shape == (222, 14)
+        nodes = list(tree.walk())
+        assert len(nodes) == 49
+        assert nodes[:3] == [tree, mid, mid.inputs[0]]
+        assert len(tree.at_level(1)) == 47
+        assert tree.at_level(2) == [tree, mid]
+    # Loading from the mid level directly
+    mid = load_hierarchy(mid_dir)
+    assert len(mid.inputs) == 47
+
+
+def test_load_hierarchy_shared(tmpdir):
+    root = str(tmpdir)
+    group_dir, mid_dir = make_tree(root)
+    # Two level-1 inputs are the same analysis, via symlink.
+    sub1 = pjoin(root, '1', 'SS', 'sub-01_SS1.feat')
+    sub2 = pjoin(root, '1', 'SS', 'sub-01_SS2.feat')
+    shutil.rmtree(sub2)
+    os.symlink(sub1, sub2)
+    memo = MemoLoader(copy=False)
+    mid = load_hierarchy(mid_dir, fsf_loader=memo)
+    assert len(mid.inputs) == 46
+    assert memo.cache_info().currsize == 47
+    assert load_hierarchy(mid_dir, fsf_loader=memo).inputs[0].fsf is (
+        mid.inputs[0].fsf)
+    # Error loading design recorded in node.
+    with open(pjoin(sub1, 'design.fsf'), 'wt') as fobj:
+        fobj.write('set unknown(foo) 1\n')
+    mid = load_hierarchy(mid_dir)
+    assert isinstance(mid.inputs[0].error, KeyError)
+    assert mid.inputs[0].fsf is None
+    assert mid.inputs[0].level is None
+    # Design file as root.
+    node = load_hierarchy(pjoin(DATA_DIR, 'one_sess_group.fsf'))
+    assert node.mat['Matrix'].shape == (24, 2)
+    assert len(node.missing) == 24
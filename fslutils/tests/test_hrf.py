@@ -0,0 +1,134 @@
+""" Test HRF kernels
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_array_equal
+
+import pytest
+
+from fslutils.hrf import (gamma_pdf, kernel, kernels, ev_params,
+                          KernelCache)
+
+
+def test_gamma_pdf():
+    times = np.arange(0, 60, 0.01)
+    pdf = gamma_pdf(times, 6, 3)
+    assert pdf[0] == 0
+    assert_almost_equal(pdf.sum() * 0.01, 1, 4)
+    # Mean and standard deviation.
+    mean = (pdf * times).sum() * 0.01
+    assert_almost_equal(mean, 6, 3)
+    assert_almost_equal(np.sqrt((pdf * (times - mean) ** 2).sum() * 0.01),
+                        3, 3)
+
+
+def test_kernel():
+    for code in (1, 2, 3):
+        kern = kernel(code, 0.05)
+        assert_almost_equal(kern.sum(), 1)
+    # Double gamma peaks around 5 seconds, with undershoot.
+    kern = kernel(3, 0.05)
+    assert 4.5 < np.argmax(kern) * 0.05 < 5.5
+    assert kern.min() < 0
+    # Gaussian peaks at delay.
+    assert np.argmax(kernel(1, 0.1, params={'delay': 4})) == 40
+    # Phase shifts earlier.
+    shifted = kernel(2, 0.1, phase=1)
+    assert_almost_equal(shifted[:10] / shifted[10],
+                        kernel(2, 0.1)[10:20] / kernel(2, 0.1)[20])
+    # No convolution; negative phase delays.
+    assert_array_equal(kernel(0, 0.1), [1])
+    assert_array_equal(kernel(0, 0.1, phase=-0.3), [0, 0, 0, 1])
+    with pytest.raises(ValueError):
+        kernel(6, 0.1)
+
+
+def test_basis_functions(tmp_path):
+    # Gamma basis functions.
+    kerns = kernels(4, 0.1, params={'fnum': 4, 'fwidth': 20})
+    assert kerns.shape == (4, 400)
+    assert_almost_equal(kerns.sum(axis=1), 1)
+    peaks = np.argmax(kerns, axis=1)
+    assert np.all(np.diff(peaks) > 0)
+    # Sine basis functions.
+    kerns = kernels(5, 0.1, params={'fnum': 3, 'fwidth': 10})
+    assert kerns.shape == (3, 100)
+    assert_almost_equal(np.abs(kerns).max(axis=1), 1, 2)
+    assert_almost_equal(kerns[1, :50], -kerns[1, 50:][::-1], 1)
+    # FIR basis functions, FEAT defaults.
+    kerns = kernels(6, 0.5)
+    assert kerns.shape == (3, 30)
+    assert_almost_equal(kerns.sum(axis=1), 1)
+    assert_almost_equal(kerns[1], np.repeat([0, 0.1, 0], 10))
+    # Custom basis functions, from file with one function per column.
+    basis = np.column_stack([np.linspace(0, 1, 201), np.ones(201)])
+    bf_fname = str(tmp_path / 'basis.txt')
+    np.savetxt(bf_fname, basis)
+    kerns = kernels(7, 0.1, params={'bfcustom': bf_fname})
+    assert kerns.shape == (2, 101)
+    assert_almost_equal(kerns[0], np.linspace(0, 1, 101))
+    with pytest.raises(ValueError):
+        kernels(7, 0.1)
+    with pytest.raises(ValueError):
+        kernel(6, 0.1)
+
+
+def test_ev_params():
+    fmri = {'convolve1': 2, 'convolve_phase1': 0.5, 'gammasigma1': 2.0,
+            'gammadelay1': 5.0, 'gausssigma1': 1.0,
+            'convolve2': 6, 'basisfnum2': '4', 'basisfwidth2': '12',
+            'convolve3': 3}
+    assert ev_params(fmri, 1) == (2, 0.5, (('delay', 5.0), ('sigma', 2.0)))
+    assert ev_params(fmri, 2) == (6, 0, (('fnum', 4.0), ('fwidth', 12.0)))
+    assert ev_params(fmri, 3) == (3, 0, ())
+    assert ev_params(fmri, 4) == (0, 0, ())
+
+
+def test_kernel_cache(tmp_path):
+    cache = KernelCache(maxsize=3)
+    kerns = cache(3, 2.0, 20)
+    assert_array_equal(kerns, kernels(3, 0.1))
+    # Read-only, and shared.
+    assert not kerns.flags.writeable
+    with pytest.raises(ValueError):
+        kerns[0, 0] = 1
+    assert cache(3, 2.0, 20) is kerns
+    assert cache(3, 2.0, 20, 0., {}) is kerns
+    assert tuple(cache.cache_info()) == (2, 1, 3, 1)
+    # Parameters as dicts or tuples.
+    gamma = cache(2, 2.0, 20, 0., {'sigma': 2, 'delay': 5})
+    assert cache(2, 2.0, 20, 0., (('delay', 5), ('sigma', 2))) is gamma
+    assert_array_equal(gamma, kernels(2, 0.1, params={'sigma': 2,
+                                                      'delay': 5}))
+    # Spectra.
+    spectrum = cache.spectrum(3, 2.0, 20, n_fft=1024)
+    assert_almost_equal(spectrum, np.fft.rfft(kerns, 1024, axis=1))
+    assert not spectrum.flags.writeable
+    assert cache.spectrum(3, 2.0, 20, n_fft=1024) is spectrum
+    # Least recently used entries drop out.
+    assert cache.cache_info().currsize == 3
+    cache(3, 2.0, 20, phase=1.)
+    assert cache.cache_info().currsize == 3
+    # Gamma kernel was least recently used; spectrum uses kernel.
+    assert cache(3, 2.0, 20) is kerns
+    assert cache(2, 2.0, 20, 0., {'sigma': 2, 'delay': 5}) is not gamma
+    cache.cache_clear()
+    assert tuple(cache.cache_info()) == (0, 0, 3, 0)
+    # Threads share arrays.
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda i: cache(1, 1.0, 10 + i % 2),
+                                    range(64)))
+    assert len(set(id(r) for r in results)) == 2
+    # Custom basis functions keyed on file identity.
+    bf_fname = str(tmp_path / 'basis.txt')
+    np.savetxt(bf_fname, np.ones((201, 2)))
+    params = {'bfcustom': bf_fname}
+    custom = cache(7, 2.0, 20, 0., params)
+    assert cache(7, 2.0, 20, 0., params) is custom
+    np.savetxt(bf_fname, np.ones((201, 3)))
+    stat = os.stat(bf_fname)
+    os.utime(bf_fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache(7, 2.0, 20, 0., params).shape == (3, 101)
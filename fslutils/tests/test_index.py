@@ -0,0 +1,104 @@
+""" Test SQLite index of designs
+"""
+
+import os
+from os.path import join as pjoin, dirname
+import shutil
+from glob import glob
+
+from fslutils.fsf import FSF, load
+from fslutils.index import DesignIndex, DesignHandle, CrawlInfo
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def _copy_designs(root):
+    for fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        shutil.copy2(fname, root)
+    shutil.copytree(pjoin(DATA_DIR, 'level1.feat'),
+                    pjoin(root, 'sub', 'level1.feat'))
+    return sorted(glob(pjoin(root, '*.fsf')) +
+                  [pjoin(root, 'sub', 'level1.feat', 'design.fsf')])
+
+
+def test_index_query(tmpdir):
+    root = str(tmpdir.mkdir('designs'))
+    paths = _copy_designs(root)
+    db_path = str(tmpdir.join('index.sqlite'))
+    with DesignIndex(db_path) as index:
+        info = index.crawl(root)
+        assert info == CrawlInfo(len(paths), 0, 0, 0, [])
+        assert len(index) == len(paths)
+        assert index.query() == paths
+        level1 = [p for p in paths if load(p).fmri['level'] == 1]
+        assert index.query(level=1) == level1
+        confevs = pjoin(root, 'with_confevs.fsf')
+        assert index.query(level=1, tr=2) == [
+            p for p in level1 if p != confevs]
+        assert index.query(level=1, tr__gt=2) == [confevs]
+        assert index.query(smooth__gt=5, level__ne=2) == [confevs]
+        assert index.query(smooth__ge=5, level__lt=2) == level1
+        assert index.query(outputdir__like='%/SS_combined') == [
+            pjoin(root, 'two_sess_mid.fsf')]
+        # List tops match on any element
+        assert index.query(
+            feat_files='/home/people/brettmz/replication/feat/1/SS/'
+            'sub-29_SS2.feat') == [pjoin(root, 'two_sess_mid.fsf')]
+        handles = index.handles(level=2)
+        assert [h.path for h in handles] == index.query(level=2)
+        for handle in handles:
+            assert isinstance(handle, DesignHandle)
+            fsf = handle.load()
+            assert isinstance(fsf, FSF)
+            assert fsf.fmri['level'] == handle.fmri['level'] == 2
+            assert handle.fmri['outputdir'] == fsf.fmri['outputdir']
+            assert handle.fmri['tr'] == fsf.fmri['tr']
+    # Index persists; recrawl only parses changed files.
+    with DesignIndex(db_path) as index:
+        assert index.crawl(root) == CrawlInfo(0, 0, 0, len(paths), [])
+        changed = pjoin(root, 'one_sess_group.fsf')
+        with open(changed, 'at') as fobj:
+            fobj.write('set fmri(smooth) 8.0\n')
+        os.unlink(confevs)
+        bad = pjoin(root, 'sub', 'bad.fsf')
+        with open(bad, 'wt') as fobj:
+            fobj.write('set unknown(foo) 1\n')
+        info = index.crawl(root)
+        assert info == CrawlInfo(1, 1, 1, len(paths) - 2, [bad])
+        assert index.query(smooth=8) == [changed]
+        assert confevs not in index.query()
+        assert list(index.errors()) == [bad]
+        assert index.query(level=1, tr__ge=2) == [
+            p for p in level1 if p != confevs]
+        # Crawl of other tree leaves this tree alone.
+        other = str(tmpdir.mkdir('other'))
+        shutil.copy2(pjoin(DATA_DIR, 'one_sess_level1.fsf'), other)
+        assert index.crawl(other) == CrawlInfo(1, 0, 0, 0, [])
+        assert len(index) == len(paths) + 1
+
+
+def test_crawl_similar_roots(tmpdir):
+    # Roots differing by case, or containing LIKE wildcards, are separate.
+    index = DesignIndex()
+    roots = [str(tmpdir.mkdir(name)) for name in ('site', 'Site', 's_te',
+                                                  's%te')]
+    for root in roots:
+        shutil.copy2(pjoin(DATA_DIR, 'one_sess_level1.fsf'), root)
+    for root in roots:
+        assert index.crawl(root) == CrawlInfo(1, 0, 0, 0, [])
+    assert len(index) == 4
+    for root in roots:
+        assert index.crawl(root) == CrawlInfo(0, 0, 0, 1, [])
+    assert index.query() == sorted(pjoin(root, 'one_sess_level1.fsf')
+                                   for root in roots)
+
+
+def test_crawl_dangling(tmpdir):
+    # Files we cannot stat are failures; other designs still indexed.
+    root = str(tmpdir.mkdir('designs'))
+    paths = _copy_designs(root)
+    dangling = pjoin(root, 'dangling.fsf')
+    os.symlink(pjoin(root, 'missing.fsf'), dangling)
+    index = DesignIndex()
+    assert index.crawl(root) == CrawlInfo(len(paths), 0, 0, 0, [dangling])
+    assert index.query() == paths
@@ -0,0 +1,174 @@
+""" Test building first-level designs
+"""
+
+from os.path import join as pjoin, dirname
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_almost_equal
+
+import pytest
+
+from fslutils.fsf import load, loads, dumps
+from fslutils.matfile import load as load_mat
+from fslutils.hrf import kernel, KernelCache
+from fslutils.evfiles import EVReader
+from fslutils.level1 import (level1_design, level1_designs, highpass_basis,
+                             highpass_filter)
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def _random_events(rng, n_events=20, duration=440):
+    onsets = np.sort(rng.uniform(0, duration, size=n_events))
+    return np.column_stack([onsets,
+                            rng.uniform(0.5, 4, size=n_events),
+                            rng.uniform(0.5, 2, size=n_events)])
+
+
+def test_one_sess_level1():
+    # The custom EV files and motion parameters for this design are not
+    # available, so use random events and confounds, and check the design
+    # has the structure of the design from feat_model.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    expected = load_mat(pjoin(DATA_DIR, 'one_sess_level1.mat'))
+    rng = np.random.RandomState(12)
+    ev_files = {i: _random_events(rng) for i in range(1, 5)}
+    confounds = rng.normal(size=(222, 6))
+    design = level1_design(fsf, ev_files, confounds)
+    matrix = design['Matrix']
+    assert matrix.shape == expected['Matrix'].shape == (222, 14)
+    assert design['NumWaves'] == expected['NumWaves']
+    assert design['NumPoints'] == expected['NumPoints']
+    assert len(design['PPheights']) == 14
+    for mat in (matrix, expected['Matrix']):
+        # Demeaned columns.
+        assert_almost_equal(mat.mean(axis=0), 0, 6)
+        # Temporal derivatives orthogonal to their EVs.
+        for col in range(0, 8, 2):
+            corr = np.corrcoef(mat[:, col], mat[:, col + 1])[0, 1]
+            assert abs(corr) < 1e-3
+    # EV titles as keys for ev_files.
+    by_title = {title: ev_files[i + 1]
+                for i, title in enumerate(fsf.events)}
+    assert_array_equal(level1_design(fsf, by_title, confounds)['Matrix'],
+                       matrix)
+    # Without the derivatives or confounds.
+    fsf.set_fields({'deriv_yn{}'.format(i): False for i in range(1, 5)})
+    design = level1_design(fsf, ev_files)
+    assert design['Matrix'].shape == (222, 4)
+    assert_almost_equal(design['Matrix'], matrix[:, 0:8:2])
+    # Orthogonalization of EV 2 with respect to EV 1.
+    fsf.set_fields({'ortho2.1': '1'})
+    ortho = level1_design(fsf, ev_files)['Matrix']
+    assert_almost_equal(ortho[:, [0, 2, 3]], design['Matrix'][:, [0, 2, 3]])
+    assert abs(ortho[:, 0] @ ortho[:, 1]) < 1e-10
+    # Arrays mode gives the same orthogonalization.
+    a_fsf = loads(dumps(fsf), arrays=True)
+    assert_array_equal(level1_design(a_fsf, ev_files)['Matrix'], ortho)
+    with pytest.raises(ValueError):
+        level1_design(load(pjoin(DATA_DIR, 'one_sess_group.fsf')))
+
+
+def test_unconvolved(tmp_path):
+    # No convolution, no filtering; samples of boxcars, minus means.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    fsf.set_fields({'temphp_yn': False})
+    fsf.set_fields({'convolve{}'.format(i): 0 for i in range(1, 5)})
+    fsf.set_fields({'deriv_yn{}'.format(i): False for i in range(1, 5)})
+    events = np.array([[10, 4, 1], [40, 10, 2], [300, 0.5, -1]])
+    ev_fname = str(tmp_path / 'events.txt')
+    np.savetxt(ev_fname, events)
+    fsf.set_fields({'custom{}'.format(i): ev_fname for i in range(1, 5)})
+    design = level1_design(fsf)
+    times = np.arange(222) * 2. + 1
+    expected = np.zeros(222)
+    for onset, duration, amplitude in events:
+        expected[(times >= onset) & (times < onset + duration)] += amplitude
+    assert_almost_equal(design['Matrix'][:, 0], expected - expected.mean())
+    assert_almost_equal(design['PPheights'], [3] * 4)
+    # EV files override custom fields; 1 column format.
+    fsf.set_fields({'shape2': 2, 'shape3': 10})
+    design = level1_design(fsf, {2: np.arange(222)})
+    assert_almost_equal(design['Matrix'][:, 1], np.arange(222) - 110.5)
+    assert_array_equal(design['Matrix'][:, 2], 0)
+    fsf.set_fields({'shape4': 4})
+    with pytest.raises(ValueError):
+        level1_design(fsf)
+
+
+def test_convolved():
+    # Isolated event gives HRF shape at the sampled times.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    fsf.set_fields({'temphp_yn': False, 'shape2': 10, 'shape3': 10,
+                    'shape4': 10, 'deriv_yn1': False})
+    design = level1_design(fsf, {1: [[100, 0.05, 1]]}, slice_time=0)
+    hrf = kernel(3, 0.1)
+    expected = np.zeros(222)
+    expected[50:50 + len(hrf[::20])] = hrf[::20]
+    assert_almost_equal(design['Matrix'][:, 0], expected - expected.mean())
+
+
+def test_highpass():
+    basis = highpass_basis(100, 33)
+    assert basis.shape == (100, 8)
+    # Lines and slow drifts are removed.
+    assert_almost_equal(highpass_filter(np.ones((100, 1)), basis), 0)
+    assert_almost_equal(highpass_filter(np.arange(100.)[:, None], basis), 0)
+    slow = np.cos(np.linspace(0, 2 * np.pi, 100))[:, None]
+    assert np.abs(highpass_filter(slow, basis)).max() < 0.01
+    # High frequencies pass.
+    alternating = np.tile([1., -1], 50)[:, None]
+    assert_almost_equal(highpass_filter(alternating, basis)[30:70],
+                        alternating[30:70], 1)
+    # Short series.
+    assert highpass_basis(3, 0.1).shape == (3, 3)
+
+
+def test_basis_functions():
+    # FIR basis functions give one column per function, without derivatives.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    fsf.set_fields({'temphp_yn': False, 'shape3': 10, 'shape4': 10,
+                    'convolve1': 6, 'basisfnum1': 4, 'basisfwidth1': 16.,
+                    'convolve2': 0, 'deriv_yn2': False})
+    cache = KernelCache()
+    design = level1_design(fsf, {1: [[100, 4, 1]], 2: [[50, 2, 1]]},
+                           slice_time=0, cache=cache)
+    matrix = design['Matrix']
+    # 4 FIR columns, EV 2 without derivative, EVs 3 and 4 with derivatives.
+    assert matrix.shape == (222, 9)
+    # Event of the same length as the FIR bins gives peak of 1 at the end
+    # of each bin.
+    peaks = np.argmax(matrix[:, :4], axis=0)
+    assert_array_equal(peaks, [52, 54, 56, 58])
+    assert_almost_equal(np.ptp(matrix[:, :4], axis=0), 1, 1)
+    # Kernels come from the cache.
+    assert cache.cache_info().currsize > 0
+    level1_design(fsf, {1: [[100, 4, 1]], 2: [[50, 2, 1]]}, cache=cache)
+    assert cache.cache_info().hits > 0
+
+
+def test_level1_designs(tmp_path):
+    # Designs sharing timing files; files read in one batch.
+    fsf = load(pjoin(DATA_DIR, 'one_sess_level1.fsf'))
+    rng = np.random.RandomState(5)
+    fnames = []
+    for i in range(6):
+        fname = str(tmp_path / 'ev{}.txt'.format(i))
+        np.savetxt(fname, _random_events(rng))
+        fnames.append(fname)
+    fsfs = []
+    for i in range(3):
+        fsf = fsf.copy()
+        fsf.set_fields({'custom{}'.format(ev_no): fnames[(i + ev_no) % 6]
+                        for ev_no in range(1, 5)})
+        fsfs.append(fsf)
+    reader = EVReader()
+    designs = level1_designs(fsfs, reader=reader)
+    assert reader.cache_info().misses == 6
+    for fsf, design in zip(fsfs, designs):
+        assert_array_equal(design['Matrix'],
+                           level1_design(fsf, read_ev=EVReader())['Matrix'])
+    # Missing files raise error for design.
+    fsfs[1].set_fields({'custom2': str(tmp_path / 'missing.txt')})
+    with pytest.raises(OSError):
+        level1_designs(fsfs, reader=reader)
@@ -0,0 +1,109 @@
+""" Test matfile module
+"""
+
+import os
+from os.path import join as pjoin, dirname
+from glob import glob
+import shutil
+import asyncio
+from io import StringIO
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from fslutils.supporting import read_file
+from fslutils.featparser import mat_to_dict
+from fslutils.matfile import load_mapped, MappedMatrix, aload, load, save
+
+import pytest
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def test_load_mapped():
+    for fname in glob(pjoin(DATA_DIR, '*.mat')):
+        exp_dmat = mat_to_dict(read_file(fname))
+        dmat = load_mapped(fname)
+        assert set(dmat) == set(exp_dmat)
+        for key in ('NumWaves', 'NumPoints', 'PPheights'):
+            assert_array_equal(dmat[key], exp_dmat[key])
+        exp_matrix = exp_dmat['Matrix']
+        matrix = dmat['Matrix']
+        assert isinstance(matrix, MappedMatrix)
+        assert matrix._starts is None
+        assert matrix.shape == exp_matrix.shape
+        assert len(matrix) == len(exp_matrix)
+        assert_array_equal(np.asarray(matrix), exp_matrix)
+        n = len(matrix)
+        for key in (0, -1, n - 1, slice(None), slice(2, 5),
+                    slice(None, None, 3), slice(-4, None), slice(5, 2),
+                    [3, 1, 2], [],
+                    np.arange(n) > n // 2,
+                    (slice(1, 4), 1), (2, slice(0, 2)), (-1, -1),
+                    (slice(None), [1, 0])):
+            assert_array_equal(matrix[key], exp_matrix[key])
+        matrix.close()
+        # Reopens on demand
+        assert_array_equal(matrix[1:3], exp_matrix[1:3])
+        matrix.close()
+
+
+def test_load_mapped_errors(tmpdir):
+    header = '/NumWaves 2\n/NumPoints 3\n/PPheights 1 1\n\n/Matrix\n'
+    fname = str(tmpdir.join('design.mat'))
+    with open(fname, 'wt') as fobj:
+        fobj.write(header + '1 2\n\n3 4\n5 6')
+    dmat = load_mapped(fname)
+    # Blank lines ignored, no final newline OK.
+    assert_array_equal(dmat['Matrix'][1:], [[3, 4], [5, 6]])
+    dmat['Matrix'].close()
+    with open(fname, 'wt') as fobj:
+        fobj.write(header + '1 2\n3 4\n')
+    matrix = load_mapped(fname)['Matrix']
+    with pytest.raises(ValueError):
+        matrix[0]
+    matrix.close()
+    with open(fname, 'wt') as fobj:
+        fobj.write(header)
+    with pytest.raises(ValueError):
+        load_mapped(fname)['Matrix'][0]
+    with open(fname, 'wt') as fobj:
+        fobj.write('/NumWaves 2\n')
+    with pytest.raises(ValueError):
+        load_mapped(fname)
+
+
+def test_aload(tmpdir):
+    fname = pjoin(DATA_DIR, 'one_sess_level1.mat')
+    exp_dmat = mat_to_dict(read_file(fname))
+    feat_dir = pjoin(str(tmpdir), 'my.feat')
+    os.mkdir(feat_dir)
+    shutil.copy(fname, pjoin(feat_dir, 'design.mat'))
+    for path in (fname, feat_dir):
+        dmat = asyncio.run(aload(path))
+        assert_array_equal(dmat['Matrix'], exp_dmat['Matrix'])
+        assert dmat['NumWaves'] == 14
+
+
+def test_save(tmpdir):
+    out_dir = str(tmpdir)
+    for fname in glob(pjoin(DATA_DIR, '*.mat')):
+        contents = read_file(fname)
+        mat_dict = load(fname)
+        out_fname = pjoin(out_dir, 'out.mat')
+        save(mat_dict, out_fname)
+        assert read_file(out_fname) == contents
+        # Streaming from memory-mapped matrix
+        mapped = load_mapped(fname)
+        save(mapped, out_fname, chunk_rows=7)
+        assert read_file(out_fname) == contents
+        mapped['Matrix'].close()
+        sio = StringIO()
+        save(mat_dict['Matrix'], sio, ppheights=mat_dict['PPheights'])
+        assert sio.getvalue() == contents
+    # Array-like, FEAT directory
+    feat_dir = str(tmpdir.mkdir('analysis.feat'))
+    save([[1, 2], [3, 5]], feat_dir)
+    mat_dict = load(feat_dir)
+    assert_array_equal(mat_dict['Matrix'], [[1, 2], [3, 5]])
+    assert_array_equal(mat_dict['PPheights'], [2, 3])
@@ -1,7 +1,10 @@
 """ Test supporting module
 """
 
-from fslutils.supporting import Bunch, read_file
+from os.path import join as pjoin
+
+from fslutils.supporting import (Bunch, read_file, LRUCache, CacheInfo,
+                                 _file_identity)
 
 import pytest
 
@@ -33,3 +36,36 @@ def test_bunch():
         Bunch(dict(bunch_foo='something'))
     with pytest.raises(ValueError):
         bfoo.bunch_update(dict(bunch_foo='something'))
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    assert cache.get('a') is None
+    assert cache.put('a', 1) == 1
+    # Existing value kept.
+    assert cache.put('a', 2) == 1
+    assert cache.get('a') == 1
+    assert cache.cache_info() == CacheInfo(1, 1, 2, 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    # 'b' was least recently used.
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.cache_info() == CacheInfo(3, 2, 2, 2)
+    cache.maxsize = 0
+    cache.put('d', 4)
+    assert cache.cache_info().currsize == 0
+    cache.cache_clear()
+    assert cache.cache_info() == CacheInfo(0, 0, 0, 0)
+
+
+def test_file_identity(tmp_path):
+    fname = str(tmp_path / 'file.txt')
+    with open(fname, 'wt') as fobj:
+        fobj.write('one')
+    identity = _file_identity(fname)
+    assert identity == _file_identity(pjoin(str(tmp_path), '.', 'file.txt'))
+    with open(fname, 'wt') as fobj:
+        fobj.write('three')
+    assert _file_identity(fname) != identity
@@ -0,0 +1,97 @@
+""" Test parameter sweep generation
+"""
+
+import os
+from os.path import join as pjoin, dirname, isfile
+from glob import glob
+
+from numpy.testing import assert_array_equal
+
+import pytest
+
+from fslutils.fsf import (FSF, LazyFSF, load, loads, dumps,
+                          _numbered_index)
+from fslutils.sweep import grid, table, iter_variants, write_variants
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def test_grid_table():
+    assert grid({'smooth': [4, 6], 'tr': [2, 3]}) == [
+        {'smooth': 4, 'tr': 2}, {'smooth': 4, 'tr': 3},
+        {'smooth': 6, 'tr': 2}, {'smooth': 6, 'tr': 3}]
+    assert grid({}) == [{}]
+    assert table({'smooth': [4, 6], 'tr': [2, 3]}) == [
+        {'smooth': 4, 'tr': 2}, {'smooth': 6, 'tr': 3}]
+    with pytest.raises(ValueError):
+        table({'smooth': [4, 6], 'tr': [2]})
+
+
+def test_iter_variants():
+    template = load(pjoin(DATA_DIR, 'one_sess_group.fsf'))
+    evgs = template.evgs
+    overrides = grid({'smooth': [4.0, 6.0], 'z_thresh': [2.3, 3.1]})
+    overrides.append({'evg1.2': 99.0, 'feat_files': ['a.feat'],
+                      'new_field': 'value'})
+    variants = list(iter_variants(template, iter(overrides)))
+    assert len(variants) == 5
+    for variant, override in zip(variants, overrides):
+        assert isinstance(variant, FSF)
+        assert variant.contents is None
+        for name, value in override.items():
+            if name == 'feat_files':
+                assert variant.feat_files == value
+            else:
+                assert variant.fmri[name] == value
+        assert variant.fmri['outputdir'] == template.fmri['outputdir']
+        back = loads(dumps(variant))
+        assert back.fmri == dict(variant.fmri)
+    # Variants reuse the template index, updated for overrides.
+    for variant in variants:
+        assert variant._index == _numbered_index(variant.fmri)
+    assert variants[0]._index is template._index
+    assert variants[0].feat_files is template.feat_files
+    assert variants[4].evgs[0, 1] == 99
+    assert_array_equal(variants[0].evgs, evgs)
+    # Template unchanged
+    assert template.fmri['evg1.2'] == evgs[0, 1]
+    assert 'new_field' not in template.fmri
+    assert len(template.feat_files) == 24
+    # Lazy and arrays templates
+    lazy = LazyFSF(template.contents)
+    variant, = iter_variants(lazy, [{'smooth': 8.0}])
+    assert variant.fmri['smooth'] == 8
+    assert_array_equal(variant.evgs, evgs)
+    arr_template = FSF(template.contents, arrays=True)
+    variant, = iter_variants(arr_template, [{'smooth': 8.0}])
+    assert variant.evgs is arr_template.fmri_arrays['evg']
+    with pytest.raises(ValueError):
+        list(iter_variants(arr_template, [{'evg1.1': 2.0}]))
+
+
+def test_write_variants(tmpdir):
+    out_dir = str(tmpdir)
+    for fname in glob(pjoin(DATA_DIR, '*.fsf')):
+        for arrays in (False, True):
+            template = load(fname, arrays=arrays)
+            overrides = grid({'smooth': [4, 6.5], 'paradigm_hp': [60, 100]})
+            overrides.append({'feat_files': ['one', 'two'], 'tr': 0.5,
+                              'extra_yn': True})
+            pattern = pjoin(out_dir, 'sweep', '{index:03d}', 'design.fsf')
+            fnames = write_variants(template, overrides, pattern, workers=3)
+            assert fnames == [pattern.format(index=i)
+                              for i in range(len(overrides))]
+            variants = iter_variants(template, overrides)
+            for fname, variant in zip(fnames, variants):
+                fsf = load(fname, arrays=arrays)
+                assert fsf.fmri == dict(variant.fmri)
+                assert fsf.feat_files == variant.feat_files
+                assert_array_equal(fsf.evgs, template.evgs)
+    # Override values in filenames; existing directories.
+    os.mkdir(pjoin(out_dir, 's4'))
+    fnames = write_variants(template, [{'smooth': 4}, {'smooth': 5}],
+                            pjoin(out_dir, 's{smooth}'))
+    assert fnames == [pjoin(out_dir, 's4', 'design.fsf'),
+                      pjoin(out_dir, 's5')]
+    assert all(isfile(f) for f in fnames)
+    assert load(fnames[1]).fmri['smooth'] == 5
@@ -18,7 +18,8 @@ if 'setuptools' in sys.modules:
     extra_kwargs = dict(
         zip_safe=False,
         # Check dependencies also in .travis.yml file
-        requires=['numpy (>=1.8)'])
+        requires=['numpy (>=1.14)'],
+        python_requires='>=3.7')
 
 
 setup(name='fslutils',
@@ -31,6 +32,7 @@ setup(name='fslutils',
       maintainer_email='matthew.brett@gmail.com',
       url='http://github.com/matthew-brett/fslutils',
       packages=['fslutils',
+                'fslutils.benchmarks',
                 'fslutils.tests'],
       package_data = {'fslutils': [
           'tests/data/*',